@@ -47,6 +47,7 @@ import os
 from Tkinter import *
 from tkFileDialog   import askopenfilename, askdirectory, asksaveasfilename
 import tkMessageBox
+import tkFont
 import Pmw
 import Tkinter 
 import tarfile
@@ -58,7 +59,12 @@ import datetime
 from base64 import b64decode
 from random import sample # potentially useless
 from random import choice
-from numpy import sqrt
+from raccoon_engine import CPUCount, LigandPrepOptions, ConvertLigand, ConversionPool, PropertyCache, LigandTable, LigandFilter
+from raccoon_engine import CountMol2, Mol2Index, SplitMol2File
+from raccoon_engine import GetLibrary, IsLibraryFile, LibraryWriter, SplitLigandName, LigandExists, ReadLigand, MaterializeLigand
+from raccoon_engine import RaccoonError, VSSettings, VSGenerator, VSLogHeader, GetAtypes, CheckMaps, MapDirIndex
+from raccoon_engine import VinaBox
+from raccoon_engine import ReceptorPrepOptions, ConvertReceptor, RECEPTOR_REPAIRS
 
 try:
 	# MolKit stuff
@@ -277,7 +283,6 @@ StopImmediately = BooleanVar()
 StopImmediately.set(False)
 
 receptorFileList = []
-DirJournal = []
 
 # Ligand preparation options
 
@@ -324,10 +329,13 @@ AtypeList = {   # count  MW
 		'e'      : [ 1,   0   ], # always 1 by default
 		'd'      : [ 1,   0   ]  # always 1 by default
 		}
+AtypeWeights = dict([ (atype, AtypeList[atype][1]) for atype in AtypeList ]) # used by LigandProperties
+LigandCache = PropertyCache() # ligand properties saved in ~/.raccoon
 
 # The Great Book of Ligands
-LigandDictionary = {}
-# its general structure is:
+LigandDictionary = LigandTable()
+LigandFilterEngine = LigandFilter(LigandDictionary) # filters with cached masks
+# columnar table (see raccoon_engine.LigandTable), used as:
 # {'filename' : {
 #		"Atypes"	: list
 #		"TORSDOF"	: int
@@ -401,6 +409,10 @@ TORSDOFmax = IntVar()
 TORSDOFmax.set(32)
 FilterSet = StringVar()
 FilterSet.set("Default")
+# the preview counters follow any change of the filters
+for var in DoRejectATypes, HbDmin, HbDmax, HbAmin, HbAmax, MWmin, MWmax, NatMin, NatMax, TORSDOFmin, TORSDOFmax:
+	var.trace("w", lambda *args: PreviewFilters())
+FilterPreviewJob = [ None ] # pending preview update
 
 # Grid settings
 AutoGridBin = StringVar()
@@ -544,6 +556,8 @@ AttachFrag = BooleanVar()
 AttachFrag.set(False)
 LockTors = BooleanVar()
 LockTors.set(False)
+LigandWorkers = IntVar() # processes used for converting ligands
+LigandWorkers.set(CPUCount())
 
 LIGAND_SET = False # define if ligand filenames have been set
 
@@ -661,6 +675,12 @@ PBShowmanyruns = IntVar()
 PBShowmanyruns.set(1)
 TarFile = StringVar()
 TarFile.set('[disabled]')
+VinaModes = IntVar()
+VinaModes.set(9)
+VinaExhaustiveness = IntVar()
+VinaExhaustiveness.set(8)
+VinaCPU = IntVar()
+VinaCPU.set(1)
 
 # Load session defaults
 LoadLig = BooleanVar()
@@ -990,8 +1010,8 @@ def LoadLog(logname):
 				CacheMapPolicy.set("Make symbolic links [ save disk space ]")
 				if DEBUG: print "	set map policy to LINKS"
 	
-		# load GPF if needed
-		if MapSource.get() <= 1:
+		# load GPF if needed (with Vina it defines the search space)
+		if MapSource.get() <= 1 or "Vina search space" in mode:
 			GPFcontent.config(state = NORMAL)
 			GPFcontent.delete(1.0, END) 
 			for line in logfile:
@@ -1017,12 +1037,29 @@ in the log:\n\n%s\n\nSkip the binary specification and continue or cancel log lo
 		# Load the DPF setup
 	
 		# identify the docking mode
+		mode = ""
 		for line in logfile:
 			if "Docking mode :" in line:
-				line = line.split(">")[1]
-				mode = line.split("<")[0]
+				if ">" in line:
+					line = line.split(">")[1]
+					mode = line.split("<")[0]
+				elif "AutoDock Vina" in line: # logs without the >tag<
+					mode = "AutoDock Vina"
 				break
 	
+		if mode == "AutoDock Vina":
+			# the Vina target, with the options of the config (VINA> lines)
+			options = { "num_modes" : VinaModes, "exhaustiveness" : VinaExhaustiveness, "cpu" : VinaCPU }
+			for line in logfile:
+				if line[0:5] == "VINA>" and "=" in line:
+					key, value = [ word.strip() for word in line[5:].split("=", 1) ]
+					if options.has_key(key):
+						try:
+							options[key].set(int(value))
+						except ValueError:
+							if DEBUG: print "LOAD_SESSION> unreadable Vina option: %s" % line
+			SystemButton3.invoke()
+
 		if mode == "generated from template" in mode:
 			docking_set.set("From template...")
 			docking_setup_interface(None)
@@ -1193,10 +1230,7 @@ def countLigands():
 		return
 
 	# start counting...
-	ligand_conscription = 0
-	for item in LigandDictionary.keys():
-		if LigandDictionary[item]["accepted"]:
-			ligand_conscription += 1
+	ligand_conscription = LigandDictionary.count_accepted()
 
 	# choices
 	if ligand_conscription < 1:
@@ -1219,30 +1253,33 @@ def countLigands():
 		return
 
 
-def openLigand(ligFile = None): # Now unified loader for all the supported formats
+def openLigand(ligFile = None, report = True): # Now unified loader for all the supported formats
 	# The input is a list
 	got_some = False
 	if not ligFile:
 		ligFile = askopenfilename(parent = root, title = "Select one or more PDBQT, PDB or (multi)MOL2", filetypes=[("Ligand PDBQT", "*.pdbqt"), ("PDB", "*.pdb"), ("Mol2", "*.mol2"), ("Any file type...", "*")], multiple = 1)
 	if ligFile:
 		# now any filter can be applied in the openfilename interface ("*" included)
-		pdb_list, pdbqt_list, mol2_list = [], [], []
+		pdb_list, pdbqt_list, mol2_list, library_list = [], [], [], []
 		for file in ligFile:
+			if not os.path.isfile(file) and SplitLigandName(file): # ligand from a library (i.e. lists, logs)
+				library_list.append(file)
+				continue
 			if file.split(".")[-1] == "pdb": pdb_list.append(file)
 			if file.split(".")[-1] == "pdbqt": pdbqt_list.append(file)
 			if file.split(".")[-1] == "mol2": mol2_list.append(file)
 		# PDB
-		for filename in pdb_list:
-			output_file = filename[:-3]+"pdbqt" # path/filename.pdbqt
-			if genPDBQT(filename, output_file):
+		if pdb_list:
+			DisableInterface()
+			failed = genPDBQTlist([ (filename, filename[:-3]+"pdbqt") for filename in pdb_list ]) # path/filename.pdbqt
+			EnableInterface()
+			if len(failed) < len(pdb_list):
 				got_some = True
-				LigandRegistration(output_file)
 				# Re-check map cache folder if is defined
 				if mapDir and MapSource.get() == 2:
-					openDirMaps(mapDir)
-			else:
-				tkMessageBox.showwarning("PDB Error", ("There is a problem in the input, please check the ligand:\n%s" % filename ))
-				break
+					opendirMaps(mapDir)
+			if failed:
+				tkMessageBox.showwarning("PDB Error", ("There is a problem in the input, please check the ligand(s):\n%s" % "\n".join(failed[:10]) ))
 		# MOL2
 		for filename in mol2_list:
 			openMultiMol2(filename)
@@ -1252,16 +1289,21 @@ def openLigand(ligFile = None): # Now unified loader for all the supported forma
 			if list_of_accepted:
 				got_some = True
 				for ligand in list_of_accepted:
-					LigandRegistration(ligand)
+					RegisterPDBQT(ligand)
+		# PDBQT libraries
+		for ligand in library_list:
+			if LigandExists(ligand):
+				got_some = True
+				LigandRegistration(ligand)
 
 	# Ligands will be filtered every time (at least because of the TDOF)
-	if got_some:
-		InfoMessage.set( "Ligands imported successfully.")
+	if got_some and report:
+		InfoMessage.set( "Ligands imported successfully.  "+LigandCacheReport())
 	FilterLigands(True)
 	countLigands()
 	# Re-check map cache folder if is defined
 	if mapDir and MapSource.get() == 2:
-		openDirMaps(mapDir)
+		opendirMaps(mapDir)
 	TheCheck()
 
 def openMultiMol2(ligFile = None):
@@ -1290,72 +1332,48 @@ def openMultiMol2(ligFile = None):
 				WARNING = "\n\n[ Warning: this will take some time ]"
 			else:
 				WARNING = ""
-			if not tkMessageBox.askokcancel('Multi-structure MOL2 file',('A multi-structure file MOL2 containing %d ligands was found. Proceed to split and convert it to PDBQT?%s' % (count_mols, WARNING))):
+			if not tkMessageBox.askokcancel('Multi-structure MOL2 file',('A multi-structure file MOL2 containing %d ligands was found. Proceed to convert it to a PDBQT library?%s' % (count_mols, WARNING))):
 				return
-			output_dir = askdirectory(parent = root, title = ("MOL2: Split and convert %d molecules in the following dir..."% count_mols) , initialdir = os.path.dirname(ligFile))
+			output_dir = askdirectory(parent = root, title = ("MOL2: Convert %d molecules in a PDBQT library in the following dir..."% count_mols) , initialdir = os.path.dirname(ligFile))
 			if not output_dir:
-				tkMessageBox.showinfo(title="MOL2 splitting", message =( "The splitting process of %s has been cancelled by the user" % ligFile))
+				tkMessageBox.showinfo(title="MOL2 conversion", message =( "The conversion process of %s has been cancelled by the user" % ligFile))
 				return
 			
 			name = os.path.basename(ligFile)[:-5] # get rid of path and extension ".mol2" (stem)
 			
-			outputDirMOL2 = output_dir+os.sep+name+os.sep+"mol2"
-			outputDirPDBQT = output_dir+os.sep+name+os.sep+"pdbqt"
-			# attempt to create the Mol2 output dir
-			try:
-				if not os.path.exists(outputDirMOL2):
-					os.makedirs(outputDirMOL2, 0755)
-			except:
-				tkMessageBox.showerror("Error!", ("I can't create the output dir:\n%s" % outputDirMol2))
-				if DEBUG: print "ERROR> mol2 import process died"
-				# break
-
+			# the molecules are not split in single files anymore: they are
+			# read from the MOL2 through its offset index and the PDBQT's
+			# are collected in a single library (with its own index)
+			outputLibrary = output_dir+os.sep+name+".pdbqt"
+			if os.path.exists(outputLibrary) and not tkMessageBox.askokcancel('PDBQT library', ('The library file\n%s\nis already present.\n\nOverwrite it?' % outputLibrary)):
+				return
 
-			# split the mol2 files
+			processed = 0
 			DisableInterface()
-			to_be_imported = SplitMol2(ligFile, outputDirMOL2)
-			if to_be_imported:
-				if DEBUG: print "i'm gong to import", to_be_imported
-				# attempt to create the PDBQT output dir
-				try:
-					if not os.path.exists(outputDirPDBQT):
-						os.makedirs(outputDirPDBQT, 0755)
-				except:
-					tkMessageBox.showerror("Error!", ("I can't create the output dir:\n%s" % outputDirPDBQT))
-					if DEBUG: print "ERROR> pdbqt import process died"
-					#break
-				message = Message(text = "I'm going to convert"+str(count_mols)+"molecules")
-				processed = 0
-				for ligand in to_be_imported:
-					name = os.path.basename(ligand)[:-5]
-					output_file = outputDirPDBQT+os.sep+name+".pdbqt" # path/filename.pdbqt
-					InfoMessage.set(("Generating PDBQT for %s ...") % name)
-					root.update()
-					if genPDBQT( ligand, output_file ):
-						LigandRegistration(output_file)
-						processed += 1
-					else:
-						tkMessageBox.showerror("Error!", ("Some problem occurred in converting the file:\n%s\n Import process aborted." % ligand))
-						break
+			try:
+				failed = genPDBQTlibrary(ligFile, Mol2Index(ligFile), outputLibrary)
+				processed = count_mols - len(failed)
+				if failed:
+					tkMessageBox.showerror("Error!", ("Some problem occurred in converting %d molecule(s):\n%s" % (len(failed), "\n".join(failed[:10]))))
+			except:
+				tkMessageBox.showerror("Error!", ("I can't write the PDBQT library:\n%s" % outputLibrary))
+				if DEBUG: print "ERROR> pdbqt import process died"
 			EnableInterface()
 			if processed == count_mols:
 				# Re-check map cache folder if is defined
 				if mapDir and MapSource.get() == 2:
-					openDirMaps(mapDir)
+					opendirMaps(mapDir)
 				tkMessageBox.showinfo(title = "MultiMol2-to-PDBQT", message = ("%d ligands successfully imported from\n%s" % (count_mols, ligFile)))
 			else:
 				tkMessageBox.showwarning(title = ligFile, message = ("Some problem occurred.\n %d out of %d structures accepted." % (processed, count_mols) )  )
 				
 
 def CheckMultiMol2(filename):
-	# simple function for checking the number oou
+	# simple function for checking the number of
 	# multiple structures in the mol2
-	count = 0
+	# (the offset index is reused by SplitMol2)
 	try:
-		multimol2 = open(filename, 'r')
-		for line in multimol2:
-			if "@<TRIPOS>MOLECULE" in line:
-				count += 1
+		count = CountMol2(filename)
 		if count == 0:
 			return False
 		else:
@@ -1375,9 +1393,7 @@ def SplitMol2 (filename = None, outdir = None):
 		return
 	# end of utility mode
 
-	buffer = []
 	count = 0
-	zinc_found = False
 	splitted_mols = []
 	total = CheckMultiMol2(filename)
 	# Also this is for using the splitting function as an utility
@@ -1388,52 +1404,17 @@ def SplitMol2 (filename = None, outdir = None):
 		return
 	# end of utility mode
 
-	multimol2 = open(filename, 'r') # the input
-	name = os.path.basename(filename)[:-5] # needed for the stem of the output files
 	try:
-		if not os.path.exists(outdir):
-			os.makedirs(outdir, 0755)
 		InfoMessage.set(("Splitting %s ") % os.path.basename(filename) )
 		root.update()
-		for line in multimol2.readlines():
-			if "@<TRIPOS>MOLECULE" in line:
-				if len(buffer) > 1: # INCREASED FROM 0
-					count += 1
-					number = "%06d" % count
-
-					if zinc_found:
-						filename = outdir+os.sep+zinc_id+".mol2"
-					else:
-						filename = outdir+os.sep+name+"_"+str(number)+".mol2"
-
-					output = open(filename, 'w')
-					for item in buffer:
-						print >>output, item[:-1]
-					output.close()
-					del buffer[:]
-					splitted_mols.append(filename)
-					zinc_found = False
-					buffer.append(line)
-			else:
-				buffer.append(line)
-			if "ZINC" in line[0:5]:
-				if DEBUG: print "found zinc name |%s|" % line
-				zinc_id = line.split()[0]
-				zinc_found = True
-		if len(buffer) > 0: # Flush the remaining buffer...
+		# molecules are copied one by one from the offset index,
+		# the library is never loaded in memory
+		for mol in SplitMol2File(filename, outdir, Mol2Index(filename)):
+			splitted_mols.append(mol)
 			count += 1
-			number = "%06d" % count
-			if zinc_found:
-				filename = outdir+os.sep+zinc_id+".mol2"
-			else:
-				filename = outdir+os.sep+name+"_"+str(number)+".mol2"
-			output = open(filename, 'w')
-			for item in buffer:
-				print >>output, item[:-1]
-			output.close()
-			zinc_found = False
-			splitted_mols.append(filename)
-			del buffer[:]
+			if count % 100 == 0:
+				InfoMessage.set(("Splitting %s [ %d | %d ]") % (os.path.basename(filename), count, total) )
+				root.update()
 		if DEBUG: print "splitted", splitted_mols
 		if utility_mode:
 				tkMessageBox.showinfo(title="MOL2 splitting", message =( "%d molecules have been successfully created in:\n %s" % (count, outdir)))
@@ -1445,113 +1426,93 @@ def SplitMol2 (filename = None, outdir = None):
 		return False
 	if DEBUG : print count, "molecules processed"
 		
+def GetLigandPrepOptions():
+	# snapshot of the PDBQT generation options: the same
+	# dictionary is used for every ligand (and every worker)
+	return LigandPrepOptions(repairs = Repair.get(), charges_to_add = ChargeSet.get(),
+				cleanup = Cleanup.get(), backbone = BackboneRotatable.get(),
+				amide = AmideRotatable.get(), guanidinium = GuanidiniumRotatable.get(),
+				largest_fragment = LargestFrag.get(), attach_fragments = AttachFrag.get(),
+				lock_torsions = LockTors.get())
+
 def genPDBQT(infile, outfile):
 	DisableInterface()
-	# any resemblance with the prepare_ligand script is accidental
-	#
-	# generate a pdbqt from a directory containing the splitted mol2 
-	#
-    # optional parameters
-
-	# PrepareLigand options defaults
-	verbose = None
-	add_bonds = False
-    #-A: repairs to make: add bonds and/or hydrogens
-	repairs = Repair.get()
-    #-C  default: add gasteiger charges 
-	charges_to_add = ChargeSet.get()
-    #-p preserve charges on specific atom types
-	preserve_charge_types=''
-    #-U: cleanup by merging nphs_lps, nphs, lps
-	cleanup  = Cleanup.get()
-    #-B named rotatable bond type(s) to allow to rotate
-	
-	# TODO strip the code doing the incremental addition of options, 'cause most
-	# likely it uses a split call internally (by Ruth?)
-	SELECTED_ALLOWED_BONDS = ""
-	if BackboneRotatable:
-		SELECTED_ALLOWED_BONDS += "backbone"
-	if AmideRotatable:
-		if SELECTED_ALLOWED_BONDS:
-			SELECTED_ALLOWED_BONDS += "_amide"
-		else:
-			SELECTED_ALLOWED_BONDS += "amide"
-	if GuanidiniumRotatable:
-		if SELECTED_ALLOWED_BONDS:
-			SELECTED_ALLOWED_BONDS += "guanidinium"
-		else:
-			SELECTED_ALLOWED_BONDS += "_guanidinium"
-	allowed_bonds = SELECTED_ALLOWED_BONDS
-    #-r  root
-	root = 'auto'
-    #-o outputfilename
-	outputfilename = outfile # GOOD
-    #-F check_for_fragments
-	check_for_fragments = LargestFrag.get()
-    #-I bonds_to_inactivate
-	bonds_to_inactivate = ""
-    #-Z inactivate_all_torsions
-	inactivate_all_torsions = LockTors.get()
-    #-g attach_nonbonded_fragments
-	attach_nonbonded_fragments = AttachFrag.get()
-    #-m mode 
-	mode = 'automatic'
-    #-d dictionary
-	dict = None
-
+	# generate a pdbqt from a single structure
+	result = ConvertLigand(infile, outfile, GetLigandPrepOptions())
+	if result:
+		InfoMessage.set("%s converted to PDBQT" % os.path.basename(infile))
+		nb.update() # TODO Update the window with the message... but not the ROOT!
+	elif DEBUG: print "ERROR IN THE EXITCODE!"
+	EnableInterface()
+	return result
 
+def genPDBQTlist(jobs):
+	# INPUT  : list of (input structure, output pdbqt) pairs
+	# OUTPUT : list of input files that failed
+	# EXTRA  : the conversion is performed by LigandWorkers processes,
+	#          and the ligands are registered as soon as they are ready
 	try:
-		mols = Read(infile)
-		mol = mols[0]
+		workers = LigandWorkers.get()
 	except:
-		return False
-	if len(mols) > 1:
-		# put here the filtering
-		ctr +=1
-		if len(m.allAtoms) > len(mol.allAtoms):
-			mol = m
-
-	coord_dict = {}
-	for atom in mol.allAtoms: coord_dict[atom] = atom.coords
-	mol.buildBondsByDistance()
-	if charges_to_add is not None:
-		preserved = {}
-		preserved_types = preserve_charge_types.split(',')
-		for type in preserved_types:
-			if not len(type): continue
-			ats = mol.allAtoms.get(lambda x: x.autodock_element == type)
-			for a in ats:
-				if a.chageSet is not None:
-					preserved[a] = [a.chargeSet, a.charge]
-	LPO = AD4LigandPreparation(mol, mode, repairs, charges_to_add, 
-                          cleanup, allowed_bonds, root, 
-                          outputfilename=outputfilename,
-                          dict=dict, check_for_fragments=check_for_fragments,
-                          bonds_to_inactivate=bonds_to_inactivate, 
-                          inactivate_all_torsions=inactivate_all_torsions,
-                          attach_nonbonded_fragments=attach_nonbonded_fragments)
-	if charges_to_add is not None:
-		# restore the previous charges
-		for atom, chargeList in preserved.items():
-			atom._charges[chargeList[0]] = chargeList[1]
-			atom.chargeSet = chargeList[0]
-	bad_list = []
-	for a in mol.allAtoms:
-		if a.coords!=coord_dict[a]: bad_list.append(a)
-	if len(bad_list):
-		if DEBUG:
-			print len(bad_list), ' atom coordinates changed!'    
-			for a in bad_list:
-				print a.name, ":", coord_dict[a], ' -> ', a.coords
-	if mol.returnCode is not 0:
-		if DEBUG: print "ERROR IN THE EXITCODE!"
-		EnableInterface()
-		return False
+		workers = 1
+	converter = ConversionPool(GetLigandPrepOptions(), workers = workers)
+	total = len(jobs)
+	for result in converter.run(jobs):
+		if result:
+			infile, outfile, success, error = result
+			if success:
+				LigandRegistration(outfile)
+			elif DEBUG: print "genPDBQTlist> %s : %s" % (infile, error)
+			InfoMessage.set(("Generating PDBQT  [ %d | %d ]  %.1f ligands/s  ( %d failed )" % \
+					(converter.done + len(converter.failed), total, converter.rate(), len(converter.failed))))
+		root.update()
+	if DEBUG: print "genPDBQTlist> %d converted, %d failed (%.1f ligands/s)" % (converter.done, len(converter.failed), converter.rate())
+	return converter.failed
+
+def genPDBQTlibrary(library, records, output):
+	# INPUT  : multi-MOL2 library, (name, offset, length) of all its molecules (Mol2Index), output PDBQT library
+	# OUTPUT : list of the molecule names that failed
+	# EXTRA  : the ligands are registered with their library name
+	#          (i.e. "output/name.pdbqt", see LibraryLigand)
+	try:
+		workers = LigandWorkers.get()
+	except:
+		workers = 1
+	converter = ConversionPool(GetLigandPrepOptions(), workers = workers)
+	writer = LibraryWriter(output)
+	total = CountMol2(library)
+	try:
+		for result in converter.run_library(library, records):
+			if result:
+				name, text, success, error = result
+				if success:
+					LigandRegistration(writer.add(name, text))
+				elif DEBUG: print "genPDBQTlibrary> %s : %s" % (name, error)
+				InfoMessage.set(("Generating PDBQT  [ %d | %d ]  %.1f ligands/s  ( %d failed )" % \
+						(converter.done + len(converter.failed), total, converter.rate(), len(converter.failed))))
+			root.update()
+	finally:
+		writer.close()
+	LigandCache.refresh(output) # the ligands were cached while the library was written
+	return converter.failed
+
+def RegisterPDBQT(filename):
+	# register a PDBQT ligand or all the ligands of a multi-PDBQT library
+	if IsLibraryFile(filename):
+		for ligand in GetLibrary(filename).paths():
+			LigandRegistration(ligand)
 	else:
-		InfoMessage.set("%s converted to PDBQT" % os.path.basename(infile))
-		nb.update() # TODO Update the window with the message... but not the ROOT!
-		EnableInterface()
-		return True
+		LigandRegistration(filename)
+
+def LigandCacheReport():
+	# save the property cache and summarize its usage for the last import
+	LigandCache.commit()
+	hits, misses, invalidated = LigandCache.stats()
+	LigandCache.reset()
+	if DEBUG: print "LigandCache> %d hits, %d misses, %d invalidated" % (hits, misses, invalidated)
+	if hits + misses + invalidated:
+		return "[ cache : %d hits | %d misses | %d invalidated ]" % (hits, misses, invalidated)
+	return ""
 
 def LigandRegistration(filename):
 	# INPUT		: pdbqt file
@@ -1559,70 +1520,30 @@ def LigandRegistration(filename):
 	# EXTRA		: append the ligand properties to the Great Book of Ligands
 	# 			  update the list of total atom types considered (for caching map)
 
-	file = open(filename, 'r')
-	ligand = file.readlines()
-	file.close()
-	current_atypes = []
-	BAD_ATOM_TYPE = False
-	MW  = 0
-	HbD = 0
-	HbA = 0
-	Nat = 0
-	status = True
-	
-	hbd_h = []
-	hbd_candidate = []
-
-	# Calculate all the properties
-	for line in ligand:
-		if 'TORSDOF' in line:
-			TORSDOF = int(line.split()[1])
-		if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
-			# Nat += 1 # Consider to remove Hydrogens? (search on PubMed)
-			atype = line.split()[-1]
-			if atype not in current_atypes:
-				current_atypes.append(atype)
-			# Hb acceptor
-			if atype == "OA" or atype == "NA" or atype == "SA":
-				HbA += 1
-			# Hb donor preparation
-			if atype == "HD":
-				#capture the hydrogens that could be bond to the Hb donor...
-				hbd_h.append(line)
-			else:
-				# count heavy atoms
-				Nat += 1
-
-			if atype == "N" or atype == "O" or atype == "OA" or atype == "NA":
-				hbd_candidate.append(line)
-			try:
-				MW += AtypeList[atype][1] # add the atomic weight to the total MW
-			except:
-				MW += 10000 # check this if it's reasonable
-				BAD_ATOM_TYPE = True
-				status = False # non-standard atom types are rejected by default
-	# identify HBD by checking if N/O's are bound to H's
-	for atom in hbd_candidate:
-		for hydrogen in hbd_h:
-			if dist(atom, hydrogen) <= 1.1:
-				HbD += 1
-				break
-	if DEBUG: print "I've found %s HBD"% HbD
+	# all the coordinates are parsed once and the H-bond donors
+	# are found with a (vectorized) distance matrix
+	# (unchanged ligands are taken from the property cache)
+	properties = LigandCache.get(filename, AtypeWeights) # plain file or library
+	current_atypes = properties["Atypes"]
+	BAD_ATOM_TYPE = properties["NotStdAT"]
+	status = not BAD_ATOM_TYPE # non-standard atom types are rejected by default
+	if DEBUG: print "I've found %s HBD"% properties["HbD"]
 
 	# Insert the ligand in the Great Book of Ligands
 	if not LigandDictionary.has_key(filename):
 		# ligand is registered with properties
 		LigandDictionary[filename] = {
 		"Atypes"	: current_atypes,
-		"TORSDOF"	: TORSDOF,
-		"HbD"		: HbD,
-		"HbA"		: HbA,
-		"MW"		: MW,
-		"Nat"		: Nat,
+		"TORSDOF"	: properties["TORSDOF"],
+		"HbD"		: properties["HbD"],
+		"HbA"		: properties["HbA"],
+		"MW"		: properties["MW"],
+		"Nat"		: properties["Nat"],
 		"NotStdAT"	: BAD_ATOM_TYPE,
+		"NDIHE"		: properties["NDIHE"],
 		"accepted"	: status }
 		
-		LigandScrolledListBox.insert('end', filename)
+		LigandList.refresh()
 		if not BAD_ATOM_TYPE:
 			for atype in current_atypes:
 				AtypeList[atype][0] += 1  # increment the count for this atom type
@@ -1635,24 +1556,6 @@ def LigandRegistration(filename):
 		print "#### Atom type-DICTIONARY ####"
 
 
-def dist(firstline, secondline):  
-	# INFO   : calculate the atomic distance between two PDB atom lines
-	# INPUT  : two pdb lines
-	# OUTPUT : a pdb line
-	coord1=[]
-	coord2=[]
-	temp=firstline[28:56]
-	coord1=temp.split()
-	temp=secondline[28:56]
-	coord2=temp.split()
-	# floating the strings
-	for index in range(len(coord1)):
-		coord1[index]=float(coord1[index])
-		coord2[index]=float(coord2[index])
-	measure=sqrt((coord1[0]-coord2[0])**2+(coord1[1]-coord2[1])**2+(coord1[2]-coord2[2])**2)
-	return measure
-
-
 def UpdateATDict(file_list):
 	"""
 	input:		list of PDBQT filenames to be excluded
@@ -1683,22 +1586,23 @@ def openLigandDir(ligDir = None):
 		ligFiles = glob.glob(os.path.join(ligDir, "*.pdbqt"))            
 		if ligFiles:
 			for item in checkPDBQTligList(ligFiles):
-				LigandRegistration(item)
+				RegisterPDBQT(item)
 		# PDB
 		ligFiles = glob.glob(os.path.join(ligDir, "*.pdb"))
 		if ligFiles:
-			openLigand(ligFiles)
+			openLigand(ligFiles, report = False)
 		# MOL2
 		ligFiles = glob.glob(os.path.join(ligDir, "*.mol2"))
 		if ligFiles:
-	 		openLigand(ligFiles)
+	 		openLigand(ligFiles, report = False)
 		# Re-check map cache folder if is defined
 		if mapDir and MapSource.get() == 2:
-			openDirMaps(mapDir)
+			opendirMaps(mapDir)
 		# Ligands will be filtered every time (at least because of the TDOF)
 		FilterLigands(True)
 		countLigands()
 		TheCheck()
+		InfoMessage.set( "Ligands imported successfully.  "+LigandCacheReport())
 
 def openLigandDirRecursive():
 	pdbqt_ligandlist = []
@@ -1734,32 +1638,29 @@ def openLigandDirRecursive():
 		# PDBQT 
 		if count_pdbqt:
 			for item in checkPDBQTligList(pdbqt_ligandlist):
-				LigandRegistration(item)
+				RegisterPDBQT(item)
 		# MOL2
 		if count_mol2:
-	 		openLigand(mol2_ligandlist)
+	 		openLigand(mol2_ligandlist, report = False)
 		# PDB
 		if count_pdb:
-			openLigand(pdb_ligandlist)
+			openLigand(pdb_ligandlist, report = False)
 		# Re-check map cache folder if is defined
 		if mapDir and MapSource.get() == 2:
-			openDirMaps(mapDir)
+			opendirMaps(mapDir)
 		# Ligands will be filtered every time (at least because of the TDOF)
 		FilterLigands(True)
 		countLigands()
 		TheCheck()
+		InfoMessage.set( "Ligands imported successfully.  "+LigandCacheReport())
 
 def removeLigand():
-	ligand_index = LigandScrolledListBox.curselection() # position of ligands in the list...
-	ligand_list = []
-	for item in ligand_index:
-		# update the list of ligands to be removed from the Great Book of Ligands
-		ligand_list.append(LigandScrolledListBox.get(item))
-		# remove the ligands from the visualized list
-		LigandScrolledListBox.delete(item)
+	# ligands to be removed from the Great Book of Ligands
+	ligand_list = LigandList.selection()
 	UpdateATDict(ligand_list)
-	for ligand in ligand_list:
-		del LigandDictionary[ligand]
+	LigandDictionary.remove(ligand_list)
+	LigandList.clear_selection()
+	LigandList.refresh()
 	countLigands()
 	FilterLigands(True)
 	TheCheck()
@@ -1778,10 +1679,10 @@ def removeReceptor():
 def removeAllLigands():
 	if len(LigandDictionary) > 1 and not tkMessageBox.askokcancel('Delete all the ligands','Do you really want to\nremove all the ligands\nfrom the list?'):
 		return
-	LigandScrolledListBox.delete(0, END) 
+	LigandList.clear_selection()
 	# Buy a new Great Book of Ligands
-	for item in LigandDictionary.keys():
-		del LigandDictionary[item]
+	LigandDictionary.clear()
+	LigandList.refresh()
 	countLigands()
 	clearATDict()
 	TheCheck()
@@ -1934,6 +1835,7 @@ def DefaultLigOptions():
 	LockTors.set(False)
 	LargestFrag.set(False)
 	AttachFrag.set(False)
+	LigandWorkers.set(CPUCount())
 
 def LigandImportOptions(): # Options for non-PDBQT files only
 	try:
@@ -1984,6 +1886,12 @@ def LigandImportOptions(): # Options for non-PDBQT files only
 		Checkbutton(FragmentFrame.interior(), text = "Attach non-bonded fragments", variable = AttachFrag, indicatoron = False).grid(row = 1 , column = 1, sticky = W)
 		FragmentFrame.grid(row = 6, column = 0,  padx = 10, pady = 10, sticky = W, columnspan = 2)
 
+		WorkersFrame = Pmw.Group(LigandOptionsWin, tag_text = "Conversion")
+		Label(WorkersFrame.interior(), text = "Parallel processes ").grid(row = 0, column = 0, sticky = W)
+		Entry(WorkersFrame.interior(), textvariable = LigandWorkers, width = 4).grid(row = 0, column = 1, sticky = W)
+		Label(WorkersFrame.interior(), text = " ( %d CPU available )" % CPUCount()).grid(row = 0, column = 2, sticky = W)
+		WorkersFrame.grid(row = 7, column = 0,  padx = 10, pady = 10, sticky = W, columnspan = 2)
+
 		Tkinter.Button(LigandOptionsWin, text="OK", command = LigandOptionsWin.destroy, width = 50 ).grid(row = 9, column = 0, sticky = S, columnspan = 2, pady = 10, padx = 10)
 		Tkinter.Button(LigandOptionsWin, text="Set defaults", command = DefaultLigOptions, width = 50).grid(row = 1, column = 0, columnspan = 3, sticky = S, pady = 10, padx = 10)
 
@@ -1996,18 +1904,7 @@ def LigandFilterOptions(): # Filtering files
 		LigandFilterWin = Toplevel(root)
 		LigandFilterWin.title("Ligand filters")
 		LigandFilterWin.winfo_toplevel().resizable(NO,NO)
-		rejected = 0
-		total = len(LigandDictionary.keys())
-		for item in LigandDictionary.keys():
-			if not LigandDictionary[item]["accepted"]:
-				rejected += 1
-		accepted = total - rejected
-		msg = "Total number of ligands: %12s" % str(total)
-		TotalNumberLigandsMsg.set(msg)
-		msg = "Accepted ligands: %12s" % str(accepted)
-		TotAcceptedLigandsMsg.set(msg)
-		msg = "Rejected ligands: %12s" % str(rejected)
-		TotRejectedLigandsMsg.set(msg)
+		SetFilterPreview(LigandDictionary.count_accepted())
 
 		# Preset menu
 		Label(LigandFilterWin, text = "Filter presets :").grid(row = 0, column = 0, columnspan = 1, sticky = W)
@@ -2159,64 +2056,57 @@ def FilteringDefaults(param = None):
 		DoRejectATypes.set(True)
 
 
-def FilterLigands(seriously):
-	accepted_ligands = []
-	rejected_ligands = []
+def GetFilterRanges():
+	# OUTPUT : { property : (min, max) } or None if some value is not valid (yet)
+	try:
+		return {	"HbA"		: (HbAmin.get(), HbAmax.get()),
+				"HbD"		: (HbDmin.get(), HbDmax.get()),
+				"TORSDOF"	: (TORSDOFmin.get(), TORSDOFmax.get()),
+				"MW"		: (MWmin.get(), MWmax.get()),
+				"Nat"		: (NatMin.get(), NatMax.get()) }
+	except (ValueError, TclError):
+		return None
+
+def SetFilterPreview(accepted):
+	total = len(LigandDictionary)
+	rejected = total - accepted
+	msg = "Total number of ligands: %12s" % str(total)
+	TotalNumberLigandsMsg.set(msg)
+	msg = "Accepted ligands: %12s" % str(accepted)
+	TotAcceptedLigandsMsg.set(msg)
+	msg = "Rejected ligands: %12s" % str(rejected)
+	TotRejectedLigandsMsg.set(msg)
+
+def PreviewFilters(delay = 100):
+	# live preview: the counters are updated shortly after the last change
+	# (while typing, values that are not valid yet are ignored)
+	if FilterPreviewJob[0]:
+		root.after_cancel(FilterPreviewJob[0])
+	FilterPreviewJob[0] = root.after(delay, UpdateFilterPreview)
+
+def UpdateFilterPreview():
+	FilterPreviewJob[0] = None
+	ranges = GetFilterRanges()
+	if ranges is None:
+		return
+	# only the criteria that changed are evaluated again
+	SetFilterPreview(LigandFilterEngine.count(ranges, reject_nonstd = DoRejectATypes.get()))
 
+def FilterLigands(seriously):
 	verbose = False
 	
 	# VALIDATE INPUT
 	if CheckLigFilterOptions():
-		for lig in LigandDictionary.keys():
-			lig_hba = LigandDictionary[lig]["HbA"]
-			lig_hbd = LigandDictionary[lig]["HbD"]
-			lig_tors = LigandDictionary[lig]["TORSDOF"]
-			lig_mw = LigandDictionary[lig]["MW"]
-			lig_nat = LigandDictionary[lig]["Nat"]
-			lig_notstdat = LigandDictionary[lig]["NotStdAT"]
-			if lig_notstdat and DoRejectATypes:
-				rejected_ligands.append(lig)
-				if verbose or DEBUG: print lig, "rejected by NonSTDatom type", LigandDictionary[lig]["NotStdAT"]
-			else:
-				if lig_hba >= HbAmin.get() and lig_hba <= HbAmax.get():
-					if lig_hbd >= HbDmin.get() and lig_hbd <= HbDmax.get():
-						if lig_tors >= TORSDOFmin.get() and lig_tors <= TORSDOFmax.get():
-							if lig_mw >= MWmin.get() and lig_mw <= MWmax.get():
-								if lig_nat >= NatMin.get() and lig_nat <= NatMax.get():
-									accepted_ligands.append(lig)
-									if verbose or DEBUG: print "ACCEPTED", lig
-								else:
-									rejected_ligands.append(lig)
-									if verbose or DEBUG: print lig, "rejected number of atoms", lig_nat
-							else:
-								if verbose or DEBUG: print lig, "rejected molecular weight", lig_mw
-								rejected_ligands.append(lig)
-						else:
-							rejected_ligands.append(lig)
-							if verbose or DEBUG: print lig, "rejected torsions", lig_tors
-					else:
-						rejected_ligands.append(lig)
-						if verbose or DEBUG: print lig, "rejected HBD", lig_hbd
-				else:
-					rejected_ligands.append(lig)
-					if verbose or DEBUG: print lig, "rejected HBA", lig_hba
+		# all the ligands are filtered at once on the columns of the table
+		selection = LigandFilterEngine.select(GetFilterRanges(), reject_nonstd = DoRejectATypes.get())
 		# summarize the filtering process
-		total = len(LigandDictionary.keys())
-		rejected = len(rejected_ligands)
-		accepted = total - rejected
-		msg = "Total number of ligands: %12s" % str(total)
-		TotalNumberLigandsMsg.set(msg)
-		msg = "Accepted ligands: %12s" % str(accepted)
-		TotAcceptedLigandsMsg.set(msg)
-		msg = "Rejected ligands: %12s" % str(rejected)
-		TotRejectedLigandsMsg.set(msg)
+		accepted = int(selection.sum())
+		if verbose or DEBUG: print "FilterLigands> %d accepted, %d rejected" % (accepted, len(LigandDictionary) - accepted)
+		SetFilterPreview(accepted)
 		# this variable is set for make TheCheck function quicker
 		TotalAcceptedLigands.set(accepted)
 		if seriously:
-			for lig in rejected_ligands:
-				LigandDictionary[lig]["accepted"] = False
-			for lig in accepted_ligands:
-				LigandDictionary[lig]["accepted"] = True
+			LigandDictionary.set_accepted(selection)
 			LigandsTag()
 			try:
 				TheCheck()
@@ -2230,13 +2120,8 @@ def FilterLigands(seriously):
 
 def LigandsTag():
 	# Color ligands basing on their status ACCEPTED/REJECTED
-	acc_col = 'black'
-	rej_col = 'red'
-	for item in range(0, LigandScrolledListBox.size()):
-		if not LigandDictionary[LigandScrolledListBox.get(item)]["accepted"]:
-			LigandScrolledListBox.itemconfig(item, fg = 'red') #white', bg = '#aa2200')
-		else:
-			LigandScrolledListBox.itemconfig(item, fg = 'black') #white', bg = '#22aa00') 
+	# (only the visible rows are colored, see LigandListView)
+	LigandList.refresh()
 	return
 
 #########################################################################################################33
@@ -2373,72 +2258,11 @@ def openSingleReceptor(filename = None):
 	TheCheck()	
 
 def genPDBQTrec(infile, outfile):
-	# If this file closely resemble the Prepare_receptor4.py, it's normal.
-	receptor_filename = infile
-	outputfilename = outfile
-
-	repair_set = RecRepairOptionsSet.get()
-	if repair_set == 'none':
-		repairs = None
-	if repair_set == 'rebuild bonds':
-		repairs = 'bonds'
-	if repair_set == 'add H':
-		repairs = 'hydrogens'
-	if repair_set == 'add H (if missing)':
-		repairs = 'checkhydrogens'
-	if repair_set == 'rebuild bonds + add H':
-		repairs = 'bonds_hydrogens'
-	
-	charges_to_add = RecChargeSet.get()
-
-	# preserve_charge_types = a			 # NEGLECTED AS IN THE LIGANDS
-	cleanup = RecCleanNPH.get()+RecCleanLP.get()+RecCleanWAT.get()+RecDelAlternate.get()
-	delete_single_nonstd_residues  = RecCleanStdRes.get()
-	
-	verbose = None
-	mode = 'automatic'
-	preserve_charge_types = None
-
-	mols = Read(receptor_filename)
-	if verbose: print 'read ', receptor_filename
-	try:
-		mol = mols[0]
-	except:
-		return False
-	preserved = {}
-	if charges_to_add is not None and preserve_charge_types is not None:
-		preserved_types = preserve_charge_types.split(',') 
-		if verbose: print "preserved_types=", preserved_types
-		for t in preserved_types:
-			if verbose: print 'preserving charges on type->', t
-			if not len(t): continue
-			ats = mol.allAtoms.get(lambda x: x.autodock_element==t)
-			if verbose: print "preserving charges on ", ats.name
-			for a in ats:
-				if a.chargeSet is not None:
-					preserved[a] = [a.chargeSet, a.charge]
-
-	if len(mols)>1:
-		if verbose: print "more than one molecule in file"
-		#use the molecule with the most atoms
-		ctr = 1
-		for m in mols[1:]:
-			ctr += 1
-			if len(m.allAtoms)>len(mol.allAtoms):
-				mol = m
-				if verbose: print "mol set to ", ctr, "th molecule with", len(mol.allAtoms), "atoms"
-	mol.buildBondsByDistance()
-
-	RPO = AD4ReceptorPreparation(mol, mode, repairs, charges_to_add, 
-						cleanup, outputfilename=outputfilename,
-						preserved=preserved, 
-						delete_single_nonstd_residues=delete_single_nonstd_residues)	
-	if charges_to_add is not None:
-		#restore any previous charges
-		for atom, chargeList in preserved.items():
-			atom._charges[chargeList[0]] = chargeList[1]
-			atom.chargeSet = chargeList[0]
-	return True
+	# the receptor PDBQT is generated with the options of the interface
+	options = ReceptorPrepOptions(repairs = RECEPTOR_REPAIRS[RecRepairOptionsSet.get()], charges_to_add = RecChargeSet.get(),
+			cleanup = RecCleanNPH.get()+RecCleanLP.get()+RecCleanWAT.get()+RecDelAlternate.get(),
+			delete_single_nonstd_residues = RecCleanStdRes.get())
+	return ConvertReceptor(infile, outfile, options)
 
 
 def checkPDBQTrec(filename):
@@ -3181,15 +3005,10 @@ def opendirMaps(mapfolder = None):
 	if mapDir:
 		MapFolderList.delete(0, END)
 		DoCachedMaps.set(False)
-		# collect all the atomic maps
-		mapFiles = glob.glob(os.path.join(mapDir, "*.map"))
-		# add the *.fld and *.xyz maps
-		for extra_map in glob.glob(os.path.join(mapDir, "*.maps.*")):
-			mapFiles.append(extra_map)
-		# Prune possible dirs matching "*map*" pattern
- 		for item in mapFiles:
-			if os.path.isdir(item):
-				del mapFiles[mapFiles.index(item)]
+		# all the atomic maps and the *.fld and *.xyz maps, from the
+		# manifest of the directory (scanned again only if changed)
+		index = MapDirIndex(mapDir)
+		mapFiles = index.files
 
 		if len(mapFiles):
 			for map in mapFiles:
@@ -3203,14 +3022,15 @@ def opendirMaps(mapfolder = None):
 			tkMessageBox.showerror("Map file not found!", "The .xyz map is missing.\nSelect another directory.")
 		# ...then check for necessary atom types if ligands have been set
 		if XyzFound and FldFound:
-			CheckFolderMap(mapFiles)
+			CheckFolderMap(mapFiles, index.problems)
 		TheCheck()
 
-def CheckFolderMap(MapFileList):
+def CheckFolderMap(MapFileList, bad_maps = None):
 	# Check for mapfiles for all the atom types (+e +d) that
 	# are found in the ligands of the Great Book of Ligands
 	# and assure that all the maps are consistent
-	# (same parameters)
+	# (same parameters; bad_maps are the problems found by
+	# CheckMaps, if already known)
 	MissingMaps = []
 	FolderIsOk = True
 	MapConsistency = True
@@ -3220,20 +3040,14 @@ def CheckFolderMap(MapFileList):
 	receptor_stem = (os.path.basename(RecFilename.get())).split(".")[0]
 	if DEBUG: print "CheckFolderMap> RECEPTOR_STEM", receptor_stem
 	# Check for all atom types maps
+	map_file_names = {}
+	for item in MapFileList:
+		map_file_names[os.path.basename(item)] = item
 	for atype in AtypeList:
 		if AtypeList[atype][0] > 0:
-			missing = 1
 			map_file_name = receptor_stem+"."+atype+".map"
-			print "MISSING", map_file_name
-			for item in MapFileList:
-				print "CHECK ITEM", item
-				if map_file_name in item:
-					missing = 0
-					break
-			else:
-				print "\t %s is not in %s" % (map_file_name, item)
+			if not map_file_names.has_key(map_file_name):
 				missing_files.append(map_file_name)
-	print MapFileList
 	if missing_files:
 		miss_text = ""
 		for file in missing_files:
@@ -3260,34 +3074,12 @@ def CheckFolderMap(MapFileList):
 				if missing == 1:   
 					MissingMaps.append(atype)
 
-	# Check for number of points
+	# Check the headers (same grid) and the number of points of all the maps
 	if len(MissingMaps) == 0:
-		mapheader = []
-		mapheader_checking = []
-		try:
-			for file in MapFileList:
-			    if file[-3:] == "map":
-				MAP = open(file, 'r')
-				# first map populates the map reference dictionary
-				if len(mapheader) == 0:
-					line = MAP.next()
-					for count in '123456':
-						mapheader.append(line)
-						line = MAP.next()
-					MAP.close()
-				else:
-					line = MAP.next()
-					for count in '123456':
-						mapheader_checking.append(line)
-						line = MAP.next()
-					MAP.close()
-					if not mapheader == mapheader_checking:
-						MapConsistency == False
-					else:
-						MapConsistency == True
-						del mapheader_checking[:]
-		except:
-			if DEBUG: print "CheckFolderMap> Houston, we've got a problem in checking maps..."
+		if bad_maps is None:
+			bad_maps = CheckMaps(MapFileList)
+		if bad_maps:
+			if DEBUG: print "CheckFolderMap> inconsistent maps:", bad_maps
 			MapConsistency = False
 
 		if MapConsistency:
@@ -3298,8 +3090,13 @@ def CheckFolderMap(MapFileList):
 			DoCachedMaps.set(True)
 			return True
 		else:
+			bad_text = ""
+			for map_file, problem in bad_maps[:10]:
+				bad_text += "\n==> %s : %s" % (os.path.basename(map_file), problem)
+			if len(bad_maps) > 10:
+				bad_text += "\n(...and %d more)" % (len(bad_maps) - 10)
 			tkMessageBox.showwarning("Map files are not coherent!", "The maps doesn't have the same properties\
-							(i.e npoints, resolution...). Please check them or select another folder")
+							(i.e npoints, resolution...) or are incomplete:\n%s\n\nPlease check them or select another folder" % bad_text)
 			CacheMapDirName.set("[ none ]")
 			CacheMapDirLabel.config(state = DISABLED)
 			AutoGridWhen1.invoke() # Select the default as "Run AG in each job"
@@ -3319,137 +3116,6 @@ def CheckFolderMap(MapFileList):
 		return False
 
 
-def prepareGPF(output_gpf_filename, receptor_filename, ligand_filename = None, atom_types = None , flexres_filename = None):
-
-	# get the vales from the scrollbox
-	# parse keyword+values
-	# generate keyword="value[,value,value]"
-	# 
-	# warning, this is limited to the keywords listed below
-	# but not others [ to be improved ]
-	# parse the GPF for keywords
-	# "input" can be either a ligand or a the dictionary of the atom types
-	#
-
-	parameters = []
-
-	list_filename = gpf_filename = None
-	directory = None
-	verbose = None
-	center_on_ligand = False
-	size_box_to_include_ligand = False
-
-	verbose = False
-
-	parameters = []
-	if verbose or DEBUG:
-			print "I'm trying to generate the GPF using the following params:"
-			print "output gpf", output_gpf_filename
-			print "receptor_filename", receptor_filename
-			print "ligand_filename", ligand_filename
-			print "atom types", atom_types
-			print "flexres_filename", flexres_filename
-
-	list_of_atom_types = []
-
-	if atom_types:
-		if verbose or DEBUG: print "I'm going to use these atom types to generate the maps...", atom_types
-		line = "ligand_types="
-		for atype in atom_types:
-			if atype not in list_of_atom_types:
-				line = line+atype+","
-				list_of_atom_types.append(atype)
-		line = line.rstrip(',')
-		parameters.append(line)
-	if verbose: print "This is the command line", line
-
-	# add potential parameter file line
-	if not GPFParameterFile.get() == "":
-		parameters.append( ( "parameter_file="+GPFParameterFile.get() ) )
-
-
-	# read the imported GPF and parse the keywords
-	gpf_lines = GPFcontent.get(1.0, END)
-
-	if verbose: print "############################################ GPF ####################\n",gpf_lines, "\n###################################"
-
-	for line in gpf_lines.split('\n'):
-		if verbose: print "======> PROCESSING: ", line
-		if not line.strip(): # get rid of empty lines
-			continue
-		else:
-			clean_line = line.split("#")[0] # get rid of comments
-			clean_line = clean_line.split(" ", 1)
-			keyword = clean_line[0]
-			try:
-				argument = clean_line[1]
-			except:
-				pass
-			if verbose: print " keyword = |"+keyword+"|, value = |"+argument+"|"
-			# try: ?
-
-			if keyword == "npts":
-				value = argument.split()
-				line = keyword+"="+value[0]+","+value[1]+","+value[2]
-				if verbose: print "=> found npts, generated this xxxx:", line
-				parameters.append(line)
-				
-			if keyword == "parameter_file":
-				value = argument.replace(" ", "")
-				line = keyword+"="+value
-				if verbose: print "=> found parameter file, generated this xxxx:", line
-
-			if keyword == "spacing":
-				value = argument.replace(" ", "")
-				line = keyword+"="+value
-				if verbose: print "=> found spacing, generated this xxxx:", line
-				parameters.append(line)
-
-			if keyword == "gridcenter":
-				value = argument.split()
-				line = keyword+"="+value[0]+" "+value[1]+" "+value[2]
-				if verbose: print "=> found gridcenter, generated this xxxx:", line
-				parameters.append(line)
-
-			if keyword == "smooth":
-				value = argument.replace(" ", "")
-				line = keyword+"="+value
-				if verbose: print "=> found smooth, generated this xxxx:", line
-				parameters.append(line)
-
-			if keyword == "dielectric":
-				value = argument.replace(" ", "")
-				line = keyword+"='"+value+"'"
-				if verbose: print "=> found dielectric, generated this xxxx:", line
-				parameters.append(line)
-	if verbose: print parameters
-
-	gpfm = GridParameter4FileMaker(size_box_to_include_ligand=False,verbose=False)
-
-	if ligand_filename:
-		gpfm.set_ligand(ligand_filename)
-	gpfm.set_receptor(receptor_filename)
-
-	if flexres_filename:
-		flexmol = Read(flexres_filename)[0]
-		flexres_types = flexmol.allAtoms.autodock_element
-		lig_types = gpfm.gpo['ligand_types']['value'].split()
-		all_types = lig_types
-		for t in flexres_types:
-			if t not in all_types: 
-				all_types.append(t)
-		all_types_string = all_types[0]
-		if len(all_types)>1:
-			for t in all_types[1:]:
-				all_types_string = all_types_string + " " + t
-		gpfm.gpo['ligand_types']['value'] = all_types_string 
-	for p in parameters:
-		key,newvalue = string.split(p, '=')
-		kw = {key:newvalue}
-		apply(gpfm.set_grid_parameters, (), kw)
-	gpfm.write_gpf(output_gpf_filename)	
-	return True
-
 def docking_setup_interface(event):
 	global Info, numGen, EnEval, simple_settings, simple_settings_info, EnEval, OpenDPF, DPF_group, docking_set, CheckTDOF, CheckVOL, complex_gen_info, complex_eval_info, DPF_INFO, InfoFrame, dockMenuSettings
 	global DPFcontent, DPFscroll, DPFedit, DPFsave, DPFfilename, DPFFilenameLabel, simple_settings_info
@@ -3624,402 +3290,6 @@ def askDPFParamFile(filename):
 				DPFedit.config(state = DISABLED)
 				keepasking = False
 
-##################################### DPF CLASS
-
-class DockingParameter42FileMaker:
-	"""Accept a <ligand>.pdbqt and <receptor>.pdbqt and create
-	<ligand>_<receptor>42.dpf
-	"""
-
-	def __init__(self, verbose = None):
-		self.verbose = verbose
-		self.dpo = DockingParameters()
-
-
-	def getTypes(self, molecule):
-		if not len(molecule.allAtoms.bonds[0]):
-			molecule.buildBondsByDistance()
-		ad4_typer = AutoDock4_AtomTyper(verbose=self.verbose)
-		ad4_typer.setAutoDockElements(molecule)
-		dict = {}
-		for a in molecule.allAtoms:
-			dict[a.autodock_element] = 1
-		d_types = dict.keys()
-		d_types.sort()
-		mol_types = d_types[0]
-		for t in d_types[1:]:
-			mol_types = mol_types + " " + t
-		if self.verbose: print "end of getTypes: types=", mol_types, ' class=', mol_types.__class__
-		return mol_types
-
-
-	def set_write_all(self, value):
-		verbose = self.verbose
-		self.dpo['write_all_flag']['value'] = True
-		if verbose: print "set write_all_flag to", self.dpo['write_all_flag']['value']
-
-
-	def set_ligand(self, ligand_filename): 
-		verbose = self.verbose
-		self.ligand_filename = os.path.basename(ligand_filename)
-		if verbose: print "set ligand_filename to", self.ligand_filename
-		self.dpo.set_ligand(ligand_filename)
-		#expect a filename like ind.out.pdbq: get 'ind' from it
-		self.ligand_stem = string.split(self.ligand_filename,'.')[0]
-		if verbose: print "set ligand_stem to", self.ligand_stem
-		self.ligand = Read(ligand_filename)[0]
-		if self.ligand==None:
-			print 'ERROR reading: ', ligand_filename
-			return 
-		if verbose: print "read ", self.ligand.name
-		#set dpo:
-		#move
-		self.dpo['move']['value'] = self.ligand_filename
-		if verbose: print "set move to ", self.dpo['move']['value']
-		#ndihe
-		#assumes ligand has torTree
-		self.dpo['ndihe']['value'] = self.ligand.parser.keys.count("BRANCH")
-		#self.dpo['ndihe']['value'] = len(self.ligand.torTree.torsionMap)
-		if verbose: print "set ndihe to ", self.dpo['ndihe']['value']
-		#torsdof
-		#caution dpo['torsdof4']['value'] is a list [ndihe, 0.274]
-		try:
-			self.dpo['torsdof4']['value'][0] = self.ligand.TORSDOF
-		except:
-			print 'setting torsdof to ligand.ndihe=', self.ligand.ndihe
-			self.dpo['torsdof4']['value'][0] = self.ligand.ndihe
-		if verbose: print "set torsdof4 to ", self.dpo['torsdof4']['value']
-		#types
-		self.ligand.types = self.getTypes(self.ligand)
-		self.dpo['ligand_types']['value'] = self.ligand.types
-		if verbose: print "set types to ", self.dpo['ligand_types']['value']
-		#about
-		self.ligand.getCenter() 
-		cen = self.ligand.center
-		self.dpo['about']['value'] =  [round(cen[0],4), round(cen[1],4),\
-										round(cen[2],4)]
-		if verbose: print "set about to ", self.dpo['about']['value']
-		
-
-	def set_receptor(self, receptor_filename):
-		self.receptor_filename = os.path.basename(receptor_filename)
-		self.receptor_stem = string.split(self.receptor_filename, '.')[0]
-		self.dpo.set_receptor(receptor_filename)
-
-
-	def set_flexres(self, flexres_filename):
-		flexmol = Read(flexres_filename)[0]
-		flexres_filename = os.path.basename(flexres_filename)
-		self.dpo['flexres_flag']['value'] = True
-		self.dpo['flexres']['value'] = flexres_filename
-		#make sure each atom type in flexres molecule is in ligand_types
-		d = {}
-		current_types = self.dpo['ligand_types']['value'].split()
-		for t in current_types:
-			d[t] = 1
-		for a in flexmol.allAtoms:
-			d[a.autodock_element] = 1
-		self.dpo['ligand_types']['value'] = string.join(d.keys())
-
-
-	def set_docking_parameters(self, **kw):
-		"""Any docking parameters should be set here
-		"""
-		# like this: 
-		# newdict = {'ga_num_evals':1750000, 'ga_pop_size':150,
-		#			'ga_run':20, 'rmstol':2.0}
-		# self.mv.dpo['<parameter>']['value'] = <new value>
-		for parm, newvalue in kw.items():
-			self.dpo[parm]['value'] = newvalue
-			if parm=='set_sw1':
-				self.dpo['set_psw1']['value'] = not newvalue
-			if parm=='set_psw1':
-				self.dpo['set_sw1']['value'] = not newvalue
-			if parm=='flexres':
-				self.set_flexres(newvalue) 
-			if parm=='write_all':
-				self.set_write_all(newvalue) 
-
-
-	def write_dpf(self, dpf_filename,
-			  parm_list = genetic_algorithm_local_search_list4_2, 
-			  pop_seed = False):
-		if not dpf_filename:
-			dpf_filename = "%s%s%s%s" % \
-						   (self.ligand_stem, "_",
-							self.receptor_stem, ".dpf")
-		# now that we have a filename...
-		# set initial conformation
-		if pop_seed:
-			self.dpo['tran0']['value'] = self.dpo['about']['value']
-			self.dpo['quat0']['value'] = '1.0 0. 0. 0.'
-			dihe0 = '0. '*self.dpo['ndihe']['value']
-			dihe0.rstrip()
-			self.dpo['dihe0']['value'] = dihe0 
-		if self.verbose:
-			print "writing ", dpf_filename
-		self.dpo.write42(dpf_filename, parm_list)
-
- 
- ########################################################
-
-
-
-def prepareDPF(dpf_filename, receptor_filename, ligand_filename, flexres_filename = None, search_algorithm = "GA", parameters = None):
-
-	# implement the possibility to define explicit params for the SmartVS?
-
-	if search_algorithm == "GA": # GA-only supported keywords
-		parameter_list = genetic_algorithm_local_search_list4_2
-	if search_algorithm == "LS":
-		parameter_list = local_search_list4_2 # not explicitly supported
-	if search_algorithm == "SA":
-		parameter_list = simulated_annealing_list4_2 # not explicitly supported
-	
-	pop_seed = False
-	verbose = False
-	template = None
-
-	# parameter parser
-	dpf_lines = DPFcontent.get(1.0, END)
-
-	if not parameters:
-		parameters = []
-	
-		for line in dpf_lines.split('\n'):
-			if not line.strip(): # get rid of empty lines
-				continue
-			else:
-				clean_line = line.split("#")[0] # get rid of comments
-				clean_line = clean_line.split(" ", 1)
-				keyword = clean_line[0]
-				try:
-					argument = clean_line[1]
-				except:
-					argument = ""
-	
-				if keyword == "autodock_parameter_version":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found autodock_param_vers", value[0]
-					parameters.append(par_line)
-					
-				if keyword == "parameter_file":
-					value = argument#.replace(" ", "")
-					par_line = keyword+"="+value
-					parameters.append(par_line)
-					#print "=> found parameter file, generated this xxxx:", value
-	
-				if keyword == "outlev":
-					value = argument#.replace(" ", "")
-					par_line = keyword+"="+value
-					#print "=> found outlev, generated this xxxx:", par_line
-					parameters.append(par_line)
-	
-				if keyword == "seed": 
-					value = argument.split()
-					par_line = keyword+"="+value[0]+" "+value[1]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-	
-				if keyword == "tran0":
-					value = argument.replace(" ", "")
-					par_line = keyword+"="+value
-					#print "=> found smooth, generated this xxxx:", par_line
-					parameters.append(par_line)
-				if keyword == "axisangle0":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "dihe":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "tstep":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "qstep":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "dstep":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "unbound":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "rmstol":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "extnrg":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "e0max":
-					value = argument.split()
-					par_line = keyword+"="+value[0]+" "+value[1]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_pop_size":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_num_evals":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_num_generations":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_elitism":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_mutation_rate":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_crossover_rate":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_window_size":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_cauchy_alpha":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_cauchy_beta":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "set_ga":
-					#value = argument.split()
-					par_line = keyword+"= "#+value[0]+"'"
-					#print "=> found %s, generated this " % (par_line)
-					parameters.append(par_line)
-				if keyword == "sw_max_its":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "sw_max_succ":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "sw_max_fail":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "sw_rho":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "sw_lb_rho":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ls_search_freq":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "set_psw1":
-					par_line = keyword+"= "
-					#par_line = "set_psw1_flag"
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "set_sw1":
-					par_line = keyword+"= "
-					#par_line = "set_sw1_flag"
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "unbound_model":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "ga_run":
-					value = argument.split()
-					par_line = keyword+"="+value[0]
-					#print "=> found %s, generated this : %s" % (keyword, par_line)
-					parameters.append(par_line)
-				if keyword == "analysis":
-					#value = argument.split()
-					par_line = keyword+"= "#+value[0]+"'"
-					#print "=> found %s, generated this : " % (par_line)
-					parameters.append(par_line)
-	if verbose: print "###\n", parameters, "###\n"
-
-	dm = DockingParameter42FileMaker(verbose=None)
-	dm.set_ligand(ligand_filename)
-	dm.set_receptor(receptor_filename)
-	if flexres_filename is not None:
-		flexmol = Read(flexres_filename)[0]
-		flexres_types = flexmol.allAtoms.autodock_element
-		lig_types = dm.dpo['ligand_types']['value'].split()
-		all_types = lig_types
-		for t in flexres_types:
-			if t not in all_types: 
-				all_types.append(t)
-		all_types_string = all_types[0]
-		if len(all_types)>1:
-			for t in all_types[1:]:
-				all_types_string = all_types_string + " " + t
-		dm.dpo['ligand_types']['value'] = all_types_string 
-		dm.dpo['flexres']['value'] = os.path.basename(flexres_filename)
-		dm.dpo['flexres_flag']['value'] = True
-	for p in parameters:
-		key,newvalue = string.split(p, '=')
-		if newvalue[0]=='[':
-			nv = []
-			for item in newvalue[1:-1].split(','):
-				nv.append(float(item))
-			newvalue = nv
-		elif 'flag' in key:
-			if newvalue in ['1','0']:
-				newvalue = int(newvalue)
-			if newvalue =='False':
-				newvalue = False
-			if newvalue =='True':
-				newvalue = True
-		kw = {key:newvalue}
-		apply(dm.set_docking_parameters, (), kw)
-		if key not in parameter_list:
-			#special hack for output_pop_file
-			if key=='output_pop_file':
-				parameter_list.insert(parameter_list.index('set_ga'), key)
-			else:
-				parameter_list.append(key) 
-	dm.write_dpf(dpf_filename, parameter_list, pop_seed)
 
 
 ########################## INFO ###################################
@@ -4030,12 +3300,12 @@ def RMBhelp(aboutwhat = None):
 	pass
 
 def GetOSoption():
-	global TargetOS, LinuxOptionsPanel, PBSOptionsPanel, WinOptionsPanel
+	global TargetOS, LinuxOptionsPanel, PBSOptionsPanel, WinOptionsPanel, VinaOptionsPanel
 	
 	LinMasterBash, LinSingleBash, LinTarGz, LinRunAfter = BooleanVar(),BooleanVar(),BooleanVar(), BooleanVar()
 	PBScputime = StringVar()
 
-	for panel in LinuxOptionsPanel, PBSOptionsPanel, WinOptionsPanel:
+	for panel in LinuxOptionsPanel, PBSOptionsPanel, WinOptionsPanel, VinaOptionsPanel:
 		panel.grid_forget()
 	if not TargetOS.get():
 		print "this is the first time the TargetOS is called"
@@ -4079,6 +3349,26 @@ def GetOSoption():
 		SetPBShowmanyruns
 		
 
+	if TargetOS.get() == "vina":
+		# Vina: the search space is the grid of the GPF, no maps nor DPF
+		panel = VinaOptionsPanel
+		if system == "Windows":
+			CygwinOption = Tkinter.Checkbutton(panel.interior(), text = 'Use Cygwin', variable = cygwin)
+			CygwinOption.grid(row = 0, column = 0, sticky = W)
+		Label(panel.interior(), text="Script generation ").grid(row = 1, column = 0, sticky = E)
+		OptionMenu(panel.interior(), LinuxScriptLevel, "master script for starting the VS",\
+						"single scripts for each ligand", "[disabled]").grid(row = 1, column = 1, sticky = W, columnspan = 3)
+		Label(panel.interior(), text = 'Create a VS package file ').grid(row = 2, column = 0, sticky = E)
+		OptionMenu(panel.interior(), TarFile, "Tar (Bz2 compression)", "Tar (Gzip compression)",\
+						"Tar (uncompressed)", "Zip compressed", "[disabled]").grid(row = 2, column = 1, sticky = W, columnspan = 3)
+		Label(panel.interior(), text = 'Poses per ligand (num_modes) ').grid(row = 3, column = 0, sticky = E)
+		Entry(panel.interior(), textvariable = VinaModes, width = 4).grid(row = 3, column = 1, sticky = W)
+		Label(panel.interior(), text = 'Exhaustiveness ').grid(row = 4, column = 0, sticky = E)
+		Entry(panel.interior(), textvariable = VinaExhaustiveness, width = 4).grid(row = 4, column = 1, sticky = W)
+		Label(panel.interior(), text = 'CPU per job ').grid(row = 5, column = 0, sticky = E)
+		Entry(panel.interior(), textvariable = VinaCPU, width = 4).grid(row = 5, column = 1, sticky = W)
+		TheCheck()
+
 	if TargetOS.get() == "win":
 		# Win (God bless you)
 		CheckMasterScript = Tkinter.Checkbutton(panel.interior(), text = 'Generate a master batch script for the VS job')
@@ -4270,6 +3560,31 @@ def TheCheck():
 		OutputDirLabel.config(fg = 'red')
 
 
+	# Vina: the search space is the grid of the GPF, the DPF is not used
+	if TargetOS.get() == "vina":
+		MAPS = False
+		if len(GPFcontent.get('1.0', END)) > 3:
+			try:
+				center, size = VinaBox(GPFcontent.get('1.0', END))
+				MapsSummary.set(("\nVina search space from the grid\n[ %.1f x %.1f x %.1f A ]" % size))
+				MAPS = True
+			except RaccoonError, e:
+				MapsSummary.set(("\n"+str(e)))
+		if MAPS:
+			MapsSummaryLabel.config(fg = '#11bb11')
+		else:
+			MapsSummaryLabel.config(fg = 'red')
+		try:
+			DOCKING = min(VinaModes.get(), VinaExhaustiveness.get(), VinaCPU.get()) > 0
+		except:
+			DOCKING = False
+		if DOCKING:
+			DockingSummary.set("\nAutoDock Vina\n[ %s poses, exhaustiveness %s ]" % (VinaModes.get(), VinaExhaustiveness.get()))
+			DockSummaryLabel.config(fg = '#11bb11')
+		else:
+			DockingSummary.set("\nAutoDock Vina\n[ the Vina options must be numbers > 0 ]")
+			DockSummaryLabel.config(fg = 'red')
+
 	if LIGANDS and RECEPTORS and MAPS and DOCKING:
 		# that's why we're here...
 		JobsSummary.set(("\t"+str(count_receptors * count_ligands)+" jobs will be generated" ))
@@ -4328,6 +3643,51 @@ def HandBrake():
 		return
 
 
+def GetVSSettings():
+	# snapshot of the VS generation settings from the interface (see VSSettings)
+	flexres_file, flex_residues = None, None
+	if DoFlex.get() and FlexResDefined.get():
+		if DoFlexFromWhat.get() == 1:
+			flexres_file = FlexResFileName.get()
+		if DoFlexFromWhat.get() == 2:
+			flex_residues = FlexResSelected.get()
+	gpf_text, map_files = "", None
+	if (MapSource.get() <= 1 or TargetOS.get() == "vina") and GPFcontent:
+		gpf_text = GPFcontent.get('1.0', END)
+	if MapSource.get() == 2:
+		map_files = list(MapFolderList.get('0', END))
+	dpf_text = ""
+	if docking_set.get() == "From template..." and DPFcontent:
+		dpf_text = DPFcontent.get('1.0', END)
+	scripts = {	"master script for starting the VS"	: "master",
+			"single scripts for each ligand"	: "single" }.get(LinuxScriptLevel.get())
+	package = {	"Tar (Bz2 compression)"		: "bz2",
+			"Tar (Gzip compression)"	: "gz",
+			"Tar (uncompressed)"		: "tar",
+			"Zip compressed"		: "zip" }.get(TarFile.get())
+	return VSSettings(gpf_text = gpf_text, dpf_text = dpf_text, map_source = MapSource.get(),
+			gpf_parameter_file = GPFParameterFile.get(), dpf_parameter_file = DPFParameterFile.get(),
+			autogrid = AutoGridBin.get(), map_dir = CacheMapDirName.get(), map_files = map_files,
+			symlink = CacheMapPolicy.get() == "Make symbolic links [ save disk space ]",
+			flexres_file = flexres_file, flex_residues = flex_residues,
+			target = TargetOS.get(), scripts = scripts, win_batch = system == "Windows" and not cygwin.get(),
+			pbs_time = PBStime.get(), pbs_runs = PBShowmanyruns.get(), package = package,
+			vina_modes = VinaModes.get(), vina_exhaustiveness = VinaExhaustiveness.get(), vina_cpu = VinaCPU.get(),
+			version = version)
+
+def GenerationError(log_file, message):
+	# the generation is aborted: tell the user and write it in the log
+	tkMessageBox.showerror("Error!", message)
+	print >> log_file, ("\n\n\n#### ERROR ###\n\n%s\n\n VS generation aborted.\n\n####      ####" % message)
+	log_file.close()
+	TheButton.config(state = DISABLED, text = "E R R O R")
+	EnableInterface()
+	return False
+
+def GenerationMessage(text):
+	InfoMessage.set(text)
+	root.update()
+
 def TheFunction():
 	path = JobDirectory.get()
 	if DEBUG: print "TheFunction> starting the vs creation in ", path
@@ -4360,267 +3720,67 @@ def TheFunction():
 
 	# Define the target(s)
 	if RCstatus.get() == 0:
-		if DEBUG: print "[gen] => single receptor NAME = ", 
 		receptor_list = [ RecFilename.get() ]
-		if DEBUG: print RecFilename.get()
 	else:
-		if DEBUG: print "[gen] => multiple receptors", 
 		receptor_list = receptorScrolledListBox.get('0', END)
-	
 	if DEBUG: print "[ I'm going to use %d receptors ]" % len(receptor_list)
 
 	# Get the filtered ligands
-	ligand_list = []
-	atomtypes_set = [] #atom types present in the accepted ligands set
-	for ligand in LigandDictionary.keys():
-		if LigandDictionary[ligand]["accepted"]:
-			ligand_list.append(ligand)
-			for atom in LigandDictionary[ligand]["Atypes"]:
-				if atom not in atomtypes_set: atomtypes_set.append(atom)
+	ligand_list = LigandDictionary.accepted_names()
+	atomtypes_set = LigandDictionary.atom_types(LigandDictionary.accepted()) #atom types present in the accepted ligands set
 	# counters are initialized here
-	rec_count = len(receptor_list)
-	lig_count = len(ligand_list) 
-	jobs_todo = rec_count * lig_count
-	jobs_done = 1
-	# the Main loop
-	for receptor in receptor_list:
-		rec_name = os.path.basename(receptor).rsplit('.', 1)[:-1][0]
-		current_path = path+os.sep+rec_name
-		# Flush the list of dir per ligands (this is generated on a per-receptor base)
-		del DirJournal[:]
-		# create the directory RECEPTOR/[ligands]
-		if not os.path.exists(current_path):
-			try:
-				os.makedirs(current_path, 0755)
-			except:
-				tkMessageBox.showerror("Error!", ("Impossible to create the directory:\n%s\n GIVING UP..." % current_path))
-				print >> log_file, ("\n\n\n#### ERROR ###\n\nThere was a problem in creating the directory:\n%s\n\n VS generation aborted.\n\n####      ####" % current_path) # End of receptor loop
-				TheButton.config(state = DISABLED, text = "E R R O R")
-				EnableInterface()
-				return False
-
-		## Preliminary stuff to do before the ligands get involved
-		#
-		#
-		## 1. define or generate flexible residue files
-		#
-		flex_res = None
-		if DoFlex.get(): # 
-			if FlexResDefined.get(): # 
-				if DEBUG: print "soo.... we want flexible,right?\n\nPREPARING"
-				if DoFlexFromWhat.get() == 1:
-					if FlexResFileName.get(): # TODO in theory it shouldn't be necessary
-						if DEBUG: print "\tcopying the flexible residue in the right place"
-						if DEBUG: print "\tcp flex.pdbqt working_dir"
-						flex_res = FlexResFileName.get()
-				if DoFlexFromWhat.get() == 2:
-					if FlexResSelected.get(): # TODO in theory it shouldn't be necessary
-						if DEBUG: print "\tgenerate the flexible residue from the receptor"
-						if DEBUG: print "\tprepare_flex_receptor blablabla "
-						InfoMessage.set( (  "[ Generating flex residues for %s... ]" % rec_name )) 
-						receptor, flex_res = genFlex(receptor)
-				flex_types = GetAtypes(flex_res)
-				for atom in flex_types:
-					if atom not in atomtypes_set: atomtypes_set.append(atom)
-
-		if DEBUG:
-			print "[GEN] I've got the flex_res filename", flex_res
-			print "[GEN] Now the receptor is", receptor
-		#
-		## 2. calculate or copy maps now if necessary
-		#
-		#  create the cached maps folder (for "now" and "already")
-		CachedMapsDir = None
-
-		CacheMapOptions = OptionMenu(CacheMapHandle.interior(), CacheMapPolicy, "Make copies [ use more disk space ]", "Make symbolic links [ save disk space ]")
-		if CacheMapPolicy.get() == "Make copies [ use more disk space ]":
-			symlink = False
-		if CacheMapPolicy.get() == "Make symbolic links [ save disk space ]":
-			symlink = True
-
-		if MapSource.get() >= 1: 
-			CachedMapsDir = current_path+os.sep+"maps"
-			if not os.path.exists(CachedMapsDir):
-				try:
-					os.makedirs(CachedMapsDir, 0755)
-				except:
-					tkMessageBox.showerror("Error!", ("Impossible to create the directory:\n%s\n GIVING UP..." % CachedMapsDir))
-					print >> log_file, ("\n\n\n#### ERROR ###\n\nThere was a problem in creating the directory:\n%s\n\n VS generation aborted.\n\n####      ####" % CachedMapsDir) 
-					EnableInterface()
-					return False
-		if MapSource.get() == 1: # populate the dir with AutoGrid
-			InfoMessage.set( (  "[ Running AutoGrid on %s... ]" % rec_name )) 
-			if not CalcCacheMaps(CachedMapsDir, receptor, flex_res): 
-				tkMessageBox.showerror("Error!", ("Impossible to calculate the cached maps here:\n%s\n GIVING UP..." % CachedMapsDir))
-				EnableInterface()
-				return False
-
-		if MapSource.get() == 2: # populate the dir by copying the files from the cache
-			InfoMessage.set( (  "[ Copying cached maps for %s... ]" % rec_name )) 
-			if not CopyMapDir(atomtypes_set, None, CachedMapsDir, symlink = False): # no matter if maps will be eventually copied or linked, now it must be false
-				tkMessageBox.showerror("Error!", ("Impossible to copy the maps in the VS job master directory \n%s\n GIVING UP..." % CachedMapsDir))
-				EnableInterface()
-				return False
-
-		# Ligands loop #############################################################################################
-		for ligand in ligand_list:
-
+	jobs_todo = len(receptor_list) * len(ligand_list)
+	try:
+		workers = LigandWorkers.get()
+	except:
+		workers = 1
+	# the jobs are generated by the engine (LigandWorkers processes), the
+	# interface is updated while waiting (and the generation can be stopped)
+	generator = VSGenerator(GetVSSettings(), atomtypes_set, message = GenerationMessage, workers = workers,
+			table = LigandDictionary)
+	try:
+		# maps of all the receptors calculated at once (AutoGrid runs in parallel)
+		for runs_done in generator.maps(receptor_list, path):
 			if StopImmediately.get():
+				generator.stop()
 				InfoMessage.set( "Generation process aborted by the user...")
 				print >> log_file, ("\n\n\n#### ABORT ###\n\nThe generation process was interrupted by the user.\n\n") 
+				log_file.close()
 				TheButton.config(state = DISABLED, text = " [ Generation aborted ]")
 				EnableInterface()
 				return False
-
-			InfoMessage.set( (  "=> Processing %s | %s \t[ %d | %d ]" % (os.path.basename(receptor), os.path.basename(ligand), jobs_done, jobs_todo )   ))
-			nb.tab('VS Generation').focus_set()
+			if runs_done:
+				InfoMessage.set( "=> Calculating the maps\t[ %d AutoGrid runs done ]" % runs_done )
 			root.update()
-			current_atom_types = []
-			ligand_name = os.path.basename(ligand).rsplit('.', 1)[:-1][0]
-			# create ligand dir
-			ligand_dir = MkJobDir(ligand, rec_name, current_path)
-			if not ligand_dir:
-				tkMessageBox.showerror("Error!", ("Impossible to create the directory:\n%s\n GIVING UP..." % ligand_dir))
-				print >> log_file, ("\n\n\n#### ERROR ###\n\nThere was a problem in creating the directory:\n%s\n\n VS generation aborted.\n\n####      ####" % ligand_dir) 
-				EnableInterface()
-				return False
-
-			# copy the ligand in place
-			if not os.path.dirname(ligand) == ligand_dir:
-				try:
-					shutil.copy2(ligand, ligand_dir)
-				except:
-					tkMessageBox.showerror("Error!", ("Impossible to copy the ligand:\n%s\n\tto\n%s\n\nGIVING UP..." % (ligand, ligand_dir)))
-					EnableInterface()
-					return False
-			else:
-				if DEBUG: print "TheFunction> skipped the source/dest ligand copy because they are identical..."
-			
-			# copy flexres if necessary
-			if DoFlex.get(): # 
-				if FlexResDefined.get():
-					if not os.path.dirname(flex_res) == ligand_dir:
-						try:
-							shutil.copy2( flex_res, ligand_dir)
-						except:
-							tkMessageBox.showerror("Error!", ("Impossible to copy the flex res file:\n%s\n\tto\n%s\n\nGIVING UP..." % (flex_res, ligand_dir)))
-							EnableInterface()
-							return False
-					else:
-						if DEBUG: print "TheFunction> skipped the source/dest flex_res copy because they are identical..."
-
-
-			# maps management
-			#
-			# a. generate GPF
-			gpf_file = None
-			if MapSource.get() == 0 : # being in the for loop cached maps will be referred to the receptor
-				# generate the gpf
-				gpf_file = ligand_dir+os.sep+rec_name+".gpf"
-				try:
-					prepareGPF(gpf_file, receptor, ligand_filename = ligand, atom_types = None, flexres_filename = flex_res)
-				except:
-					tkMessageBox.showerror("Error!", ("Impossible to create the gpf file:\n%s\n GIVING UP..." % gpf_file))
-					EnableInterface()
-					return False
-					
-				if not os.path.exists(gpf_file):
-					tkMessageBox.showerror("Error!", ("Impossible to create the gpf file:\n%s\n GIVING UP..." % gpf_file))
-					print >> log_file, ("\n\n\n#### ERROR ###\n\nThere was a problem in creating the GPF:\n%s\n\n VS generation aborted.\n\n####      ####" % gpf_file) 
+		for receptor in receptor_list:
+			target = generator.receptor(receptor, path)
+
+			# Ligands loop #############################################################################################
+			for jobs_done in generator.jobs(target, ligand_list):
+				if StopImmediately.get():
+					generator.stop()
+					InfoMessage.set( "Generation process aborted by the user...")
+					print >> log_file, ("\n\n\n#### ABORT ###\n\nThe generation process was interrupted by the user.\n\n") 
+					log_file.close()
+					TheButton.config(state = DISABLED, text = " [ Generation aborted ]")
 					EnableInterface()
-					# error message window
 					return False
+				if jobs_done:
+					InfoMessage.set( (  "=> Processing %s \t[ %d | %d ]" % (os.path.basename(receptor), jobs_done, jobs_todo )   ))
+				nb.tab('VS Generation').focus_set()
+				root.update()
 
-				# copy potential parameter files
-				if not GPFParameterFile.get() == "":
-					if not os.path.dirname(GPFParameterFile.get()) == ligand_dir:
-						try:
-							shutil.copy2( GPFParameterFile.get(), ligand_dir)
-						except:
-							tkMessageBox.showerror("Error!", ("Impossible to copy the parameter file required by the\
-GPF:\n%s\n\tto\n%s\n\nGIVING UP..." % (GPFParameterFile.get(), ligand_dir)))
-							EnableInterface()
-							return False
-					else:
-						if DEBUG: print "TheFunction> skipped the source/dest GPFparamfile copy because they are identical..."
-
-
-				# copy the receptor
-				if not os.path.dirname(receptor) == ligand_dir:
-					try:
-						shutil.copy2(receptor, ligand_dir)
-					except:
-						tkMessageBox.showerror("Error!", ("Impossible to copy the receptor\n%s\n\tto\n%s\n\nGIVING UP..." % (receptor, ligand_dir)))
-						EnableInterface()
-						return False
-				else:
-					if DEBUG: print "TheFunction> skipped the source/dest receptor copy because they are identical..."
-
-
-
-			# b. use cached maps
-			elif MapSource.get() >= 1:
-				current_atom_types = GetAtypes(ligand)
-				# include flex res atoms
-				if FlexResDefined.get():
-					for atom in flex_types:
-						if atom not in current_atom_types: current_atom_types.append(atom)
-				CopyMapDir(current_atom_types, CachedMapsDir, ligand_dir, symlink = symlink)
-
-			# Prepare the DPF
-			if docking_set.get() == "From template...":
-				dpf_file = ligand_dir+os.sep+ligand_name+"_"+rec_name+".dpf"
-				prepareDPF(dpf_file, receptor, ligand, flex_res)
-				if not os.path.exists(dpf_file):
-					tkMessageBox.showerror("Error!", ("Impossible to create the DPF file:\n%s\n GIVING UP..." % dpf_file))
-					print >> log_file, ("\n\n\n#### ERROR ###\n\nThere was a problem in creating the DPF:\n%s\n\n VS generation aborted.\n\n####      ####" % dpf_file) 
-					EnableInterface()
-					return False	
-				# copy potential parameter files
-				if not DPFParameterFile.get() == "":
-					if not os.path.dirname(DPFParameterFile.get()) == ligand_dir:
-						try:
-							shutil.copy2( DPFParameterFile.get(), ligand_dir)
-						except:
-							tkMessageBox.showerror("Error!", ("Impossible to copy the parameter file required by the\
-DPF:\n%s\n\tto\n%s\n\nGIVING UP..." % (DPFParameterFile.get(), ligand_dir)))
-							EnableInterface()
-							return False
-					else:
-						if DEBUG: print "TheFunction> skipped the source/dest DPFparamfile copy because they are identical..."
-			jobs_done += 1
+			generator.close(target)
+		generator.finish()
 
-			if not TargetOS.get() == "win":
-				if not LinuxScriptLevel.get() == "[disabled]":
-					MakeJobScript(ligand_dir, dpf_file, gpf_file)
-			log_file.flush()
-			
-	
-		if TargetOS.get() == "pbs" or TargetOS.get() == "lin":
-			if DEBUG: print "Making the master script"
-			if LinuxScriptLevel.get() == "master script for starting the VS":
-				MakeMasterJobScript(current_path)
-
-	if DEBUG: print "\n\n\n	[ GENERATION DONE ]"
-	if not TarFile.get() == "[disabled]":
-		InfoMessage.set( (  "[ writing the compressed file... ]")   ) 
-		TheButton.config(state = DISABLED, text = "...creating the VS package...")
-		root.update()
-		# vs pack filename
-		pack_filename = path+os.sep+"VSpack_"+os.path.basename(path)
-		if DEBUG:
-			print "TheFunction> creating the package file", pack_filename, "in ", path
-
-		# Zip file format
-		if TarFile.get() == "Zip compressed":
-			if not MakeZip(path, pack_filename):
-				root.update()
-				return False
-		# ...anything else
-		else:
-			if not MakeTar(path, pack_filename):
-				root.update()
-				return False
+		if DEBUG: print "\n\n\n	[ GENERATION DONE ]"
+		if generator.settings['package']:
+			TheButton.config(state = DISABLED, text = "...creating the VS package...")
+			root.update()
+			generator.package(path)
+	except RaccoonError, e:
+		generator.stop()
+		return GenerationError(log_file, str(e))
 
 	InfoMessage.set( (  "[ generation completed successfully ]")   ) 
 	tkMessageBox.showinfo(title="VS generation terminated", message=("%d docking jobs have been successfully \
@@ -4628,131 +3788,22 @@ generated in:\n\n%s\n" % (len(receptor_list) * len(ligand_list), path ) ))
 	EnableInterface()
 	# Success! update the log with all the ligands, and close the file
 	print >> log_file, "\n\t\t\t process completed successfully.\n\n"
+	if generator.skipped:
+		print >> log_file, "RESUMED>\t%d jobs were already generated in the directory\n" % generator.skipped
+	print >> log_file, "RECEPTORS>\tcache : %d hits | %d misses\n" % generator.receptors.stats()
+	print >> log_file, "MAPS>\tstore : %d hits | %d misses" % generator.store.stats()
+	for line in generator.links.report():
+		print >> log_file, "MAPS>\t"+line
+	for line in generator.warnings:
+		print >> log_file, "VINA>\tWARNING "+line
+	print >> log_file
+	for line in generator.timer.report():
+		print >> log_file, "TIMING>\t"+line
 	print >> log_file, "\n\n\n[DONE]" # End of receptor loop. This line is used in the load function to recognize a successfull VSgeneration when loading it back.
 	log_file.close()
 	TheButton.config(state = DISABLED, text = "D O N E")
 
 
-def CopyMapDir(atomtypes_to_copy, source_dir, destination_dir, symlink = False):
-	# copy or make symbolic links of map files
-	#
-	#
-	if source_dir == destination_dir:
-		if DEBUG: print "CopyMapDir> skipping copy/symlink because the directories are the same"
-		return True
-	if MapSource.get() == 2:
-		map_files = MapFolderList.get('0', END)
-	if MapSource.get() == 1:
-		map_files = glob.glob(os.path.join(source_dir, "*.map"))
-		map_files.append(glob.glob(os.path.join(source_dir, "*.xyz"))[0])
-		map_files.append(glob.glob(os.path.join(source_dir, "*.fld"))[0])
-
-	counter = 0
-	atomtypes_to_copy.append('e')
-	atomtypes_to_copy.append('d')
-	atomtypes_to_copy.append('maps')
-	for atype in atomtypes_to_copy:
-		for map in map_files:
-			if atype == map.split(".")[-2]:
-				try:
-					if DEBUG: print "CopyMapDir> going to process this file ==>", map
-					if symlink:
-						if DEBUG: print "     doing symlinking", map, destination_dir
-						map_filename = os.path.basename(map)
-						map_dir = os.path.basename(source_dir)
-						SRC = "../"+map_dir+os.sep+map_filename
-						DEST = destination_dir+os.sep+map_filename
-						os.symlink(SRC, DEST)
-					else:
-						shutil.copy2( map, destination_dir)
-					counter = counter + 1 # +1 to account for the two maps.* files
-				except:
-					tkMessageBox.showerror(title="Cached maps error", message=(("Some problem occurred when copying or linking the file %s") % map ))
-					return False
-	if len(atomtypes_to_copy)+1 == counter:
-		return True
-	else:
-		return False
-
-def GetAtypes(filename = None, selection = None):
-	# The selection works with selected
-	# flex residues only
-	#
-	if not filename and not selection:
-		return
-
-	atypes = []
-	if filename:
-		f = open(filename, 'r')
-		for line in f.readlines():
-			if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
-				atom = line.split()[-1]
-				if atom not in atypes:
-					atypes.append(atom)
-		f.close()
-	if selection:
-		pass
-	
-	return atypes
-
-def CalcCacheMaps(output_dir, receptor, flexible_residues = None):
-	# get the atom types for the accepted ligands
-	atom_types = []
-	for ligand in LigandDictionary.keys():
-		if LigandDictionary[ligand]["accepted"]:
-			for atom in LigandDictionary[ligand]["Atypes"]:
-				if atom not in atom_types:
-					atom_types.append(atom)
-	if not os.path.dirname(receptor) == output_dir:
-		try:
-			shutil.copy2( receptor, output_dir)
-		except:
-			tkMessageBox.showerror(title="Error", message=(("Impossible to copy the receptor in the target directory for caching the maps.")))
-		gpf_name = output_dir+os.sep+os.path.basename(receptor).rsplit('.', 1)[:-1][0]+"_all_maps.gpf"
-	else:
-		if DEBUG: print "CalcCacheMaps> skipping the receptor copy, because files are identical"
-
-	try:
-		prepareGPF(gpf_name, receptor, atom_types = atom_types , flexres_filename = flexible_residues)
-	except:
-		return False
-	if RunAutoGrid(output_dir, gpf_name):
-		return True
-	else:
-		return False
-
-
-def RunAutoGrid(working_dir, gpf):
-	# define AutoGrid
-	#
-	if not AutoGridBin.get():
-		return False
-	else:
-		AutoGrid = AutoGridBin.get()
-
-	glg = gpf.rsplit('.', 1)[:-1][0]+".glg"
-	try:
-		nb.tab('VS Generation').focus_set()
-		root.update()
-		#print "Look, mom! I'm running Autogrid from inside Python!!!!"
-		os.system(("cd %s; %s -p %s -l %s" % (working_dir, AutoGrid, gpf, glg )))
-		
-		# Check if the calculation succeded
-		GridLog = open(glg, 'r')
-		log = GridLog.readlines()
-		GridLog.close()
-		if DEBUG: print log[-2]
-		if "Successful Completion" in log[-2]:
-			return True
-		else:
-			error = ""
-			for line in log[-7:]:
-				error += line
-			tkMessageBox.showerror("AutoGrid error!", ("Maps calculation failed with the following message:\n %s" % error))
-			return False
-	except:
-		return False
-
 def WhichAutoGrid(program = 'autogrid4'):
 	# Try to check the file path....
 	def is_exe(fpath):
@@ -4815,50 +3866,6 @@ def CheckExe(file):
 	# not working 
 	return True
 
-def genFlex(receptor_filename):
-	verbose = False
-	name = os.path.splitext(receptor_filename)[0]
-	rigid_filename=name+"_rigid.pdbqt"
-	flexres_filename=name+"_flex.pdbqt"
-	if verbose or DEBUG: print "[genFlex] rigid = ", rigid_filename
-	if verbose or DEBUG: print "[genFlex] flexres = ", flexres_filename
-
-	residue_selected = ListFlexResiduesNames.get()
-	residue_selected = residue_selected.replace(" ","")
-	if verbose or DEBUG: print "[genFlex] gen from ", residue_selected
-
-	residue_to_move = residue_selected.replace(',','_')
-	if verbose or DEBUG: print "These are residues to move", residue_to_move
-
-	disallow = ""
-	disallowed_pairs = ""
-	r = Read(receptor_filename)[0]
-	r.buildBondsByDistance()
-	all_res = ResidueSet()
-	res_names = residue_to_move.split('_')
-	res_names = residue_selected.split(',')
-	
-	if verbose or DEBUG: print "res_names will be", res_names
-
-	for n in res_names:
-		res = r.chains.residues.get(lambda x: x.name==n)
-		all_res += res
-
-	d = {}
-	for res in all_res: d[res] = 1
-	all_res = d.keys()
-	all_res = ResidueSet(all_res)
-	all_bnds = BondSet()
-	bnd_pairs = disallowed_pairs.split(':')
-	for pair in bnd_pairs:
-		names = pair.split('_')
-		bnds = all_res.atoms.bonds[0].get(lambda x: x.atom1.name in names and x.atom2.name in names)
-		all_bnds += bnds
-	fdp = AD4FlexibleReceptorPreparation(r, residues=all_res, rigid_filename=rigid_filename, 
-											flexres_filename=flexres_filename,
-											non_rotatable_bonds=all_bnds)
-	return rigid_filename, flexres_filename
-
 def update_status(status_message):
 	status = Label(p1, text=status_message, bd=1, relief=SUNKEN, anchor=S)
 	status.pack(side=BOTTOM, fill=X)
@@ -4867,448 +3874,37 @@ def confirm():
 	if tkMessageBox.askokcancel("Close Raccoon", "\nAre you sure you want to quit?\n\n(all unsaved data will be lost)\n"):
 		root.destroy()
 
-def MkJobDir(ligand_filename, receptor_stem, output_dir):
-	global DirJournal
-	LigNAME = os.path.basename(ligand_filename).rsplit('.', 1)[:-1][0]
-	RecNAME = receptor_stem
-	JobDir = output_dir+os.sep+LigNAME+"_"+RecNAME
-	if JobDir in DirJournal: # to manage homonimy (same ligand filename from different directories)
-		DirJournal.append(JobDir)
-		JobDir = JobDir+"_"+str(DirJournal.count(JobDir))
-	else:
-		DirJournal.append(JobDir)
-	try:
-		if not os.path.exists(JobDir):
-			os.makedirs(JobDir, 0755)
-		else:
-			return
-		return JobDir
-	except:
-		return False
-
-def MakeJobScript(ligand_dir, dpf_file, gpf_file):
-	# generate run.sh in the ligand_dir
-	if TargetOS.get() == "lin":
-		if system == "Windows" and not cygwin.get():
-			script_file = ligand_dir+os.sep+"run.bat"
-			line = "@echo off"
-			line = "REM Generated by AutoDock Raccoon"
-			if gpf_file:
-				gpf = os.path.basename(gpf_file)
-				glg = gpf[:-3]+"glg"
-				line += ("\necho Running AutoGrid...\nautogrid4.exe -p %s -l %s" % (gpf, glg) )
-			dpf = os.path.basename(dpf_file)
-			dlg = dpf[:-3]+"dlg"
-			line += ("\necho Running AutoDock...\nautodock4.exe -p %s -l %s\n" % (dpf, dlg) )
-		else:
-			script_file = ligand_dir+os.sep+"run.sh"
-			line = "#!/bin/bash\n# Generated by AutoDock Raccoon\n#\n#"
-			line += "\n# Specify here the paths for the binaries, if necessary"
-			if gpf_file:
-				line += "\n"+"# autogrid = ''"
-				line += "\n"+"# autodock = ''"
-			else:
-				line += "\n"+"# autodock = ''"
-			if gpf_file:
-				gpf = os.path.basename(gpf_file)
-				glg = gpf[:-3]+"glg"
-				line += ("\necho Running AutoGrid...\nautogrid4 -p %s -l %s" % (gpf, glg) )
-			dpf = os.path.basename(dpf_file)
-			dlg = dpf[:-3]+"dlg"
-			line += ("\necho Running AutoDock...\nautodock4 -p %s -l %s\n" % (dpf, dlg) )
-		script = open( script_file, 'w')
-		script.writelines(line)
-		script.close()
-		if not system == "Windows": os.system("chmod +x %s" % (script_file))
-		return True
-
-def MakeMasterJobScript(path):
-	header = """      ________________________________________________________________
-__________//___________________________/////___________________/____________
-_________/__/__________________________/____/__________________/____________
-________/____/___________/_____________/_____/_________________/____________
-________/____/__/_____/_/////___/////__/_____/__/////___/////__/___/________
-_______/______/_/_____/__/_____/_____/_/_____/_/_____/_/_____/_/_//_________
-_______////////_/_____/__/_____/_____/_/_____/_/_____/_/_______//_/_________
-_______/______/_/____//__/___/_/_____/_/____/__/_____/_/_____/_/___/________
-_______/______/__////_/___///___/////__/////____/////___/////__/____/_______
-      ________________________________________________________________
-                                 ______ 
-                                /      \\ 
-                               /        \\ 
-                              /          \\   Raccoon
-                              \\    /\\    /    Virtual 
-                               \\  /  \\  /      Screening 
-                                \\/ /\\ \\/        Generation      
-                                 /\\  \\ 
-                               /\\  \\__\\    version %s
-                              /  \\__\\ 
-                             /____\\ """ % version
-	
-
-
-	if TargetOS.get() == "lin":
-		if system == "Windows" and not cygwin.get():
-			line = "@echo off\nREM Generated by AutoDock Raccoon\necho.\n"
-			command = "call run.bat"
-			master_script_name = path+os.sep+"RunVS.bat"
-			spacer = ""
-			Q = ""
-		else:
-			line = "### Generated by AutoDock Raccoon\n"
-			command = "./run.sh"
-			master_script_name = path+os.sep+"RunVS.sh"
-			Q = "'"
-			spacer = "  "
-
-		for i in header.split("\n"): # acrobatic moves for making a unified generator...
-			line += "echo %s%s%s%s\n" % (Q, spacer, i, Q)
-
-		if system == "Windows" and not cygwin.get():
-			line += "echo.\necho                  == Press ENTER to start the calculation ==\n"
-			line += "pause > NUL\n"
-		else:
-			line += "\necho -e \"\\n                 == Press ENTER to start the calculation ==\"\n"
-			line += "read X\n"
-			
-
-		for DIR in DirJournal:
-			dir = os.path.basename(DIR)
-			line += ("echo %sDocking %s%s\n"% (Q, dir, Q)  )
-			line += ("cd %s\n%s\ncd ..\n\n" % (dir, command))
-
-
-		line += "echo %sCalculation completed.%s\n" % (Q,Q)
-		if system == "Windows" and not cygwin.get():
-			line += "pause > NUL\n"
-		else:
-			line += "read X\n"
-
-		try:
-			master_script = open(master_script_name, 'w')
-			master_script.writelines(line)
-			master_script.close()
-		except:
-			tkMessageBox.showerror("Master script generation.", ("An error occurred when trying to generate the jobs list file."))
-			return False
-
-		if not system == "Windows":
-			os.system("chmod +x %s" % (master_script_name))
-
-	if TargetOS.get() == "pbs":
-		# create the list of job dirs in which to go
-		# for submitting the calculation
-		try:
-			file = open(path+os.sep+'jobs_list', 'w')
-			for DIR in DirJournal:
-				dir = os.path.basename(DIR)
-				print >> file, dir+"\n" 
-			file.close()
-		except:
-			tkMessageBox.showerror("PBS script generation.", ("An error occurred when trying to generate the jobs list file."))
-			return False
-		CreateSmuggler(path)
-		return True
-
-def CreateSmuggler(path):
-	# this function is called only for
-	# PBS jobs
-	if DEBUG: print "Creating the smuggler..."
-	filename = "vs_submit.sh"
-	end = PBShowmanyruns.get()
-	line = "#!/bin/bash\n"
-	line += "#\n# Generated with Raccoon | AutoDockVS\n#\n\n"
-
-	line += "#### PBS jobs parameters"
-	line += "CPUT=\"%s\"\n" % PBStime.get()
-	line += "WALLT=\"%s\"\n" % PBStime.get()
-	line += "#\n# There should be no reason\n"
-	line += "# for changing the following values\n"
-	line += "NODES=1\n"
-	line += "PPN=1\n"
-	line += "MEM=512mb\n\n\n"
-
-	line += "### CUSTOM VARIABLES\n"
-	line += "#\n"
-	line += "# use the following line to set special options (e.g. specific queues)\n"
-	line += "#OPT=\"-q MyPriorQueue\"\n"
-	line += "OPT=\"\"\n\n\n"
-
-	line += "# Paths for executables on the cluster \n"
-	line += "# Modify them to specify custom executables to be used\n"
-	line += "QSUB=\"qsub\"\n"
-	line += "AUTODOCK=\"autodock4\"\n\n"
-	# Set Autogrid if necessary"
-	if MapSource.get() == 0:
-		line += "AUTOGRID=\"autogrid4\"\n\n"
-
-	line += "# Special path to move into before running\n"
-	line += "# the screening. This is very system-specific,\n"
-	line += "# so unless you're know what are you doing,\n"
-	line += "# leave it as it is\n"
-	line += "WORKING_PATH=`pwd`\n\n"
-
-	line += "\n\n##################################################################################################\n"
-	line += "##################################################################################################\n"
-	line += "####### There should be no need to modify anything below this line ###############################\n"
-	line += "##################################################################################################\n"
-	line += "##################################################################################################\n\n\n"
-	line += "#\n#\n\n"
-
-	line += "type $AUTODOCK &> /dev/null || {\n"
-	line += "        echo -e \"\\nError: the file [$AUTODOCK] doesn't exist or is not executable\\n\";\n"
-	line += "        echo -e \"Try to specify the full path to the executable of the AutoDock binary in the script\";\n"
-	line += "        echo -e \"( i.e. AUTODOCK=/usr/bin/autodock4 )\\n\\n\";\n"
-	line += "        echo -e \" [ virtuals screening submission aborted]\\n\"\n"
-	line += "        exit 1; }\n\n"
-	line += ""
-
-	if MapSource.get() == 0:
-		line += "type $AUTOGRID &> /dev/null || {\n"
-		line += "        echo -e \"\\nError: the file [$AUTOGRID] doesn't exist or is not executable\\n\";\n"
-		line += "        echo -e \"Try to specify the full path to the executable of the AutoGrid binary in the script\";\n"
-		line += "        echo -e \"( i.e. AUTOGRID=/usr/bin/autogrid4 )\\n\\n\";\n"
-		line += "        echo -e \" [ virtuals screening submission aborted]\\n\"\n"
-		line += "        exit 1; }\n\n"
-
-	line += "type $QSUB &> /dev/null || {\n"
-	line += "        echo -e \"\\nError: the file [$QSUB] doesn't exist or is not executable\\n\";\n"
-	line += "        echo -e \"Try to specify the full path to the executable of the Qsub command binary in the script\";\n"
-	line += "        echo -e \"( i.e. QSUB=/usr/bin/qsub )\\n\\n\";\n"
-	line += "        echo -e \" [ virtuals screening submission aborted]\\n\"\n"
-	line += "        exit 1; }\n\n"
-
-	line += "echo Starting submission...\n"
-	line += "for NAME in `cat jobs_list`\n"
-	line += "    do\n"
-	line += "        cd $NAME\n"
-	# Set the extra loop for multiple DLG per ligand
-	# and specify the name convention: ligand_protein.#.job
-	if end > 1:
-		line += "        for i in `seq 1 %s`\n" % str(end)
-		line += "            do\n"
-		job_name = "$NAME.$i.job"
-		tab = "    "
-	else:
-		tab = ""
-		job_name = "$NAME.job"
-
-	line += "%s        echo \"#!/bin/bash\" > %s\n" % (tab, job_name)
-	line += "%s        echo \"cd $WORKING_PATH/$NAME\" >> %s \n" % (tab, job_name)
-	if MapSource.get() == 0:
-		line += "%s        echo \"$AUTOGRID -p *.gpf -l grid_out.glg\" >> %s\n" % (tab, job_name)
-	if end > 1:
-		line += "%s        echo \"$AUTODOCK -p $NAME.dpf -l $NAME.$i.dlg\" >> %s\n" % (tab, job_name)
-	else:
-		line += "%s        echo \"$AUTODOCK -p $NAME.dpf -l $NAME.dlg\" >> %s\n" % (tab, job_name)
-
-	line += "%s        chmod +x %s\n" % (tab, job_name)
-	line += "%s        echo -n \"Submitting $NAME : \"\n" % tab
-	line += "%s        $QSUB $OPT -l cput=$CPUT -l nodes=1:ppn=1 -l walltime=$WALLT -l mem=$MEM %s\n" % (tab, job_name) # remove the echo for making it active
-	if end > 1:
-		line += "        done\n"	
-	line += "        cd ..\n"
-	line += "done\n"
-	try:
-		output = open(path+os.sep+filename, 'w')
-		output.writelines(line)
-		output.close()
-		if not system == "Windows":
-			os.system("chmod +x %s" % (path+os.sep+filename))
-		return True
-	except:
-		tkMessageBox.showerror("PBS script generation.", ("An error occurred when trying to generate the %s file." % filename))
-		return False
-
 def InitializeLog(outdir = None, filename = None):
 	if not outdir and not filename:
 		return False
 	if not outdir:
 		outdir = ""
-	#global LogFile, first_time
-	if system == "Windows":
-		os.environ.get("USERNAME")
-	else:
-		user = os.environ["USER"]
-	machine = system_info[1]
-	operative_system = system_info[0]
-	
-	if TargetOS.get() == "lin":
-		target_machine = "Workstation"
-	if TargetOS.get() == "pbs":
-		target_machine = "Linux clusters"
-	if TargetOS.get() == "win":
-		target_machine = "Windows"
 
 	# take a look at the clock
 	date = datetime.datetime.now()
-	year = str(date.year)
-	month = str(date.month)
-	day = str(date.day)
-	hour = str(date.hour)
-	minute = str(date.minute)
-	second = str(date.second) 			# too much?
-	microsecond = str(date.microsecond)	# waaay to much!
 
 	# VSgen-2009.7.26.log
 	if not filename:
-		log_name = outdir+os.sep+"raccoonVS-"+year+"."+month+"."+day+".log"
+		log_name = outdir+os.sep+"raccoonVS-"+str(date.year)+"."+str(date.month)+"."+str(date.day)+".log"
 	else:
 		log_name = filename
-	
-	full_date = date.strftime("%Y-%B-%d %H:%M")
-
-
-	if RCstatus.get() == 0:
-		receptor_count = 1	
-	else:
-		receptor_count = len(receptorScrolledListBox.get('0', END))
-
-	ligand_count = str(TotalAcceptedLigands.get())
-
-	tot_number_jobs = str( (TotalAcceptedLigands.get() * receptor_count  ) )
-
-	header = """
- 	      ________________________________________________________________
-	
-	__________//___________________________/////___________________/____________
-	_________/__/__________________________/____/__________________/____________
-	________/____/___________/_____________/_____/_________________/____________
-	________/____/__/_____/_/////___/////__/_____/__/////___/////__/___/________
-	_______/______/_/_____/__/_____/_____/_/_____/_/_____/_/_____/_/_//_________
-	_______////////_/_____/__/_____/_____/_/_____/_/_____/_/_______//_/_________
-	_______/______/_/____//__/___/_/_____/_/____/__/_____/_/_____/_/___/________
-	_______/______/__////_/___///___/////__/////____/////___/////__/____/_______
-	
-	      ________________________________________________________________
-	                                 ______ 
-	                                /      \\ 
-	                               /        \\ 
-	                              /          \\   Raccoon
-	                              \\    /\\    /    Virtual 
-	                               \\  /  \\  /      Screening 
-	                                \\/ /\\ \\/        Generation      
-	                                 /\\  \\ 
-	                               /\\  \\__\\    version %s
-	                              /  \\__\\ 
-	                             /____\\
-		
-		
-                  date :\t%s
-      output directory :\t%s
-    total docking jobs :\t%s
-      operative system :\t%s [ %s ]
-   generating jobs for :\t%s
-
-
-      ===================================== Ligand filters =========================================
-	
-                       Filtering criteria
-                       ------------------
-                                   MIN      MAX
-                    Hb donors :   %4s  -  %4s
-                 Hb acceptors :   %4s  -  %4s
-             Molecular weight :   %4s  -  %4s
-        Total number of atoms :   %4s  -  %4s
-              Rotatable bonds :   %4s  -  %4s
-		Reject non-AD atypes  :   %s
-	
-	
-		Ligands accepted for the virtual-screening: %s
 
-
-""" % ( version, full_date, outdir, tot_number_jobs, operative_system, machine, target_machine , str(HbDmin.get()), str(HbDmax.get()), str(HbAmin.get()), str(HbAmax.get()), str(MWmin.get()), str(MWmax.get()), str(NatMin.get()), str(NatMax.get()), str(TORSDOFmin.get()), str(TORSDOFmax.get()), str(DoRejectATypes.get()), ligand_count)   
-	
-
-	# receptor
 	if RCstatus.get() == 0:
-		receptor_log = "\n      ============================= Single target receptor ==========================================\n"
-		receptor_log = receptor_log+"\n   Target structure:\nTARGET>\t"+ RecFilename.get()
-
+		receptors = [ RecFilename.get() ]
 	else:
-		receptor_log = "\n      =========================== Multiple target receptors =========================================\n"
-		receptor_log = receptor_log+"\n   Total target structures :" + str(receptor_count)+"\n"
-		# append the list of receptor structures
-		for rec in receptorScrolledListBox.get('0', END):
-			receptor_log = receptor_log+"\nTARGET>\t"+rec
-	header = header + receptor_log
-
-	# flexible residues
-	if DoFlex.get():
-		if FlexResDefined.get():
-			flex_log = "\n\n      ------------------------------- Flexible residues -----------------------------------\n\n"
-			if DoFlexFromWhat.get() == 1:
-				if FlexResFileName.get(): # TODO in theory it shouldn't be necessary
-					flex_log = flex_log + "FLEX> Flexible residues from the file :\t"+FlexResFileName.get()
-				else:
-					if DEBUG : print "RETURNING A SHAMEFUL FALSE: problems in logging the flex residues [FlexResFileName.get() = ", FlexResFileName.get(), "]"
-					return False
-			if DoFlexFromWhat.get() == 2:
-				if FlexResSelected.get(): # TODO in theory it shouldn't be necessary
-					flex_log = flex_log + "FLEX> Flexible residues generated from the selection : "+ FlexResSelected.get()
-				else:
-					if DEBUG :print "RETURNING A SHAMEFUL FALSE: problems in logging the flex residues [FlexResSelected.get() = ", FlexResSelected.get(), "]"
-					return False
-			header = header + flex_log + "\n"
-
-
-	
-	# Maps
-	maps_log = "\n\n      ===================================== Maps ====================================================\n"
-
-	if MapSource.get() <= 1:
-		if MapSource.get() == 0:
-			maps_log = maps_log + "\n   Grid mode : calculated in each job.\n"
-			maps_log = maps_log + "   Grid param file template :\n\n"
-	
-		if MapSource.get() == 1:
-			if CacheMapPolicy.get() == "Make copies [ use more disk space ]":
-				maps_log = maps_log + "\n   Grid mode : calculated now and >copied< in each ligand job directory.\n"
-				maps_log = maps_log + "   Grid param file template :\n\n"
-			if CacheMapPolicy.get() == "Make symbolic links [ save disk space ]":
-				maps_log = maps_log + "\n   Grid mode : calculated now and >linked< in each ligand job directory.\n"
-				maps_log = maps_log + "   Grid param file template :\n\n"
-			maps_log = maps_log+("\t [ AutoGrid binary file used : |%s| ]" % AutoGridBin.get())
-
-		# add the gpf lines to the log
-		for line in GPFcontent.get('1.0', END).split('\n'):
-			if not line.strip(): # get rid of empty lines
-				continue
-			else:
-				maps_log = maps_log+"\nGPF>\t"+line#"\n"
-		if GPFParameterFile.get():
-			maps_log = maps_log+(" [ the parameter file |%s| has been copied ]\n\n" % GPFParameterFile.get())
-
-	if MapSource.get() == 2:
-		if CacheMapPolicy.get() == "Make copies [ use more disk space ]":
-			cache_policy = " >copied< "
-		if CacheMapPolicy.get() == "Make symbolic links [ save disk space ]":
-			cache_policy = " >linked< "
-		maps_log = maps_log + "\n   Grid mode : use pre-calculated"+cache_policy+"in each ligand job directory.\n"
-		maps_log = maps_log + "   Grid cache dir : "+CacheMapDirName.get()
-
-	header = header + maps_log
-
-
-	docking_log = "\n\n     ==================================  Docking parameters ========================================\n"
-
-	if docking_set.get() == "From template...":
-		docking_log = docking_log+"\n   Docking mode : docking parameters will be >generated from template< for each ligand.\n"
-		docking_log = docking_log+"   Docking param file template :\n\n"
-		for line in DPFcontent.get(1.0, END).split('\n'):
-			if not line.strip(): # get rid of empty lines
-				continue
-			else:
-				docking_log = docking_log+"\nDPF>\t"+line
-		if DPFParameterFile.get():
-			docking_log = docking_log+("\n\n[ the parameter file %s has been copied ]" % DPFParameterFile.get())
-	header = header + docking_log
-
-	ligands_log = "\n\n     ======================================  Ligands list ============================================\n\n"
-	for ligand in LigandDictionary.keys():
-		if LigandDictionary[ligand]["accepted"]:
-			ligands_log += "\nLIGAND> "+ligand
-	header += ligands_log
+		receptors = list(receptorScrolledListBox.get('0', END))
+
+	# the header is shared with the command line tools (raccoon_batch.py)
+	info = {	'date'		: date.strftime("%Y-%B-%d %H:%M"),
+			'outdir'	: outdir,
+			'os'		: system_info[0],
+			'machine'	: system_info[1],
+			'filters'	: GetFilterRanges(),
+			'reject'	: DoRejectATypes.get(),
+			'receptors'	: receptors,
+			'single'	: RCstatus.get() == 0,
+			'ligands'	: LigandDictionary.accepted_names() }
+	header = VSLogHeader(GetVSSettings(), info)
 	try:
 		LOG = open(log_name, 'w')
 	except:
@@ -5318,82 +3914,6 @@ def InitializeLog(outdir = None, filename = None):
 	print >> LOG, header
 	return LOG
 
-def MakeTar(source_dir, tarfilename):
-
-	if DEBUG:
-		print "MakeTar> creating the tar from the source =>", source_dir
-		print "MakeTar> The filename is	=>", tarfilename
-
-	if TarFile.get() == "[disabled]":
-		return True
-	if TarFile.get() == "Tar (uncompressed)":
-		filemode = "w"
-		ext = ".tar"
-	if TarFile.get() == "Tar (Bz2 compression)":
-		filemode = "w:bz2"
-		ext = ".tar.bz2"
-	if TarFile.get() == "Tar (Gzip compression)":
-		filemode = "w:gz"
-		ext = ".tar.gz"
-
-	tarfilename += ext
-	InfoMessage.set('Writing the VS package...(this could take a while)')
-	root.update()
-	short_name = os.path.basename(source_dir)
-	try:
-		if DEBUG: print "Trying to generate the tar file", tarfilename
-		vs_tar = tarfile.open(name = tarfilename, mode = filemode)
-		root.update()
-		vs_tar.add(source_dir, arcname = short_name)
-		root.update()
-		vs_tar.close()
-		return True
-	except:
-		InfoMessage.set('Error in writing the VS package...')
-		tkMessageBox.showwarning("Tar file error", "Unable to perform the operation.") 
-		if DEBUG: print "problems in creating the tar file"
-		return False
-
-
-def MakeZip(source_dir, zipfilename):
-	# compression level
-	compression = zipfile.ZIP_DEFLATED
-
-	zipfilename += ".zip"
-	prefix = os.path.basename(source_dir)
-	file_list = []
-	InfoMessage.set('Creating the zip file...')
-	root.update()
-	try:
-		output = zipfile.ZipFile(zipfilename, mode = 'w')
-	except:
-		InfoMessage.set('Zip file creation error!')
-		root.update()
-		return False
-	for ROOT, SUBFOLDERS, FILES in os.walk(source_dir):
-		if DEBUG:
-			print "=================\nMAKEZIP > "
-			print "ROOT", ROOT
-			print "\tSUBFOLDS", SUBFOLDERS
-			print "\t\tFILES", FILES
-		for item in FILES:
-			file_list.append(os.path.join(ROOT,item))
-
-	for item in file_list:
-		if DEBUG: print "Adding |%s| to %s" % (item, zipfilename)
-		if not zipfilename in item: # to avoid a nice infinite, disk-hungry loop
-			try:
-				tmp = item
-				shortname = tmp.replace(source_dir, prefix)
-				output.write(item, arcname = shortname, compress_type = compression)
-				InfoMessage.set('Adding files to the Zip file...(this could take a while)')
-				root.update()
-			except:
-				InfoMessage.set('Error adding files to the Zip archive!')
-				root.update()
-				return False
-	return True
-
 
 def ImportLigList(filename = None):
 	if not filename:
@@ -5414,7 +3934,7 @@ def ImportLigList(filename = None):
 		for item in list:
 			if not item[0] == "#":
 				item = item.rstrip()
-				if os.path.isfile(item):
+				if LigandExists(item):
 					found.append(item)
 				else:
 					missing.append(item)
@@ -5457,14 +3977,11 @@ def ExportLigList():
 
 		list = []
 		if SaveLig.get() == "all":
-			for ligand in LigandDictionary:
-				list.append(ligand)
+			list = LigandDictionary.keys()
 		if SaveLig.get() == "accepted":
-			for ligand in LigandDictionary:
-				if LigandDictionary[ligand]["accepted"]: list.append(ligand)
+			list = LigandDictionary.accepted_names()
 		if SaveLig.get() == "rejected":
-			for ligand in LigandDictionary:
-				if not LigandDictionary[ligand]["accepted"]: list.append(ligand)
+			list = LigandDictionary.rejected_names()
 		if len(list):
 			if not filename:
 				filename = asksaveasfilename(title = "Select a ligand list file......", filetypes = [('Raccoon log file', '*.log'), ("Any file...", "*")] , defaultextension =[("Any file...", '*')])
@@ -5489,12 +4006,9 @@ def ExportLigList():
 	except:
 		DisableInterface()	
 
-		rejected = 0
-		total = len(LigandDictionary.keys())
-		for item in LigandDictionary.keys():
-			if not LigandDictionary[item]["accepted"]:
-				rejected += 1
-		accepted = total - rejected
+		total = len(LigandDictionary)
+		accepted = LigandDictionary.count_accepted()
+		rejected = total - accepted
 
 		all_msg      = "All ligands    [ %d ]" % total
 		accepted_msg = "Accepted [ %d ]" % accepted
@@ -5515,6 +4029,136 @@ def ExportLigList():
 		Button(ExportLigWin, text = "Cancel", command = ExportAbort).grid(row = 10, column = 1, padx = 3, pady= 10)
 		#EnableInterface()
 
+class LigandListView:
+	"""Virtualized list of the ligands in the LigandDictionary.
+
+	Only the rows that fit in the window are inserted in the Listbox, and
+	they are rendered again from the table when scrolling, searching or
+	after the ligands change (accepted/rejected colors included), so the
+	cost of the list does not depend on the number of ligands.
+	"""
+
+	def __init__(self, parent, table, font):
+		self.table = table
+		self.first = 0 # first visible row
+		self.rows = 20 # number of visible rows
+		self.matches = None # table rows matching the search (None : all the ligands)
+		self.selected = {} # selected ligands (kept while scrolling)
+		self.pending = None
+		self.search = StringVar()
+		self.position = StringVar()
+
+		SearchFrame = Frame(parent)
+		Label(SearchFrame, text = "Search :").pack(side = LEFT)
+		SearchEntry = Entry(SearchFrame, textvariable = self.search)
+		SearchEntry.pack(side = LEFT, fill = X, expand = 1)
+		SearchEntry.bind("<Return>", lambda event : self.find())
+		Button(SearchFrame, text = "Find", command = self.find).pack(side = LEFT)
+		Button(SearchFrame, text = "Show all", command = self.show_all).pack(side = LEFT)
+		Label(SearchFrame, textvariable = self.position, width = 24, anchor = E).pack(side = RIGHT)
+		SearchFrame.pack(fill = X, side = TOP)
+
+		self.listbox = Listbox(parent, selectmode = EXTENDED, fg = 'black', font = font)
+		self.scroll = Scrollbar(parent, command = self.yview)
+		self.scroll.pack(anchor = N, side = RIGHT, fill = 'y')
+		self.listbox.pack(fill = BOTH, expand = 1)
+		self.linespace = tkFont.Font(font = font).metrics("linespace") + 1
+		self.listbox.bind("<Configure>", self.resize)
+		self.listbox.bind("<<ListboxSelect>>", self.select)
+		self.listbox.bind("<MouseWheel>", lambda event : self.yview("scroll", -event.delta / 120, "units"))
+		self.listbox.bind("<Button-4>", lambda event : self.yview("scroll", -3, "units"))
+		self.listbox.bind("<Button-5>", lambda event : self.yview("scroll", 3, "units"))
+		self.listbox.bind("<Prior>", lambda event : self.yview("scroll", -1, "pages"))
+		self.listbox.bind("<Next>", lambda event : self.yview("scroll", 1, "pages"))
+
+	def size(self):
+		if self.matches is None:
+			return len(self.table)
+		return len(self.matches)
+
+	def yview(self, *args):
+		# scrollbar protocol: ("moveto", fraction) or ("scroll", n, "units"/"pages")
+		if args[0] == "moveto":
+			first = int(float(args[1]) * self.size())
+		elif args[2] == "pages":
+			first = self.first + int(args[1]) * self.rows
+		else:
+			first = self.first + int(args[1])
+		self.first = max(0, min(first, self.size() - self.rows))
+		self.render()
+		return "break"
+
+	def resize(self, event):
+		rows = max(1, event.height / self.linespace)
+		if not rows == self.rows:
+			self.rows = rows
+			self.render()
+
+	def refresh(self):
+		# the table changed: render again when idle (many changes, one update)
+		if self.pending is None:
+			self.pending = self.listbox.after_idle(self.update)
+
+	def update(self):
+		self.pending = None
+		if self.matches is not None:
+			self.find()
+		else:
+			self.render()
+
+	def render(self):
+		names = self.table.names
+		accepted = self.table.accepted()
+		size = self.size()
+		self.first = max(0, min(self.first, size - self.rows))
+		last = min(self.first + self.rows, size)
+		self.listbox.delete(0, END)
+		for item in range(self.first, last):
+			if self.matches is None:
+				row = item
+			else:
+				row = self.matches[item]
+			self.listbox.insert(END, names[row])
+			if not accepted[row]:
+				self.listbox.itemconfig(END, fg = 'red')
+			if self.selected.has_key(names[row]):
+				self.listbox.selection_set(END)
+		if size:
+			self.scroll.set(float(self.first) / size, float(last) / size)
+			self.position.set("[ %d-%d / %d ]" % (self.first + 1, last, size))
+		else:
+			self.scroll.set(0, 1)
+			self.position.set("")
+
+	def select(self, event = None):
+		chosen = [ int(item) for item in self.listbox.curselection() ]
+		for item, name in enumerate(self.listbox.get(0, END)):
+			if item in chosen:
+				self.selected[name] = True
+			elif self.selected.has_key(name):
+				del self.selected[name]
+
+	def selection(self):
+		# selected ligands (including the ones not visible)
+		return [ name for name in self.selected if self.table.has_key(name) ]
+
+	def clear_selection(self):
+		self.selected.clear()
+
+	def find(self):
+		text = self.search.get()
+		if not text:
+			return self.show_all()
+		self.matches = [ row for row, name in enumerate(self.table.names) if text in name ]
+		self.first = 0
+		self.render()
+
+	def show_all(self):
+		self.search.set("")
+		self.matches = None
+		self.render()
+
+
 # Ligand page ############### p1 ################################
 LigandButtonsGroup = Frame(p1, relief = FLAT)
 AddLigandsButton = Button(LigandButtonsGroup, text='[ + ] Add ligands...', command = openLigand)
@@ -5526,13 +4170,7 @@ AddLigandsDirRecursiveButton.pack(expand=YES, anchor=CENTER, side=LEFT)
 
 LigandButtonsGroup.pack(fill = 'both', expand = 0, padx = 5, pady = 5, anchor = S)
 Ligand_group = Pmw.Group(p1, tag_textvariable = LigandListLabel)
-LigandScrolledListBox = Listbox(Ligand_group.interior(), selectmode=EXTENDED)
-LigandScroll = Scrollbar(Ligand_group.interior(), command=LigandScrolledListBox.yview)
-LigandScroll.pack(anchor = N, side = RIGHT, fill = 'y')
-LigandScrolledListBox.configure(yscrollcommand=LigandScroll.set)
-LigandScrolledListBox.grid(row = 1, column = 0, columnspan = 3, sticky = N+S+W+E)
-LigandScrolledListBox.config(fg = 'black', font = ("Helvetica", 11, "bold"))
-LigandScrolledListBox.pack(fill = BOTH, expand = 1)
+LigandList = LigandListView(Ligand_group.interior(), LigandDictionary, ("Helvetica", 11, "bold"))
 Ligand_group.pack(fill = BOTH, expand = 1, padx = 10, pady = 10, side = TOP , anchor = N)
 
 LigandPDBQTOptButton = Button(p1, text = "PDBQT generation options", command = LigandImportOptions)
@@ -5626,10 +4264,13 @@ Summary_group2 = Pmw.Group(p5, tag_text = 'OS Options')
 LinuxOptionsPanel = Pmw.Group(Summary_group2.interior(), tag_pyclass = None)
 PBSOptionsPanel = Pmw.Group(Summary_group2.interior(), tag_pyclass = None)
 WinOptionsPanel = Pmw.Group(Summary_group2.interior(), tag_pyclass = None)
+VinaOptionsPanel = Pmw.Group(Summary_group2.interior(), tag_pyclass = None)
 SystemButton1 = Radiobutton(Summary_group2.interior(), text='Workstation', value='lin', variable=TargetOS, command = GetOSoption)
 SystemButton1.grid(row = 1, column = 0, sticky = W)
 SystemButton2 = Radiobutton(Summary_group2.interior(), text='Linux cluster', value='pbs', variable=TargetOS, command = GetOSoption)
 SystemButton2.grid(row = 1, column = 1, sticky = W)
+SystemButton3 = Radiobutton(Summary_group2.interior(), text='AutoDock Vina', value='vina', variable=TargetOS, command = GetOSoption)
+SystemButton3.grid(row = 1, column = 2, sticky = W)
 
 
 if system == "Linux" or system == "Darwin":
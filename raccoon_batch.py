@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+#
+# Raccoon batch
+#
+# Generate a virtual screening without the graphical interface
+# (Tkinter/Pmw are not required: MGLTools are still needed
+# for the PDBQT, GPF and DPF generation).
+#
+#   usage: python raccoon_batch.py config.ini
+#
+# The VS is described by a config file:
+#
+#   [ligands]
+#   files       = lig1.pdbqt library.pdbqt *.mol2    ; PDBQT, PDBQT libraries, PDB, (multi)MOL2
+#   directories = /data/ligands                      ; all the ligands in the directories
+#   recursive   = no
+#   library_dir = /data/libraries                    ; PDBQT libraries from multi-MOL2 [ output directory ]
+#   workers     = 4                                  ; PDBQT conversion processes [ all the cores ]
+#
+#   [filters]
+#   preset      = Lipinski-like                      ; Default, Lipinski-like, DrugLikeness, DrugLikeness (frag)
+#   mw          = 160 480                            ; min max, overrides the preset (also hbd, hba, nat, torsdof)
+#   reject_nonstd = yes                              ; reject non-AutoDock atom types
+#
+#   [receptors]
+#   files         = rec1.pdbqt rec2.pdb              ; PDB/MOL2 are converted to PDBQT
+#   flexres_file  = flex.pdbqt                       ; flexible residues (or)
+#   flex_residues = ARG8,THR276                      ; flexible residues generated from each receptor
+#
+#   [maps]
+#   mode     = job                                   ; job (AutoGrid in each job), now (calculated now), cached
+#   gpf      = template.gpf                          ; job, now
+#   gpf_parameter_file =
+#   autogrid = autogrid4                             ; now
+#   map_dir  = /data/maps                            ; cached (a directory or a .rmap container)
+#   policy   = copy                                  ; copy, link (now, cached)
+#
+#   [docking]
+#   dpf      = template.dpf
+#   dpf_parameter_file =
+#
+#   [vina]                                           ; target = vina
+#   num_modes      = 9
+#   exhaustiveness = 8
+#   cpu            = 1                               ; --cpu of each Vina job
+#
+#   [funnel]                                         ; target = vina: run the screening now, in two stages
+#   vina     = vina
+#   fraction = 0.1                                   ; best ligands docked again at the [vina] exhaustiveness
+#   fast     = 1                                     ; exhaustiveness of the first stage
+#   rank     = score                                 ; score, efficiency (score per heavy atom)
+#   jobs     = 4                                     ; Vina processes at the same time [ cores / cpu ]
+#   batch    = 1                                     ; ligands docked by each Vina process
+#   timeout  =                                       ; seconds before a docking is stopped [ none ]
+#
+#   [output]
+#   directory = /data/vs
+#   target    = lin                                  ; lin, pbs, win, vina
+#   scripts   = master                               ; master, single, none
+#   package   = none                                 ; none, tar, gz, bz2, zip (one file per worker)
+#   pbs_time  = 24:00:00
+#   pbs_runs  = 1
+#   workers   = 4                                    ; job generation processes [ all the cores ]
+#
+# With target = vina the [maps] gpf only sets the search space (center and
+# size = npts * spacing) of the Vina config written for each receptor:
+# no maps are calculated and the [docking] section is not used.
+# With a [funnel] section the accepted ligands are then docked on each
+# receptor with a fast first stage (<receptor>/stage1), and the best
+# fraction of them again with the full exhaustiveness (<receptor>/stage2,
+# see vina_screen.py); the funnel is recorded in the log (FUNNEL> lines).
+#
+# The log written in the output directory can be loaded in Raccoon.
+# Running again on the same output directory (and settings) resumes
+# an interrupted generation.
+#
+# v.1.0.0  Stefano Forli
+#
+# Copyright 2009, Molecular Graphics Lab
+# 	The Scripps Research Institute
+#
+#################################################################
+#
+#     This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+#################################################################
+
+import os
+import sys
+import glob
+import time
+import datetime
+import platform
+import ConfigParser
+
+from raccoon_engine import CPUCount, LigandPrepOptions, ConversionPool, PropertyCache, LigandTable, LigandFilter
+from raccoon_engine import CountMol2, Mol2Index, GetLibrary, IsLibraryFile, LibraryWriter, CheckLigand, ATOM_WEIGHTS
+from raccoon_engine import ReceptorPrepOptions, ConvertReceptor, CheckReceptor, MapDirIndex, PackedMaps, RMAP_SUFFIX
+from raccoon_engine import RaccoonError, StageTimer, VSSettings, VSGenerator, VSLogHeader, MakeDir, FilterRanges
+from raccoon_engine import FILTER_PRESETS, PACKAGE_FORMATS, TARGETS, MAPS_IN_JOB, MAPS_NOW, MAPS_CACHED, VINA_CONFIG
+from vina_screen import VinaFunnel, FUNNEL_RANKS, LigandName
+
+version = "1.0  "
+
+MAP_MODES = { 'job' : MAPS_IN_JOB, 'now' : MAPS_NOW, 'cached' : MAPS_CACHED }
+FILTERS = { 'hbd' : "HbD", 'hba' : "HbA", 'mw' : "MW", 'nat' : "Nat", 'torsdof' : "TORSDOF" }
+PROGRESS_EVERY = 5. # seconds between progress lines
+
+
+def Get(config, section, option, default = ""):
+	if config.has_option(section, option):
+		return config.get(section, option).strip()
+	return default
+
+
+def GetList(config, section, option):
+	return Get(config, section, option).split()
+
+
+def GetBoolean(config, section, option, default = False):
+	if config.has_option(section, option):
+		return config.getboolean(section, option)
+	return default
+
+
+def ReadText(filename):
+	infile = open(filename, 'r')
+	try:
+		return infile.read()
+	finally:
+		infile.close()
+
+
+def Which(program):
+	# full path of an executable (given with its path or in the PATH), None if missing
+	if os.path.dirname(program):
+		paths = [ "" ]
+	else:
+		paths = os.environ.get("PATH", "").split(os.pathsep)
+	for path in paths:
+		for exe_file in (os.path.join(path, program), os.path.join(path, program+".exe")):
+			if os.path.isfile(exe_file) and os.access(exe_file, os.X_OK):
+				return exe_file
+	return None
+
+
+def Message(text):
+	print text
+	sys.stdout.flush()
+
+
+class Progress:
+	"""Print a progress line every PROGRESS_EVERY seconds."""
+
+	def __init__(self, what, total):
+		self.what = what
+		self.total = total
+		self.start = self.last = time.time()
+
+	def update(self, done, force = False):
+		now = time.time()
+		if not force and now - self.last < PROGRESS_EVERY:
+			return
+		self.last = now
+		elapsed = max(now - self.start, 1e-9)
+		Message("  %s [ %d | %d ]  %.1f/s" % (self.what, done, self.total, done / elapsed))
+
+
+#########################################################################################################
+#### Ligands
+
+def LigandFiles(config):
+	# OUTPUT : list of the ligand files listed in the config
+	files = []
+	for pattern in GetList(config, "ligands", "files"):
+		files.extend(sorted(glob.glob(pattern)) or [ pattern ])
+	recursive = GetBoolean(config, "ligands", "recursive")
+	for directory in GetList(config, "ligands", "directories"):
+		if recursive:
+			for ROOT, SUBFOLDERS, FILES in os.walk(directory):
+				for item in sorted(FILES):
+					files.append(os.path.join(ROOT, item))
+		else:
+			for item in sorted(os.listdir(directory)):
+				files.append(os.path.join(directory, item))
+	return [ f for f in files if os.path.splitext(f)[1].lower() in (".pdbqt", ".pdb", ".mol2") ]
+
+
+def RegisterLigand(table, cache, filename):
+	# append the ligand properties to the ligand table
+	if table.has_key(filename):
+		return
+	properties = cache.get(filename, ATOM_WEIGHTS)
+	properties["accepted"] = not properties["NotStdAT"]
+	table[filename] = properties
+
+
+def ImportLigands(config, table, cache, output_dir):
+	# INFO   : register all the ligands (PDB/MOL2 are converted to PDBQT first)
+	# OUTPUT : list of the files rejected
+	pdbqt, single, libraries, rejected = [], [], [], []
+	for filename in LigandFiles(config):
+		ext = os.path.splitext(filename)[1].lower()
+		if not os.path.isfile(filename):
+			rejected.append(filename)
+		elif ext == ".pdbqt":
+			pdbqt.append(filename)
+		elif ext == ".mol2" and CountMol2(filename) > 1:
+			libraries.append(filename)
+		else:
+			single.append(filename)
+
+	workers = int(Get(config, "ligands", "workers", CPUCount()))
+	converter = ConversionPool(LigandPrepOptions(), workers = workers, timeout = PROGRESS_EVERY)
+	if single:
+		Message("Converting %d ligands to PDBQT (%d processes)" % (len(single), converter.workers))
+		progress = Progress("converted", len(single))
+		for result in converter.run([ (f, os.path.splitext(f)[0]+".pdbqt") for f in single ]):
+			if result:
+				infile, outfile, success, error = result
+				if success:
+					pdbqt.append(outfile)
+				else:
+					rejected.append(infile)
+			progress.update(converter.done + len(converter.failed))
+
+	library_dir = Get(config, "ligands", "library_dir", output_dir)
+	for library in libraries:
+		MakeDir(library_dir)
+		output = os.path.join(library_dir, os.path.splitext(os.path.basename(library))[0]+".pdbqt")
+		records = Mol2Index(library)
+		Message("Converting %s (%d molecules) in the library %s" % (library, CountMol2(library), output))
+		progress = Progress("converted", CountMol2(library))
+		writer = LibraryWriter(output)
+		try:
+			for result in converter.run_library(library, records):
+				if result:
+					name, text, success, error = result
+					if success:
+						RegisterLigand(table, cache, writer.add(name, text))
+					else:
+						rejected.append(library+":"+name)
+				progress.update(converter.done + len(converter.failed))
+		finally:
+			writer.close()
+		cache.refresh(output) # the ligands were cached while the library was written
+
+	progress = Progress("registered", len(pdbqt))
+	for count, filename in enumerate(pdbqt):
+		if IsLibraryFile(filename):
+			for ligand in GetLibrary(filename).paths():
+				RegisterLigand(table, cache, ligand)
+		elif CheckLigand(filename):
+			RegisterLigand(table, cache, filename)
+		else:
+			rejected.append(filename)
+		progress.update(count + 1)
+	cache.commit()
+	return rejected
+
+
+def FilterSettings(config):
+	# OUTPUT : ({ property : (min, max) }, reject non-standard atom types)
+	preset = Get(config, "filters", "preset", "Default")
+	if not FILTER_PRESETS.has_key(preset):
+		raise RaccoonError("Unknown filter preset: %s (available: %s)" % (preset, ", ".join(sorted(FILTER_PRESETS.keys()))))
+	ranges = FilterRanges(preset)
+	for option, field in FILTERS.items():
+		values = GetList(config, "filters", option)
+		if values:
+			ranges[field] = (int(values[0]), int(values[1]))
+	return ranges, GetBoolean(config, "filters", "reject_nonstd", True)
+
+
+#########################################################################################################
+#### Receptors, maps, docking
+
+def Receptors(config):
+	# OUTPUT : list of the receptor PDBQT's (PDB/MOL2 are converted)
+	receptors = []
+	for pattern in GetList(config, "receptors", "files"):
+		for filename in sorted(glob.glob(pattern)) or [ pattern ]:
+			if not os.path.splitext(filename)[1].lower() == ".pdbqt":
+				output = os.path.splitext(filename)[0]+".pdbqt"
+				Message("Converting the receptor %s" % filename)
+				if not ConvertReceptor(filename, output, ReceptorPrepOptions()):
+					raise RaccoonError("Problems converting the receptor %s" % filename)
+				filename = output
+			problem = CheckReceptor(filename)
+			if problem:
+				raise RaccoonError("%s : %s" % (filename, problem))
+			receptors.append(os.path.abspath(filename))
+	if not receptors:
+		raise RaccoonError("No receptors defined.")
+	return receptors
+
+
+def Settings(config):
+	# OUTPUT : VSSettings() from the config
+	target = Get(config, "output", "target", "lin")
+	if not TARGETS.has_key(target):
+		raise RaccoonError("Unknown target: %s (available: %s)" % (target, ", ".join(sorted(TARGETS.keys()))))
+	if target == "vina":
+		return VSSettings(gpf_text = ReadText(Get(config, "maps", "gpf")), map_source = MAPS_IN_JOB,
+				flexres_file = FlexresFile(config), flex_residues = Get(config, "receptors", "flex_residues") or None,
+				target = target, scripts = Scripts(config), package = Package(config),
+				vina_modes = int(Get(config, "vina", "num_modes", 9)),
+				vina_exhaustiveness = int(Get(config, "vina", "exhaustiveness", 8)),
+				vina_cpu = int(Get(config, "vina", "cpu", 1)), version = version)
+	mode = Get(config, "maps", "mode", "job")
+	if not MAP_MODES.has_key(mode):
+		raise RaccoonError("Unknown map mode: %s (available: job, now, cached)" % mode)
+	map_source = MAP_MODES[mode]
+	gpf_text, autogrid, map_dir, map_files = "", None, "", None
+	if map_source <= MAPS_NOW:
+		gpf_text = ReadText(Get(config, "maps", "gpf"))
+	if map_source == MAPS_NOW:
+		autogrid = Which(Get(config, "maps", "autogrid", "autogrid4"))
+		if not autogrid:
+			raise RaccoonError("The AutoGrid binary file is required for pre-caching maps.")
+	if map_source == MAPS_CACHED:
+		map_dir = os.path.abspath(Get(config, "maps", "map_dir"))
+		if map_dir.endswith(RMAP_SUFFIX): # unpacked in the VS directory
+			packed = PackedMaps(map_dir)
+			map_files, bad_maps = [ map_dir ], packed.problems()
+			packed.close()
+		else:
+			index = MapDirIndex(map_dir)
+			map_files, bad_maps = index.files, index.problems
+		if not map_files:
+			raise RaccoonError("No maps found in %s" % map_dir)
+		if bad_maps:
+			raise RaccoonError("The maps in %s are not consistent:\n%s" % (map_dir,
+					"\n".join([ "  %s : %s" % (os.path.basename(name), problem) for name, problem in bad_maps ])))
+
+	return VSSettings(gpf_text = gpf_text, dpf_text = ReadText(Get(config, "docking", "dpf")), map_source = map_source,
+			gpf_parameter_file = Get(config, "maps", "gpf_parameter_file"),
+			dpf_parameter_file = Get(config, "docking", "dpf_parameter_file"),
+			autogrid = autogrid, map_dir = map_dir, map_files = map_files,
+			symlink = Get(config, "maps", "policy", "copy") == "link",
+			flexres_file = FlexresFile(config), flex_residues = Get(config, "receptors", "flex_residues") or None,
+			target = target, scripts = Scripts(config), win_batch = target == "win",
+			pbs_time = Get(config, "output", "pbs_time", "24:00:00"), pbs_runs = int(Get(config, "output", "pbs_runs", 1)),
+			package = Package(config), version = version)
+
+
+def Scripts(config):
+	scripts = Get(config, "output", "scripts", "master")
+	if scripts == "none":
+		return None
+	return scripts
+
+
+def Package(config):
+	package = Get(config, "output", "package", "none")
+	if package == "none":
+		return None
+	if not PACKAGE_FORMATS.has_key(package):
+		raise RaccoonError("Unknown package format: %s" % package)
+	return package
+
+
+def FlexresFile(config):
+	flexres_file = Get(config, "receptors", "flexres_file") or None
+	if flexres_file:
+		return os.path.abspath(flexres_file)
+	return None
+
+
+#########################################################################################################
+#### Vina funnel
+
+def Funnel(config, settings, targets, table, ligands):
+	# INFO   : dock the ligands of the generated Vina jobs ([funnel]), one receptor at a time
+	# OUTPUT : list of lines for the log
+	vina = Which(Get(config, "funnel", "vina", "vina"))
+	if not vina:
+		raise RaccoonError("Vina executable not found: %s" % Get(config, "funnel", "vina", "vina"))
+	vina = os.path.abspath(vina) # Vina runs in the receptor directories
+	rank = Get(config, "funnel", "rank", "score")
+	if not rank in FUNNEL_RANKS:
+		raise RaccoonError("Unknown funnel rank: %s (available: %s)" % (rank, ", ".join(FUNNEL_RANKS)))
+	fraction = float(Get(config, "funnel", "fraction", 0.1))
+	fast = int(Get(config, "funnel", "fast", 1))
+	jobs = Get(config, "funnel", "jobs") and int(Get(config, "funnel", "jobs")) or None
+	timeout = Get(config, "funnel", "timeout") and float(Get(config, "funnel", "timeout")) or None
+	lines = [ "vina : %s, stage 1 at exhaustiveness %d, best %.1f%% at %d" % (vina, fast, fraction * 100,
+			settings['vina_exhaustiveness']) ]
+	for target in targets:
+		# the ligands of the jobs (journal: job directories in ligand order)
+		job_ligands = [ os.path.join(job_dir, os.path.basename(ligand)) for job_dir, ligand in zip(target['journal'], ligands) ]
+		heavy_atoms = {}
+		for job_ligand, ligand in zip(job_ligands, ligands):
+			heavy_atoms[job_ligand] = table[ligand]["Nat"]
+		try:
+			funnel = VinaFunnel(vina, VINA_CONFIG, target['path'], fraction, fast, settings['vina_exhaustiveness'], rank,
+					heavy_atoms, jobs = jobs, cpu = settings['vina_cpu'], timeout = timeout,
+					batch = int(Get(config, "funnel", "batch", 1)), cwd = target['path'])
+		except ValueError, e:
+			raise RaccoonError(str(e))
+		Message("Docking %d ligands on %s" % (len(job_ligands), target['name']))
+		progress = { "stage1" : Progress("stage 1", len(job_ligands)), "stage2" : None }
+		done = { "stage1" : 0, "stage2" : 0 }
+		try:
+			for stage, result in funnel.run(job_ligands):
+				if progress[stage] is None:
+					progress[stage] = Progress("stage 2", len(funnel.selected))
+				if result:
+					done[stage] += 1
+					if not result[1] == 'docked':
+						Message("  %s : %s (%s)" % (LigandName(result[0]), result[1], result[3]))
+				progress[stage].update(done[stage])
+		finally:
+			funnel.stop()
+		for line in funnel.report():
+			Message("  "+line)
+			lines.append("%s : %s" % (target['name'], line))
+	return lines
+
+
+#########################################################################################################
+#### VS generation
+
+def Generate(config):
+	# INFO   : run the whole VS generation described by the config
+	# OUTPUT : number of jobs generated
+	timer = StageTimer()
+	path = os.path.abspath(Get(config, "output", "directory"))
+	if not Get(config, "output", "directory"):
+		raise RaccoonError("The output directory is not defined.")
+	MakeDir(path)
+
+	timer.start("import")
+	table = LigandTable()
+	cache = PropertyCache()
+	rejected = ImportLigands(config, table, cache, path)
+	hits, misses, invalidated = cache.stats()
+	Message("%d ligands imported, %d rejected [ cache : %d hits | %d misses | %d invalidated ]" % \
+			(len(table), len(rejected), hits, misses, invalidated))
+
+	timer.start("filters")
+	ranges, reject = FilterSettings(config)
+	table.set_accepted(LigandFilter(table).select(ranges, reject_nonstd = reject))
+	ligands = table.accepted_names()
+	Message("%d ligands accepted, %d rejected by the filters" % (len(ligands), len(table) - len(ligands)))
+	if not ligands:
+		raise RaccoonError("No ligands accepted for the virtual screening.")
+
+	timer.start("setup")
+	receptors = Receptors(config)
+	settings = Settings(config)
+	workers = int(Get(config, "output", "workers", CPUCount()))
+	generator = VSGenerator(settings, table.atom_types(table.accepted()), message = Message, workers = workers,
+			table = table)
+
+	date = datetime.datetime.now()
+	log_name = path+os.sep+"raccoonVS-"+str(date.year)+"."+str(date.month)+"."+str(date.day)+".log"
+	info = {	'date'		: date.strftime("%Y-%B-%d %H:%M"),
+			'outdir'	: path,
+			'os'		: platform.uname()[0],
+			'machine'	: platform.uname()[1],
+			'filters'	: ranges,
+			'reject'	: reject,
+			'receptors'	: receptors,
+			'single'	: len(receptors) == 1,
+			'ligands'	: ligands }
+	log_file = open(log_name, 'w')
+	print >> log_file, VSLogHeader(settings, info)
+	timer.stop()
+
+	jobs_todo = len(receptors) * len(ligands)
+	Message("Generating %d docking jobs in %s" % (jobs_todo, path))
+	progress = Progress("jobs", jobs_todo)
+	targets = []
+	try:
+		for runs in generator.maps(receptors, path):
+			pass
+		for receptor in receptors:
+			target = generator.receptor(receptor, path)
+			for done in generator.jobs(target, ligands):
+				progress.update(generator.done)
+			generator.close(target)
+			targets.append(target)
+		generator.finish()
+		progress.update(generator.done, force = True)
+		if generator.skipped:
+			Message("%d jobs were already generated (resumed)" % generator.skipped)
+		package = generator.package(path)
+		if package:
+			Message("VS package written: %s" % ", ".join(package))
+		funnel = []
+		if settings['target'] == "vina" and config.has_section("funnel"):
+			timer.start("funnel")
+			funnel = Funnel(config, settings, targets, table, ligands)
+			timer.stop()
+	except RaccoonError, e:
+		generator.stop()
+		print >> log_file, ("\n\n\n#### ERROR ###\n\n%s\n\n VS generation aborted.\n\n####      ####" % e)
+		log_file.close()
+		raise
+
+	timer.add(generator.timer)
+	print >> log_file, "\n\t\t\t process completed successfully.\n\n"
+	if generator.skipped:
+		print >> log_file, "RESUMED>\t%d jobs were already generated in the directory\n" % generator.skipped
+	print >> log_file, "RECEPTORS>\tcache : %d hits | %d misses\n" % generator.receptors.stats()
+	print >> log_file, "MAPS>\tstore : %d hits | %d misses" % generator.store.stats()
+	for line in generator.links.report():
+		print >> log_file, "MAPS>\t"+line
+	for line in generator.warnings:
+		print >> log_file, "VINA>\tWARNING "+line
+	for line in funnel:
+		print >> log_file, "FUNNEL>\t"+line
+	print >> log_file
+	for line in timer.report():
+		print >> log_file, "TIMING>\t"+line
+	print >> log_file, "\n\n\n[DONE]"
+	log_file.close()
+
+	Message("Receptor cache : %d hits | %d misses" % generator.receptors.stats())
+	Message("Map store      : %d hits | %d misses" % generator.store.stats())
+	for line in generator.links.report():
+		Message("  maps "+line)
+	Message("\nTimings:")
+	for line in timer.report():
+		Message("  "+line)
+	return generator.done
+
+
+if __name__ == "__main__":
+	if not len(sys.argv) == 2:
+		print "usage: python %s config.ini" % os.path.basename(sys.argv[0])
+		sys.exit(1)
+	config = ConfigParser.RawConfigParser()
+	if not config.read(sys.argv[1]):
+		print "ERROR: unable to read the config file %s" % sys.argv[1]
+		sys.exit(1)
+	try:
+		jobs = Generate(config)
+	except (RaccoonError, IOError, OSError, ConfigParser.Error), e:
+		print "ERROR: %s" % e
+		sys.exit(1)
+	print "\n%d docking jobs have been successfully generated." % jobs
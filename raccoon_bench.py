@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+#
+# Raccoon benchmarks
+#
+# Timings of the Raccoon engine routines against the
+# implementation they replaced.
+#
+#   usage: python raccoon_bench.py [ benchmark ] [ size ]
+#
+#   benchmarks:
+#     hbd    : ligand registration (H-bond donors detection)
+#     dpf    : DPF generation (DPFTemplate vs PrepareDPF, needs MGLTools)
+#     gpf    : GPF generation (GPFTemplate vs PrepareGPF, needs MGLTools)
+#     maps   : map validation (CheckMaps vs reading the maps line by line)
+#     rmap   : .rmap round trip (PackMaps/UnpackMaps, plain and zlib) of the
+#              maps, fld, xyz and of maps that can only be packed as text
+#     vina   : per-ligand time of Vina with batches of 1, 2, 4... ligands
+#              per process (vina in the PATH or $VINA, batches need Vina 1.2)
+#
+# v.1.0.0  Stefano Forli
+#
+# Copyright 2009, Molecular Graphics Lab
+# 	The Scripps Research Institute
+#
+#################################################################
+#
+#     This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+#################################################################
+
+import os
+import sys
+import time
+from math import sqrt
+
+from raccoon_engine import LigandProperties, ATOM_WEIGHTS, PrepareDPF, DPFValues, DPFTemplate
+from raccoon_engine import PrepareGPF, GPFParameters, GPFValues, GPFTemplate
+from raccoon_engine import CheckMaps, PackMaps, UnpackMaps
+from vina_screen import VinaRunner, Which
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEST_LIGAND = os.path.join(HERE, "ZINC00000052.pdbqt")
+
+WEIGHTS = ATOM_WEIGHTS
+
+
+def Timed(function, *args):
+	start = time.time()
+	result = function(*args)
+	return time.time() - start, result
+
+
+def Report(name, size, old, new):
+	print "%-8s %8d   old : %8.3f s   new : %8.3f s   speed-up : %6.1fx" % (name, size, old, new, old / max(new, 1e-9))
+
+
+#########################################################################################################
+#### hbd
+
+def _dist(firstline, secondline):
+	# the distance function used by LigandRegistration before the vectorization
+	coord1 = firstline[28:56].split()
+	coord2 = secondline[28:56].split()
+	for index in range(len(coord1)):
+		coord1[index] = float(coord1[index])
+		coord2[index] = float(coord2[index])
+	return sqrt((coord1[0]-coord2[0])**2+(coord1[1]-coord2[1])**2+(coord1[2]-coord2[2])**2)
+
+
+def OldProperties(ligand, weights):
+	# LigandRegistration property loop before the vectorization
+	current_atypes = []
+	BAD_ATOM_TYPE = False
+	MW  = 0
+	HbD = 0
+	HbA = 0
+	Nat = 0
+	TORSDOF = 0
+	hbd_h = []
+	hbd_candidate = []
+	for line in ligand:
+		if 'TORSDOF' in line:
+			TORSDOF = int(line.split()[1])
+		if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
+			atype = line.split()[-1]
+			if atype not in current_atypes:
+				current_atypes.append(atype)
+			if atype == "OA" or atype == "NA" or atype == "SA":
+				HbA += 1
+			if atype == "HD":
+				hbd_h.append(line)
+			else:
+				Nat += 1
+			if atype == "N" or atype == "O" or atype == "OA" or atype == "NA":
+				hbd_candidate.append(line)
+			try:
+				MW += weights[atype]
+			except:
+				MW += 10000
+				BAD_ATOM_TYPE = True
+	for atom in hbd_candidate:
+		for hydrogen in hbd_h:
+			if _dist(atom, hydrogen) <= 1.1:
+				HbD += 1
+				break
+	return { "Atypes" : current_atypes, "TORSDOF" : TORSDOF, "HbD" : HbD, "HbA" : HbA,
+		"MW" : MW, "Nat" : Nat, "NotStdAT" : BAD_ATOM_TYPE }
+
+
+def Protonated(lines):
+	# the test ligand has no HD: one is added 0.97 A away from every
+	# OA/N, so that the donor detection has some work to do
+	protonated = []
+	serial = 100
+	for line in lines:
+		protonated.append(line)
+		if (line[0:4] == 'ATOM' or line[0:6] == 'HETATM') and line.split()[-1] in ("OA", "N"):
+			serial += 1
+			x, y, z = float(line[30:38]) + 0.97, float(line[38:46]), float(line[46:54])
+			protonated.append("%s%5d  H   %s%8.3f%8.3f%8.3f%s HD\n" % (line[0:6], serial, line[17:30], x, y, z, line[54:76]))
+	return protonated
+
+
+def BigLigand(lines, copies):
+	# the test ligand replicated (translated by 10 A) in a single molecule:
+	# used to check the spatial grid path for big ligands
+	big = []
+	for i in range(copies):
+		for line in lines:
+			if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
+				x = float(line[30:38]) + 10. * i
+				line = "%s%8.3f%s" % (line[:30], x, line[38:])
+			big.append(line)
+	return big
+
+
+def NewProperties(ligand, weights):
+	# LigandProperties without the field added for the DPF
+	properties = LigandProperties(ligand, weights)
+	del properties["NDIHE"]
+	return properties
+
+
+def BenchHbd(size):
+	lines = open(TEST_LIGAND).readlines()
+	for name, ligand in ( ("hbd", lines), ("hbd+H", Protonated(lines)) ):
+		library = [ ligand ] * size
+		old, old_result = Timed(lambda: [ OldProperties(l, WEIGHTS) for l in library ])
+		new, new_result = Timed(lambda: [ NewProperties(l, WEIGHTS) for l in library ])
+		if not old_result == new_result:
+			print "ERROR: different results", old_result[0], new_result[0]
+			return False
+		Report(name, size, old, new)
+	big = BigLigand(Protonated(lines), 200)
+	old, old_result = Timed(OldProperties, big, WEIGHTS)
+	new, new_result = Timed(NewProperties, big, WEIGHTS)
+	if not old_result == new_result:
+		print "ERROR: different results (big ligand)", old_result["HbD"], new_result["HbD"]
+		return False
+	Report("hbd-big", len(big), old, new)
+	return True
+
+
+#########################################################################################################
+#### dpf, gpf
+
+GPF_TEMPLATE = """npts 40 40 40
+spacing 0.375
+gridcenter 2.5 6.5 -7.5
+smooth 0.5
+dielectric -0.1465
+"""
+
+def BenchTemplate(name, size, prepare, template_class, values):
+	# ADT (prepare(output, receptor)) against the template compiled from its output
+	import tempfile, shutil
+	try:
+		import AutoDockTools
+	except ImportError:
+		print "%-8s skipped (MGLTools not available)" % name
+		return True
+	tmpdir = tempfile.mkdtemp(prefix = "raccoon_bench_")
+	try:
+		receptor = os.path.join(tmpdir, "receptor.pdbqt")
+		output_file = os.path.join(tmpdir, "ligand."+name)
+		shutil.copy(TEST_LIGAND, receptor)
+		def old_file():
+			for i in range(size):
+				prepare(output_file, receptor)
+			return open(output_file).read()
+		old, old_result = Timed(old_file)
+		template = template_class(old_result, TEST_LIGAND, values)
+		if not template.valid:
+			print "ERROR: the %s template can't reproduce ADT" % name
+			return False
+		def new_file():
+			for i in range(size):
+				output = open(output_file, 'w')
+				output.write(template.render(TEST_LIGAND, values))
+				output.close()
+			return open(output_file).read()
+		new, new_result = Timed(new_file)
+		if not old_result == new_result:
+			print "ERROR: different %s" % name
+			return False
+		Report(name, size, old, new)
+		return True
+	finally:
+		shutil.rmtree(tmpdir, True)
+
+
+def BenchDpf(size):
+	properties = LigandProperties(open(TEST_LIGAND).readlines(), WEIGHTS)
+	prepare = lambda output, receptor: PrepareDPF(output, receptor, TEST_LIGAND, "")
+	return BenchTemplate("dpf", size, prepare, DPFTemplate, DPFValues(properties))
+
+
+def BenchGpf(size):
+	properties = LigandProperties(open(TEST_LIGAND).readlines(), WEIGHTS)
+	parameters = GPFParameters(GPF_TEMPLATE) # parsed once, as in VSGenerator
+	prepare = lambda output, receptor: PrepareGPF(output, receptor, GPF_TEMPLATE, ligand_filename = TEST_LIGAND,
+			parameters = parameters)
+	return BenchTemplate("gpf", size, prepare, GPFTemplate, GPFValues(properties))
+
+
+#########################################################################################################
+#### maps
+
+MAP_NPTS = 80 # 81^3 points, ~3 Mb per map
+
+def ReadMaps(map_files):
+	# header comparison of CheckFolderMap, plus the count of the values
+	problems = []
+	reference = None
+	for name in map_files:
+		map_file = open(name)
+		header = [ map_file.readline() for i in range(6) ]
+		lines = 0
+		for line in map_file:
+			lines += 1
+		map_file.close()
+		points = 1
+		for n in header[4].split()[1:]:
+			points *= int(n) + 1
+		if reference is None:
+			reference = header[:1] + header[2:]
+		if not header[:1] + header[2:] == reference or not lines == points:
+			problems.append(name)
+	return problems
+
+
+def BenchMaps(size):
+	import tempfile, shutil
+	tmpdir = tempfile.mkdtemp(prefix = "raccoon_bench_")
+	try:
+		body = "".join([ "%.3f\n" % ((i % 997) * 0.001) for i in range((MAP_NPTS+1)**3) ])
+		map_files = []
+		for i in range(size):
+			name = os.path.join(tmpdir, "receptor.T%d.map" % i)
+			output = open(name, 'w')
+			output.write("GRID_PARAMETER_FILE receptor.gpf\nGRID_DATA_FILE receptor.maps.fld\nMACROMOLECULE receptor.pdbqt\n")
+			output.write("SPACING 0.375\nNELEMENTS %d %d %d\nCENTER 2.500 6.500 -7.500\n" % ((MAP_NPTS,) * 3))
+			output.write(i == size - 1 and body[:-6] or body) # the last one is truncated
+			output.close()
+			map_files.append(name)
+		old, old_result = Timed(ReadMaps, map_files)
+		new, new_result = Timed(CheckMaps, map_files)
+		if not old_result == [ name for name, problem in new_result ]:
+			print "ERROR: different results", old_result, new_result
+			return False
+		Report("maps", size, old, new)
+		return True
+	finally:
+		shutil.rmtree(tmpdir, True)
+
+
+def BenchRmap(size):
+	# every file must be unpacked byte for byte as it was packed; the maps
+	# with CRLF line ends, mixed decimals or no final newline are the ones
+	# packed as text
+	import tempfile, shutil
+	tmpdir = tempfile.mkdtemp(prefix = "raccoon_bench_")
+	try:
+		header = "GRID_PARAMETER_FILE receptor.gpf\nGRID_DATA_FILE receptor.maps.fld\nMACROMOLECULE receptor.pdbqt\n"
+		header += "SPACING 0.375\nNELEMENTS %d %d %d\nCENTER 2.500 6.500 -7.500\n" % ((MAP_NPTS,) * 3)
+		values = [ "%.3f\n" % ((i % 997) * 0.001 - 0.4) for i in range((MAP_NPTS+1)**3) ]
+		body = "".join(values)
+		files = {
+			"receptor.maps.fld" : "# AVS field file\n#\nndim=3\ndim1=%d\ndim2=%d\ndim3=%d\n" % ((MAP_NPTS+1,) * 3) +
+				"".join([ "variable %d file=receptor.T%d.map filetype=ascii skip=6\n" % (i+1, i) for i in range(size) ]),
+			"receptor.maps.xyz" : "-7.500 22.500\n-3.500 26.500\n-22.500 7.500\n",
+			"receptor.crlf.map" : (header + body).replace("\n", "\r\n"),
+			"receptor.mixed.map" : header + body.replace("0.001\n", "0.0010\n"),
+			"receptor.truncated.map" : header + body[:-1],
+			}
+		for i in range(size):
+			files["receptor.T%d.map" % i] = header + body
+		map_files = []
+		for name in sorted(files.keys()):
+			map_files.append(os.path.join(tmpdir, name))
+			output = open(map_files[-1], 'wb')
+			output.write(files[name])
+			output.close()
+		for compress in (False, True):
+			filename = os.path.join(tmpdir, "maps.rmap")
+			destination = tempfile.mkdtemp(prefix = "unpacked_", dir = tmpdir)
+			packing, (original, packed) = Timed(PackMaps, map_files, filename, compress)
+			unpacking, unpacked = Timed(UnpackMaps, filename, destination)
+			for map_file in unpacked:
+				if not open(map_file, 'rb').read() == files[os.path.basename(map_file)]:
+					print "ERROR: %s is different after the round trip (%s)" % (os.path.basename(map_file),
+							compress and "zlib" or "plain")
+					return False
+			if not len(unpacked) == len(files):
+				print "ERROR: %d files unpacked instead of %d" % (len(unpacked), len(files))
+				return False
+			print "%-8s %8d   %-5s   pack : %8.3f s   unpack : %8.3f s   size : %6.1fx" % ("rmap", size,
+					compress and "zlib" or "plain", packing, unpacking, float(original) / max(packed, 1))
+		return True
+	finally:
+		shutil.rmtree(tmpdir, True)
+
+
+#########################################################################################################
+#### vina
+
+def BenchVina(size):
+	# the ligand is docked on itself (a receptor made of its atoms), with the
+	# lowest exhaustiveness: the time per ligand is mostly the receptor setup
+	import tempfile, shutil
+	vina = Which(os.environ.get("VINA", "vina"))
+	if not vina:
+		print "%-8s skipped (Vina not available)" % "vina"
+		return True
+	tmpdir = tempfile.mkdtemp(prefix = "raccoon_bench_")
+	try:
+		atoms = [ line for line in open(TEST_LIGAND) if line[0:4] == 'ATOM' or line[0:6] == 'HETATM' ]
+		receptor = open(os.path.join(tmpdir, "receptor.pdbqt"), 'w')
+		receptor.writelines(atoms)
+		receptor.close()
+		center = [ sum([ float(line[start:start+8]) for line in atoms ]) / len(atoms) for start in (30, 38, 46) ]
+		config = os.path.join(tmpdir, "conf.txt")
+		output = open(config, 'w')
+		output.write("receptor = %s\n" % os.path.join(tmpdir, "receptor.pdbqt"))
+		output.write("center_x = %.3f\ncenter_y = %.3f\ncenter_z = %.3f\n" % tuple(center))
+		output.write("size_x = 20\nsize_y = 20\nsize_z = 20\nexhaustiveness = 1\nnum_modes = 1\n")
+		output.close()
+		ligands = []
+		for i in range(size):
+			ligands.append(os.path.join(tmpdir, "ligand%d.pdbqt" % i))
+			shutil.copy(TEST_LIGAND, ligands[-1])
+		batch, single = 1, None
+		while batch <= size:
+			output_dir = tempfile.mkdtemp(prefix = "batch%d_" % batch, dir = tmpdir)
+			runner = VinaRunner(vina, config, output_dir, jobs = 1, cpu = 1, batch = batch)
+			if runner.batch < batch:
+				print "%-8s no batch mode in %s (Vina 1.2 or later)" % ("vina", vina)
+				break
+			elapsed, results = Timed(lambda: [ result for result in runner.run(ligands) if result ])
+			if runner.count['docked'] < size:
+				print "ERROR: %d ligands not docked with batches of %d" % (size - runner.count['docked'], batch)
+				return False
+			if single is None:
+				single = elapsed
+			print "%-8s %8d   batch : %4d   %8.3f s/ligand   speed-up : %6.1fx" % ("vina", size, batch, elapsed / size,
+					single / max(elapsed, 1e-9))
+			batch *= 2
+		return True
+	finally:
+		shutil.rmtree(tmpdir, True)
+
+
+BENCHMARKS = {
+	"hbd"	: (BenchHbd, 20000),
+	"dpf"	: (BenchDpf, 200),
+	"gpf"	: (BenchGpf, 200),
+	"maps"	: (BenchMaps, 40),
+	"rmap"	: (BenchRmap, 4),
+	"vina"	: (BenchVina, 16),
+	}
+
+if __name__ == "__main__":
+	names = sys.argv[1:2] or sorted(BENCHMARKS.keys())
+	for name in names:
+		if not BENCHMARKS.has_key(name):
+			print "Unknown benchmark: %s (available: %s)" % (name, ", ".join(sorted(BENCHMARKS.keys())))
+			sys.exit(1)
+		function, size = BENCHMARKS[name]
+		if len(sys.argv) > 2:
+			size = int(sys.argv[2])
+		if not function(size):
+			sys.exit(1)
@@ -0,0 +1,4419 @@
+#!/usr/bin/env python
+#
+# Raccoon engine
+#
+# GUI-independent routines used by Raccoon | AutoDock VS
+#
+# v.1.0.0  Stefano Forli
+#
+# Copyright 2009, Molecular Graphics Lab
+# 	The Scripps Research Institute
+#
+#
+#################################################################
+#
+#     This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+#
+#################################################################
+#
+# Nothing in here is allowed to import Tkinter/Pmw: the functions
+# are executed by worker processes and by the command line tools,
+# where no display is available.
+# MolKit/AutoDockTools are imported only by the functions that
+# really need them.
+#
+
+import os
+import sys
+import glob
+import shutil
+import time
+import mmap
+import subprocess
+import threading
+import Queue
+import numpy
+
+try:
+	import multiprocessing
+except ImportError:
+	# Python < 2.6: everything runs in the main process
+	multiprocessing = None
+
+try:
+	import sqlite3
+except ImportError:
+	# Python < 2.5: no property cache
+	sqlite3 = None
+
+DEBUG = False
+
+RACCOON_DIR = os.path.join(os.path.expanduser("~"), ".raccoon") # user cache files
+
+
+def CPUCount():
+	# number of available cores (at least 1)
+	if multiprocessing:
+		try:
+			return multiprocessing.cpu_count()
+		except NotImplementedError:
+			pass
+	return 1
+
+
+def NewPool(workers):
+	# INFO   : start a pool of worker processes
+	# INPUT  : number of workers
+	# OUTPUT : multiprocessing.Pool or None if processes are not available
+	#
+	# On Windows the workers re-import the main module; Raccoon builds
+	# its interface at import time, so the path of the main module is hidden
+	# while the pool is spawned (the workers only need this module).
+	if not multiprocessing or workers < 2:
+		return None
+	if not sys.platform == "win32":
+		return multiprocessing.Pool(workers)
+	main = sys.modules['__main__']
+	main_file = getattr(main, '__file__', None)
+	argv0 = sys.argv[0]
+	try:
+		if main_file is not None:
+			del main.__file__
+		sys.argv[0] = '-c'
+		return multiprocessing.Pool(workers)
+	finally:
+		if main_file is not None:
+			main.__file__ = main_file
+		sys.argv[0] = argv0
+
+
+#########################################################################################################
+#### Ligand preparation
+
+def LigandPrepOptions(repairs = "", charges_to_add = "gasteiger", cleanup = "nphs_lps", backbone = True,
+		amide = False, guanidinium = False, largest_fragment = False, attach_fragments = False,
+		lock_torsions = False):
+	# INFO   : collect the PDBQT generation options in a plain dictionary
+	#          that can be shipped as it is to the worker processes
+	# OUTPUT : dictionary with the AD4LigandPreparation arguments
+	allowed_bonds = []
+	if backbone:
+		allowed_bonds.append("backbone")
+	if amide:
+		allowed_bonds.append("amide")
+	if guanidinium:
+		allowed_bonds.append("guanidinium")
+	return {
+		'repairs'			: repairs,
+		'charges_to_add'		: charges_to_add,
+		'preserve_charge_types'		: '',
+		'cleanup'			: cleanup,
+		'allowed_bonds'			: "_".join(allowed_bonds),
+		'root'				: 'auto',
+		'check_for_fragments'		: largest_fragment,
+		'bonds_to_inactivate'		: "",
+		'inactivate_all_torsions'	: lock_torsions,
+		'attach_nonbonded_fragments'	: attach_fragments,
+		'mode'				: 'automatic',
+		'dict'				: None }
+
+
+def ConvertLigand(infile, outfile, options):
+	# INFO   : generate a ligand PDBQT (any resemblance with the
+	#          prepare_ligand4 script is accidental)
+	# INPUT  : input structure (PDB, MOL2...), output PDBQT, LigandPrepOptions()
+	# OUTPUT : True/False
+	from MolKit import Read
+	from AutoDockTools.MoleculePreparation import AD4LigandPreparation
+
+	charges_to_add = options['charges_to_add']
+	try:
+		mols = Read(infile)
+		mol = mols[0]
+	except:
+		return False
+	# use the molecule with the most atoms
+	for m in mols[1:]:
+		if len(m.allAtoms) > len(mol.allAtoms):
+			mol = m
+
+	coord_dict = {}
+	for atom in mol.allAtoms: coord_dict[atom] = atom.coords
+	mol.buildBondsByDistance()
+	preserved = {}
+	if charges_to_add is not None:
+		for type in options['preserve_charge_types'].split(','):
+			if not len(type): continue
+			ats = mol.allAtoms.get(lambda x: x.autodock_element == type)
+			for a in ats:
+				if a.chargeSet is not None:
+					preserved[a] = [a.chargeSet, a.charge]
+	LPO = AD4LigandPreparation(mol, options['mode'], options['repairs'], charges_to_add,
+				options['cleanup'], options['allowed_bonds'], options['root'],
+				outputfilename = outfile,
+				dict = options['dict'], check_for_fragments = options['check_for_fragments'],
+				bonds_to_inactivate = options['bonds_to_inactivate'],
+				inactivate_all_torsions = options['inactivate_all_torsions'],
+				attach_nonbonded_fragments = options['attach_nonbonded_fragments'])
+	if charges_to_add is not None:
+		# restore the previous charges
+		for atom, chargeList in preserved.items():
+			atom._charges[chargeList[0]] = chargeList[1]
+			atom.chargeSet = chargeList[0]
+	if DEBUG:
+		for a in mol.allAtoms:
+			if a.coords != coord_dict[a]:
+				print a.name, ":", coord_dict[a], ' -> ', a.coords
+	if mol.returnCode is not 0:
+		return False
+	return True
+
+
+def _LibraryConversionJob(job):
+	# worker side of ConversionPool.run_library(): the molecule is copied
+	# from the library to a scratch file, converted, and the PDBQT text is
+	# sent back to the main process
+	library, name, offset, length, options, tmpdir = job
+	stem = os.path.join(tmpdir, "%d_%s" % (os.getpid(), name.replace(os.sep, "_")))
+	infile = stem + os.path.splitext(library)[1]
+	outfile = stem + ".pdbqt"
+	try:
+		try:
+			source = open(library, 'rb')
+			try:
+				output = open(infile, 'wb')
+				try:
+					CopyRecord(source, output, offset, length)
+				finally:
+					output.close()
+			finally:
+				source.close()
+			if not ConvertLigand(infile, outfile, options):
+				return name, None, False, "conversion failed"
+			pdbqt = open(outfile, 'r')
+			try:
+				return name, pdbqt.read(), True, None
+			finally:
+				pdbqt.close()
+		except Exception, e:
+			return name, None, False, str(e)
+	finally:
+		for scratch in (infile, outfile):
+			if os.path.exists(scratch):
+				os.remove(scratch)
+
+
+def _ConversionJob(job):
+	# worker side of the ConversionPool (must be a module-level function
+	# to be pickled)
+	infile, outfile, options = job
+	try:
+		if ConvertLigand(infile, outfile, options):
+			return infile, outfile, True, None
+		return infile, outfile, False, "conversion failed"
+	except Exception, e:
+		return infile, outfile, False, str(e)
+
+
+class ConversionPool:
+	"""Convert ligands to PDBQT using a pool of worker processes.
+
+	Results are streamed back in order of completion as
+	(infile, outfile, success, error) tuples; None is returned
+	every 'timeout' seconds while waiting, so the caller can keep
+	the interface alive.
+	"""
+
+	def __init__(self, options, workers = None, timeout = 0.1):
+		if workers is None:
+			workers = CPUCount()
+		self.options = options
+		self.workers = max(1, workers)
+		self.timeout = timeout
+		self.done = 0
+		self.failed = []
+		self.start = None
+		self.pool = None
+
+	def run(self, jobs):
+		# jobs : list of (infile, outfile) pairs
+		tasks = [ (infile, outfile, self.options) for infile, outfile in jobs ]
+		return self._map(_ConversionJob, tasks)
+
+	def run_library(self, library, records):
+		# INFO   : convert molecules stored in a multi-structure library
+		# INPUT  : library filename, list (or generator, see Mol2Index) of
+		#          (name, offset, length)
+		# OUTPUT : generator of (name, pdbqt text, success, error)
+		import tempfile, shutil
+		try:
+			count = len(records)
+		except TypeError: # all the molecules of the library
+			count = len(GetLibrary(library))
+		tmpdir = tempfile.mkdtemp(prefix = "raccoon_")
+		try:
+			tasks = ((library, name, offset, length, self.options, tmpdir) for name, offset, length in records)
+			for result in self._map(_LibraryConversionJob, tasks, count):
+				yield result
+		finally:
+			shutil.rmtree(tmpdir, True)
+
+	def _map(self, function, tasks, count = None):
+		# count: number of tasks (when they are a generator)
+		if count is None:
+			count = len(tasks)
+		self.start = time.time()
+		self.pool = NewPool(min(self.workers, count))
+		if not self.pool:
+			for task in tasks:
+				yield self._account(function(task))
+			return
+		try:
+			results = self.pool.imap_unordered(function, tasks)
+			for i in range(count):
+				while True:
+					try:
+						result = results.next(self.timeout)
+						break
+					except multiprocessing.TimeoutError:
+						yield None
+				yield self._account(result)
+			self.pool.close()
+		finally:
+			if self.pool:
+				self.pool.terminate()
+			self.pool = None
+
+	def _account(self, result):
+		if result[2]:
+			self.done += 1
+		else:
+			self.failed.append(result[0])
+		return result
+
+	def stop(self):
+		if self.pool:
+			self.pool.terminate()
+			self.pool = None
+
+	def rate(self):
+		# throughput in ligands/s
+		if not self.start:
+			return 0.
+		elapsed = time.time() - self.start
+		if elapsed <= 0:
+			return 0.
+		return (self.done + len(self.failed)) / elapsed
+
+
+#########################################################################################################
+#### Ligand properties
+
+HBD_CUTOFF = 1.1 # max distance (A) between a donor and its HD
+HBD_ATYPES = ( "N", "O", "OA", "NA" )
+HBA_ATYPES = ( "OA", "NA", "SA" )
+HBD_NUMPY = 256 # with more donor/hydrogen pairs than this the distances are calculated with numpy...
+HBD_GRID = 4096 # ...and with more than this a spatial grid is used
+
+ATOM_WEIGHTS = {	# AutoDock atom types : atomic weight (no account for merged non-polar H's)
+	'H' : 1, 'HD' : 1, 'HS' : 1, 'C' : 12, 'A' : 12, 'N' : 14, 'NA' : 14, 'NS' : 14,
+	'OA' : 16, 'OS' : 16, 'F' : 19, 'Mg' : 24, 'MG' : 24, 'P' : 31, 'SA' : 32, 'S' : 32,
+	'Cl' : 35.4, 'CL' : 35.4, 'Ca' : 40, 'CA' : 40, 'Mn' : 55, 'MN' : 55, 'Fe' : 56, 'FE' : 56,
+	'Zn' : 65.4, 'ZN' : 65.4, 'Br' : 80, 'BR' : 80, 'I' : 126, 'e' : 0, 'd' : 0 }
+
+def LigandProperties(lines, weights):
+	# INFO   : calculate the properties used to filter the ligands
+	# INPUT  : PDBQT lines, { atom type : atomic weight }
+	# OUTPUT : dictionary with Atypes, TORSDOF, HbD, HbA, MW, Nat, NotStdAT
+	#          and NDIHE (BRANCH records, used in the DPF)
+	# EXTRA  : the coordinates are read only for the donor candidates and
+	#          the HD's of ligands that have both (the center for the DPF
+	#          is read at job time, see LigandCenter)
+	atypes = []
+	TORSDOF = 0
+	NDIHE = 0
+	MW  = 0
+	HbA = 0
+	Nat = 0
+	BAD_ATOM_TYPE = False
+	donors = []
+	hydrogens = []
+	for line in lines:
+		if line[0:7] == 'TORSDOF':
+			TORSDOF = int(line.split()[1])
+		elif line[0:6] == 'BRANCH':
+			NDIHE += 1
+		elif line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
+			atype = line.split()[-1]
+			if atype not in atypes:
+				atypes.append(atype)
+			if atype in HBA_ATYPES:
+				HbA += 1
+			if atype == "HD":
+				hydrogens.append(line)
+			else:
+				# count heavy atoms
+				Nat += 1
+				if atype in HBD_ATYPES:
+					donors.append(line)
+			try:
+				MW += weights[atype] # add the atomic weight to the total MW
+			except KeyError:
+				MW += 10000 # check this if it's reasonable
+				BAD_ATOM_TYPE = True
+	HbD = 0
+	if donors and hydrogens:
+		HbD = CountDonors(LineCoords(donors), LineCoords(hydrogens))
+	return {
+		"Atypes"	: atypes,
+		"TORSDOF"	: TORSDOF,
+		"HbD"		: HbD,
+		"HbA"		: HbA,
+		"MW"		: MW,
+		"Nat"		: Nat,
+		"NotStdAT"	: BAD_ATOM_TYPE,
+		"NDIHE"		: NDIHE }
+
+
+def LigandCenter(lines):
+	# INFO   : center of all the atoms of a ligand (the 'about' of the DPF)
+	# INPUT  : PDBQT lines
+	# OUTPUT : (x, y, z)
+	# (small molecules: adding the floats is faster than building an array)
+	x, y, z = 0., 0., 0.
+	count = 0
+	for line in lines:
+		if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
+			x += float(line[30:38])
+			y += float(line[38:46])
+			z += float(line[46:54])
+			count += 1
+	count = max(1, count)
+	return (x / count, y / count, z / count)
+
+
+def LineCoords(lines):
+	# coordinates of PDB(QT) atom lines as a list of (x, y, z)
+	return [ (float(line[30:38]), float(line[38:46]), float(line[46:54])) for line in lines ]
+
+
+def AtomCoords(lines):
+	# coordinates of PDB(QT) atom lines as a (n, 3) array
+	return numpy.array([ (float(line[30:38]), float(line[38:46]), float(line[46:54])) for line in lines ])
+
+
+def CountDonors(donors, hydrogens):
+	# INFO   : count the N/O atoms bound to (at least) one HD
+	# INPUT  : coordinates (x, y, z) of the candidate donors and of the HD's
+	# OUTPUT : number of H-bond donors
+	# EXTRA  : typical ligands have a few pairs, checked one by one: the
+	#          numpy arrays cost more than the distances themselves
+	if not donors or not hydrogens:
+		return 0
+	cutoff = HBD_CUTOFF ** 2
+	if len(donors) * len(hydrogens) <= HBD_NUMPY:
+		count = 0
+		for x, y, z in donors:
+			for hx, hy, hz in hydrogens:
+				if (x-hx)**2 + (y-hy)**2 + (z-hz)**2 <= cutoff:
+					count += 1
+					break
+		return count
+	D = numpy.array(donors)
+	H = numpy.array(hydrogens)
+	if len(donors) * len(hydrogens) <= HBD_GRID:
+		delta = D[:, numpy.newaxis, :] - H[numpy.newaxis, :, :]
+		return int(((delta * delta).sum(axis = 2) <= cutoff).any(axis = 1).sum())
+	# big ligands: only the hydrogens in the neighbouring cells are checked
+	cells = {}
+	for i, cell in enumerate(numpy.floor(H / HBD_CUTOFF).astype(int).tolist()):
+		cells.setdefault(tuple(cell), []).append(i)
+	count = 0
+	for i, (x, y, z) in enumerate(numpy.floor(D / HBD_CUTOFF).astype(int).tolist()):
+		near = []
+		for dx in (-1, 0, 1):
+			for dy in (-1, 0, 1):
+				for dz in (-1, 0, 1):
+					near.extend(cells.get((x+dx, y+dy, z+dz), ()))
+		if near:
+			delta = H[near] - D[i]
+			if ((delta * delta).sum(axis = 1) <= cutoff).any():
+				count += 1
+	return count
+
+
+class PropertyCache:
+	"""On-disk cache of the ligand properties (~/.raccoon/ligands.db).
+
+	Entries are keyed by the ligand filename and they are valid as long
+	as size and modification time of the file (or of the library
+	containing the ligand) are unchanged; the ligands cached while their
+	library was written are made valid by refresh(), once the library is
+	closed. Hits, misses and invalidated entries are counted until
+	reset() is called.
+	"""
+
+	FIELDS = ( "Atypes", "TORSDOF", "HbD", "HbA", "MW", "Nat", "NotStdAT", "NDIHE" )
+
+	def __init__(self, filename = None):
+		if filename is None:
+			filename = os.path.join(RACCOON_DIR, "ligands.db")
+		self.filename = filename
+		self.db = None
+		self.pending = 0
+		self.reset()
+		if not sqlite3:
+			return
+		try:
+			if not os.path.exists(os.path.dirname(filename)):
+				os.makedirs(os.path.dirname(filename), 0755)
+			self.db = sqlite3.connect(filename)
+			self.db.execute("CREATE TABLE IF NOT EXISTS ligands (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, properties TEXT)")
+		except Exception, e:
+			if DEBUG: print "PropertyCache> disabled (%s)" % e
+			self.db = None
+
+	def reset(self):
+		self.hits = 0
+		self.misses = 0
+		self.invalidated = 0
+
+	def stats(self):
+		return self.hits, self.misses, self.invalidated
+
+	def _stat(self, filename):
+		virtual = SplitLigandName(filename)
+		if virtual:
+			filename = virtual[0]
+		stat = os.stat(filename)
+		return stat.st_size, stat.st_mtime
+
+	def get(self, filename, weights):
+		# INFO   : ligand properties (see LigandProperties), from the cache if possible
+		# INPUT  : ligand filename (plain file or library), { atom type : atomic weight }
+		# OUTPUT : dictionary of properties
+		filename = os.path.abspath(filename)
+		if self.db is None:
+			self.misses += 1
+			return LigandProperties(ReadLigand(filename), weights)
+		size, mtime = self._stat(filename)
+		row = self.db.execute("SELECT size, mtime, properties FROM ligands WHERE path = ?", (filename,)).fetchone()
+		if row:
+			if row[0] == size and row[1] == mtime:
+				properties = self.decode(row[2])
+				if properties is not None:
+					self.hits += 1
+					return properties
+			self.invalidated += 1
+		else:
+			self.misses += 1
+		properties = LigandProperties(ReadLigand(filename), weights)
+		self.db.execute("INSERT OR REPLACE INTO ligands VALUES (?, ?, ?, ?)", (filename, size, mtime, self.encode(properties)))
+		self.pending += 1
+		if self.pending >= 10000:
+			self.commit()
+		return properties
+
+	def refresh(self, library):
+		# INFO   : size and modification time of the ligands of a library
+		#          written by a LibraryWriter (call it after close())
+		if self.db is None:
+			return
+		size, mtime = self._stat(library)
+		paths = GetLibrary(library).paths()
+		self.db.executemany("UPDATE ligands SET size = ?, mtime = ? WHERE path = ?", [ (size, mtime, path) for path in paths ])
+		self.pending += len(paths)
+		if self.pending >= 10000:
+			self.commit()
+
+	def commit(self):
+		if self.db is not None and self.pending:
+			self.db.commit()
+			self.pending = 0
+
+	def clear(self):
+		if self.db is not None:
+			self.db.execute("DELETE FROM ligands")
+			self.db.commit()
+			self.pending = 0
+
+	def encode(self, properties):
+		values = [ ",".join(properties["Atypes"]) ]
+		values += [ repr(properties[field]) for field in self.FIELDS[1:] ]
+		return "\t".join(values)
+
+	def decode(self, text):
+		# OUTPUT : properties, None for entries written with other fields
+		values = text.split("\t")
+		if not len(values) == len(self.FIELDS):
+			return None
+		properties = { "Atypes" : [ atype for atype in values[0].split(",") if atype ] }
+		properties["TORSDOF"] = int(values[1])
+		properties["HbD"] = int(values[2])
+		properties["HbA"] = int(values[3])
+		if "." in values[4] or "e" in values[4]:
+			properties["MW"] = float(values[4])
+		else:
+			properties["MW"] = int(values[4])
+		properties["Nat"] = int(values[5])
+		properties["NotStdAT"] = values[6] == "True"
+		properties["NDIHE"] = int(values[7])
+		return properties
+
+
+#########################################################################################################
+#### Ligand table
+
+class LigandRow:
+	"""Dictionary-like view of a ligand in a LigandTable."""
+
+	def __init__(self, table, row):
+		self.table = table
+		self.row = row
+
+	def __getitem__(self, field):
+		if field == "Atypes":
+			return self.table.decode_atypes(self.table.masks[self.row])
+		value = self.table.columns[field][self.row]
+		if field in ("NotStdAT", "accepted"):
+			return bool(value)
+		if field == "MW":
+			return round(float(value), 3)
+		return int(value)
+
+	def __setitem__(self, field, value):
+		if field == "Atypes":
+			self.table.masks[self.row] = self.table.encode_atypes(value)
+		else:
+			self.table.columns[field][self.row] = value
+		if not field == "accepted":
+			self.table.version += 1
+
+	def keys(self):
+		return list(self.table.FIELDS)
+
+	def has_key(self, field):
+		return field in self.table.FIELDS
+
+
+class LigandTable:
+	"""Columnar table of the registered ligands (the Great Book of Ligands).
+
+	Properties are stored in numpy arrays (one row per ligand) and the
+	atom types as a bitmask of the interned types, so each ligand costs
+	a few tens of bytes plus its name. The table behaves like the
+	dictionary of dictionaries it replaces:
+
+		table[filename] = { "Atypes" : [...], "TORSDOF" : 3, ... }
+		table[filename]["accepted"]
+		del table[filename]
+
+	while the filters work on whole columns (see column(), select()).
+	"""
+
+	FIELDS = ( "Atypes", "TORSDOF", "HbD", "HbA", "MW", "Nat", "NotStdAT", "NDIHE", "accepted" )
+	TYPES = { "TORSDOF" : numpy.int16, "HbD" : numpy.int16, "HbA" : numpy.int16, "MW" : numpy.float32,
+		"Nat" : numpy.int32, "NotStdAT" : numpy.bool_, "NDIHE" : numpy.int16, "accepted" : numpy.bool_ }
+
+	def __init__(self, capacity = 1024):
+		self.names = []
+		self.position = {}
+		self.atypes = [] # interned atom types (bit i of the masks)
+		self.atype_bit = {}
+		self.columns = {}
+		for field, type in self.TYPES.items():
+			self.columns[field] = numpy.zeros(capacity, type)
+		self.masks = numpy.zeros((capacity, 1), numpy.uint64)
+		self.version = 0 # incremented at every change of the properties (not of the accepted flags)
+
+	# atom types
+	def encode_atypes(self, atypes):
+		mask = numpy.zeros(self.masks.shape[1], numpy.uint64)
+		for atype in atypes:
+			bit = self.atype_bit.get(atype)
+			if bit is None:
+				bit = len(self.atypes)
+				self.atypes.append(atype)
+				self.atype_bit[atype] = bit
+				if bit >= 64 * self.masks.shape[1]:
+					# more than 64 types: add a word to all the masks
+					self.masks = numpy.hstack((self.masks, numpy.zeros((len(self.masks), 1), numpy.uint64)))
+					mask = numpy.append(mask, numpy.uint64(0))
+			mask[bit // 64] |= numpy.uint64(1) << numpy.uint64(bit % 64)
+		return mask
+
+	def decode_atypes(self, mask):
+		return [ atype for bit, atype in enumerate(self.atypes) if int(mask[bit // 64]) >> (bit % 64) & 1 ]
+
+	def atom_types(self, selection = None):
+		# INFO   : atom types present in the ligands
+		# INPUT  : boolean mask of the ligands to consider (default: all)
+		# OUTPUT : list of atom types
+		masks = self.masks[:len(self.names)]
+		if selection is not None:
+			masks = masks[selection]
+		if not len(masks):
+			return []
+		union = numpy.bitwise_or.reduce(masks, axis = 0)
+		return self.decode_atypes(union)
+
+	# dictionary interface
+	def __len__(self):
+		return len(self.names)
+
+	def __iter__(self):
+		return iter(list(self.names))
+
+	def __contains__(self, name):
+		return self.position.has_key(name)
+
+	def has_key(self, name):
+		return self.position.has_key(name)
+
+	def keys(self):
+		return list(self.names)
+
+	def __getitem__(self, name):
+		return LigandRow(self, self.position[name])
+
+	def __setitem__(self, name, properties):
+		row = self.position.get(name)
+		if row is None:
+			row = len(self.names)
+			if row == len(self.masks):
+				self._grow()
+			self.names.append(name)
+			self.position[name] = row
+		for field, type in self.TYPES.items():
+			self.columns[field][row] = properties.get(field, 0)
+		mask = self.encode_atypes(properties.get("Atypes", []))
+		self.masks[row] = mask
+		self.version += 1
+
+	def __delitem__(self, name):
+		self.remove([name])
+
+	def _grow(self):
+		capacity = 2 * len(self.masks)
+		for field in self.columns:
+			column = numpy.zeros(capacity, self.columns[field].dtype)
+			column[:len(self.names)] = self.columns[field][:len(self.names)]
+			self.columns[field] = column
+		masks = numpy.zeros((capacity, self.masks.shape[1]), numpy.uint64)
+		masks[:len(self.names)] = self.masks[:len(self.names)]
+		self.masks = masks
+
+	def remove(self, names):
+		# remove a list of ligands, keeping the order of the others
+		keep = numpy.ones(len(self.names), numpy.bool_)
+		for name in names:
+			keep[self.position[name]] = False
+		count = int(keep.sum())
+		for field in self.columns:
+			self.columns[field][:count] = self.columns[field][:len(self.names)][keep]
+		self.masks[:count] = self.masks[:len(self.names)][keep]
+		self.names = [ name for name, kept in zip(self.names, keep) if kept ]
+		self.position = dict([ (name, row) for row, name in enumerate(self.names) ])
+		self.version += 1
+
+	def clear(self):
+		version = self.version
+		self.__init__()
+		self.version = version + 1
+
+	# columns
+	def column(self, field):
+		# array of the values of a property (read-only use)
+		return self.columns[field][:len(self.names)]
+
+	def accepted(self):
+		return self.column("accepted")
+
+	def count_accepted(self):
+		return int(self.accepted().sum())
+
+	def accepted_names(self):
+		return [ self.names[row] for row in numpy.flatnonzero(self.accepted()) ]
+
+	def rejected_names(self):
+		return [ self.names[row] for row in numpy.flatnonzero(~self.accepted()) ]
+
+	def set_accepted(self, mask):
+		self.columns["accepted"][:len(self.names)] = mask
+
+	def criterion(self, field, low, high):
+		# boolean mask of the ligands with low <= field <= high
+		values = self.column(field)
+		return (values >= low) & (values <= high)
+
+	def select(self, ranges, reject_nonstd = True):
+		# INFO   : evaluate the filters on all the ligands at once
+		# INPUT  : { field : (min, max) }, reject non-AD atom types
+		# OUTPUT : boolean mask of the ligands passing all the filters
+		selection = numpy.ones(len(self.names), numpy.bool_)
+		for field, (low, high) in ranges.items():
+			selection &= self.criterion(field, low, high)
+		if reject_nonstd:
+			selection &= ~self.column("NotStdAT")
+		return selection
+
+
+class LigandFilter:
+	"""Filters of a LigandTable with a cached mask for each criterion.
+
+	A criterion is recalculated only when its own range changes (or when
+	the table changes), so moving a single filter while previewing costs
+	one comparison over one column plus the combination of the masks.
+	"""
+
+	def __init__(self, table):
+		self.table = table
+		self.masks = {} # field : (table version, range, mask)
+
+	def mask(self, field, low, high):
+		cached = self.masks.get(field)
+		if cached and cached[0] == self.table.version and cached[1] == (low, high):
+			return cached[2]
+		if field == "NotStdAT":
+			mask = ~self.table.column("NotStdAT")
+		else:
+			mask = self.table.criterion(field, low, high)
+		self.masks[field] = (self.table.version, (low, high), mask)
+		return mask
+
+	def select(self, ranges, reject_nonstd = True):
+		# same as LigandTable.select(), using the cached masks
+		selection = numpy.ones(len(self.table), numpy.bool_)
+		for field, (low, high) in ranges.items():
+			selection &= self.mask(field, low, high)
+		if reject_nonstd:
+			selection &= self.mask("NotStdAT", None, None)
+		return selection
+
+	def count(self, ranges, reject_nonstd = True):
+		# number of ligands accepted by the filters
+		return int(self.select(ranges, reject_nonstd).sum())
+
+	def clear(self):
+		self.masks.clear()
+
+
+#########################################################################################################
+#### Multi-structure libraries
+
+MOL2_TAG = "@<TRIPOS>MOLECULE"
+PDBQT_TAG = "MODEL"
+BUFSIZE = 1048576 # 1 Mb read buffer: memory used while scanning a library does not depend on its size
+INDEX_EXT = ".idx"
+
+def TagOffsets(filename, tag, bufsize = BUFSIZE):
+	# INFO   : scan a multi-structure file with a bounded buffer
+	# INPUT  : filename, record tag
+	# OUTPUT : generator of the byte offsets of the lines starting with the tag
+	keep = len(tag) - 1 # a tag split between two blocks is still found
+	infile = open(filename, 'rb')
+	try:
+		pos = 0 # file offset of buffer[0]
+		before = "\n" # character preceding buffer[0]
+		buffer = ""
+		while True:
+			block = infile.read(bufsize)
+			if not block:
+				break
+			buffer += block
+			i = buffer.find(tag)
+			while i >= 0:
+				# only tags at the beginning of a line
+				if (i == 0 and before == "\n") or (i > 0 and buffer[i-1] == "\n"):
+					yield pos+i
+				i = buffer.find(tag, i+1)
+			if len(buffer) > keep:
+				cut = len(buffer) - keep
+				before = buffer[cut-1]
+				pos += cut
+				buffer = buffer[cut:]
+	finally:
+		infile.close()
+
+
+def Mol2Offsets(filename, bufsize = BUFSIZE):
+	return TagOffsets(filename, MOL2_TAG, bufsize)
+
+
+def LibraryRecords(filename, bufsize = BUFSIZE):
+	# INFO   : single pass over a multi-MOL2 or a multi-PDBQT (MODEL/ENDMDL)
+	# INPUT  : library filename
+	# OUTPUT : generator of (name, offset, length) for every molecule
+	if filename[-5:].lower() == ".mol2":
+		tag, getname = MOL2_TAG, _Mol2Name
+	else:
+		tag, getname = PDBQT_TAG, _PdbqtName
+	size = os.path.getsize(filename)
+	reader = open(filename, 'rb') # used only to pick up the names
+	try:
+		previous = None
+		for offset in TagOffsets(filename, tag, bufsize):
+			if previous is not None:
+				yield getname(reader, previous), previous, offset-previous
+			previous = offset
+		if previous is not None:
+			yield getname(reader, previous), previous, size-previous
+	finally:
+		reader.close()
+
+Mol2Records = LibraryRecords
+
+
+def _Mol2Name(infile, offset):
+	# the molecule name is the line following the MOLECULE tag
+	infile.seek(offset)
+	infile.readline()
+	return infile.readline().strip()
+
+
+def _PdbqtName(infile, offset):
+	# the name is in the "REMARK  Name = " line of the model (if any)
+	infile.seek(offset)
+	infile.readline()
+	for i in range(20):
+		line = infile.readline()
+		if not line or line[0:6] == "ENDMDL":
+			break
+		if line[0:6] == "REMARK" and "Name =" in line:
+			return line.split("Name =", 1)[1].strip()
+		if line[0:4] == "ROOT":
+			break
+	return ""
+
+
+def IsLibraryFile(filename):
+	# quick check for PDBQT files containing more than one structure
+	try:
+		infile = open(filename, 'rb')
+		try:
+			head = infile.read(65536)
+		finally:
+			infile.close()
+	except IOError:
+		return False
+	return head[0:5] == PDBQT_TAG or ("\n"+PDBQT_TAG) in head
+
+
+class LibraryIndex:
+	"""Offset index (molecule name -> offset, length) of a multi-MOL2
+	or multi-PDBQT library.
+
+	The index is saved next to the library (<library>.idx) and it is
+	rebuilt only when the size or the modification time of the library
+	change. Ligands stored in a library are referred to with the virtual
+	filename <library>/<name>.pdbqt (see LibraryLigand()).
+	"""
+
+	loaded = None # signature of the library when the index was loaded
+	writing = False # the library is being written by a LibraryWriter
+
+	def __init__(self, filename, build = True):
+		self.filename = os.path.abspath(filename)
+		self.index_file = self.filename + INDEX_EXT
+		self.names = []
+		self.records = {}
+		self.stem = os.path.splitext(os.path.basename(filename))[0]
+		if build and not self.load():
+			self.build()
+			self.save()
+
+	def signature(self):
+		try:
+			stat = os.stat(self.filename)
+		except OSError:
+			return None
+		return "%d %d" % (stat.st_size, int(stat.st_mtime))
+
+	def add(self, name, offset, length):
+		# register a molecule, names are made unique and usable as filenames
+		name = name.split()
+		if name:
+			name = name[0].replace("/", "_").replace("\\", "_").replace(":", "_")
+		else:
+			name = "%s_%06d" % (self.stem, len(self.names)+1)
+		if self.records.has_key(name):
+			count = 2
+			while self.records.has_key("%s_%d" % (name, count)):
+				count += 1
+			name = "%s_%d" % (name, count)
+		self.names.append(name)
+		self.records[name] = (offset, length)
+		return name
+
+	def build(self):
+		del self.names[:]
+		self.records.clear()
+		for name, offset, length in LibraryRecords(self.filename):
+			self.add(name, offset, length)
+
+	def load(self):
+		try:
+			infile = open(self.index_file, 'r')
+		except IOError:
+			return False
+		try:
+			if not infile.readline().startswith("# Raccoon library index"):
+				return False
+			if not infile.readline()[2:].strip() == self.signature():
+				if DEBUG: print "LibraryIndex> %s is outdated" % self.index_file
+				return False
+			for line in infile:
+				name, offset, length = line.rstrip("\n").split("\t")
+				self.names.append(name)
+				self.records[name] = (int(offset), int(length))
+		finally:
+			infile.close()
+		return True
+
+	def save(self):
+		# the index is not saved for plain (single structure) files, and
+		# a read-only library simply gets its index rebuilt next time
+		if not self.names:
+			return False
+		try:
+			output = open(self.index_file, 'w')
+			try:
+				print >>output, "# Raccoon library index"
+				print >>output, "# %s" % self.signature()
+				for name in self.names:
+					print >>output, "%s\t%d\t%d" % (name, self.records[name][0], self.records[name][1])
+			finally:
+				output.close()
+		except IOError:
+			if DEBUG: print "LibraryIndex> unable to save %s" % self.index_file
+			return False
+		return True
+
+	def __len__(self):
+		return len(self.names)
+
+	def items(self):
+		# list of (name, offset, length)
+		return [ (name, self.records[name][0], self.records[name][1]) for name in self.names ]
+
+	def iteritems(self):
+		# generator of (name, offset, length)
+		for name in self.names:
+			offset, length = self.records[name]
+			yield name, offset, length
+
+	def path(self, name):
+		return LibraryLigand(self.filename, name)
+
+	def paths(self):
+		return [ LibraryLigand(self.filename, name) for name in self.names ]
+
+	def read(self, name):
+		# text of the molecule (without MODEL/ENDMDL records)
+		offset, length = self.records[name]
+		infile = open(self.filename, 'rb')
+		try:
+			infile.seek(offset)
+			text = infile.read(length)
+		finally:
+			infile.close()
+		if text[0:5] == PDBQT_TAG:
+			lines = [ line for line in text.splitlines(True) if not line[0:5] == PDBQT_TAG and not line[0:6] == "ENDMDL" ]
+			text = "".join(lines)
+		return text
+
+
+_LIBRARIES = {}
+
+def GetLibrary(filename):
+	# INFO   : library index (loaded or built once, and kept until the file changes)
+	# OUTPUT : LibraryIndex
+	filename = os.path.abspath(filename)
+	index = _LIBRARIES.get(filename)
+	if index is not None and index.writing:
+		return index
+	if index is None or not index.signature() == index.loaded:
+		index = LibraryIndex(filename)
+		index.loaded = index.signature()
+		if len(index):
+			_LIBRARIES[filename] = index
+	return index
+
+
+def Mol2Index(filename):
+	# OUTPUT : generator of (name, offset, length) (CountMol2() molecules)
+	return GetLibrary(filename).iteritems()
+
+
+def CountMol2(filename):
+	return len(GetLibrary(filename))
+
+
+def LibraryLigand(library, name):
+	# virtual filename of a ligand stored in a library
+	return os.path.join(library, name + ".pdbqt")
+
+
+def SplitLigandName(filename):
+	# OUTPUT : (library, name) for ligands stored in a library, None for plain files
+	library = os.path.dirname(filename)
+	if os.path.isfile(library):
+		return library, os.path.basename(filename)[:-6]
+	return None
+
+
+def LigandExists(filename):
+	if os.path.isfile(filename):
+		return True
+	virtual = SplitLigandName(filename)
+	if virtual:
+		return GetLibrary(virtual[0]).records.has_key(virtual[1])
+	return False
+
+
+def ReadLigand(filename):
+	# INFO   : read a ligand from a plain file or from a library
+	# OUTPUT : list of lines
+	virtual = SplitLigandName(filename)
+	if virtual:
+		return GetLibrary(virtual[0]).read(virtual[1]).splitlines(True)
+	infile = open(filename, 'r')
+	try:
+		return infile.readlines()
+	finally:
+		infile.close()
+
+
+def MaterializeLigand(filename, dest_dir):
+	# INFO   : put the ligand file in the job directory
+	# OUTPUT : filename of the ligand in dest_dir
+	# EXTRA  : ligands stored in a library are written only here
+	output_name = os.path.join(dest_dir, os.path.basename(filename))
+	virtual = SplitLigandName(filename)
+	if virtual:
+		output = open(output_name, 'wb')
+		try:
+			output.write(GetLibrary(virtual[0]).read(virtual[1]))
+		finally:
+			output.close()
+	elif not os.path.dirname(os.path.abspath(filename)) == os.path.abspath(dest_dir):
+		import shutil
+		shutil.copy2(filename, dest_dir)
+	return output_name
+
+
+class LibraryWriter:
+	"""Append PDBQT ligands to a multi-PDBQT library, keeping its index."""
+
+	def __init__(self, filename):
+		self.filename = os.path.abspath(filename)
+		self.output = open(self.filename, 'wb')
+		self.index = LibraryIndex(self.filename, build = False)
+		self.index.writing = True
+		_LIBRARIES[self.filename] = self.index
+
+	def add(self, name, text):
+		# OUTPUT : virtual filename of the ligand
+		name = self.index.add(name, self.output.tell(), 0)
+		if not text[-1:] == "\n":
+			text += "\n"
+		block = "%s %d\nREMARK  Name = %s\n%sENDMDL\n" % (PDBQT_TAG, len(self.index), name, text)
+		self.index.records[name] = (self.index.records[name][0], len(block))
+		self.output.write(block)
+		self.output.flush()
+		return self.index.path(name)
+
+	def close(self):
+		self.output.close()
+		self.index.save()
+		self.index.loaded = self.index.signature()
+		self.index.writing = False
+
+
+def CopyRecord(infile, outfile, offset, length, bufsize = BUFSIZE):
+	# copy length bytes from offset of the (open) infile to outfile
+	infile.seek(offset)
+	while length > 0:
+		data = infile.read(min(bufsize, length))
+		if not data:
+			break
+		outfile.write(data)
+		length -= len(data)
+
+
+def SplitMol2File(filename, outdir, records = None, bufsize = BUFSIZE):
+	# INFO   : write every molecule of a multi-MOL2 in its own file
+	# INPUT  : mol2 filename, output directory, [ records from Mol2Index() ]
+	# OUTPUT : generator of the filenames written
+	# EXTRA  : molecules with a ZINC name are saved as ZINCxxxxx.mol2,
+	#          the others as <library>_<number>.mol2
+	if records is None:
+		records = Mol2Records(filename, bufsize)
+	stem = os.path.splitext(os.path.basename(filename))[0]
+	if not os.path.exists(outdir):
+		os.makedirs(outdir, 0755)
+	infile = open(filename, 'rb')
+	try:
+		count = 0
+		for name, offset, length in records:
+			count += 1
+			if name[0:4] == "ZINC":
+				output_name = outdir+os.sep+name.split()[0]+".mol2"
+			else:
+				output_name = outdir+os.sep+stem+"_%06d.mol2" % count
+			output = open(output_name, 'wb')
+			try:
+				CopyRecord(infile, output, offset, length, bufsize)
+			finally:
+				output.close()
+			yield output_name
+	finally:
+		infile.close()
+
+
+#########################################################################################################
+#### Receptor preparation
+
+RECEPTOR_REPAIRS = {	# receptor repair options (as shown in the interface)
+	'none'			: None,
+	'rebuild bonds'		: 'bonds',
+	'add H'			: 'hydrogens',
+	'add H (if missing)'	: 'checkhydrogens',
+	'rebuild bonds + add H'	: 'bonds_hydrogens' }
+
+def ReceptorPrepOptions(repairs = 'checkhydrogens', charges_to_add = 'gasteiger', cleanup = "_nphs_lps_waters",
+		delete_single_nonstd_residues = False):
+	# INFO   : collect the receptor PDBQT generation options
+	# OUTPUT : dictionary with the AD4ReceptorPreparation arguments
+	return {
+		'repairs'			: repairs,
+		'charges_to_add'		: charges_to_add,
+		'preserve_charge_types'		: None,
+		'cleanup'			: cleanup,
+		'delete_single_nonstd_residues'	: delete_single_nonstd_residues,
+		'mode'				: 'automatic' }
+
+
+def ConvertReceptor(infile, outfile, options):
+	# INFO   : generate a receptor PDBQT (if this closely resembles
+	#          prepare_receptor4.py, it's normal)
+	# INPUT  : input structure (PDB, MOL2...), output PDBQT, ReceptorPrepOptions()
+	# OUTPUT : True/False
+	from MolKit import Read
+	from AutoDockTools.MoleculePreparation import AD4ReceptorPreparation
+
+	charges_to_add = options['charges_to_add']
+	preserve_charge_types = options['preserve_charge_types']
+	mols = Read(infile)
+	try:
+		mol = mols[0]
+	except:
+		return False
+	preserved = {}
+	if charges_to_add is not None and preserve_charge_types is not None:
+		for t in preserve_charge_types.split(','):
+			if not len(t): continue
+			for a in mol.allAtoms.get(lambda x: x.autodock_element == t):
+				if a.chargeSet is not None:
+					preserved[a] = [a.chargeSet, a.charge]
+	# use the molecule with the most atoms
+	for m in mols[1:]:
+		if len(m.allAtoms) > len(mol.allAtoms):
+			mol = m
+	mol.buildBondsByDistance()
+	AD4ReceptorPreparation(mol, options['mode'], options['repairs'], charges_to_add,
+			options['cleanup'], outputfilename = outfile, preserved = preserved,
+			delete_single_nonstd_residues = options['delete_single_nonstd_residues'])
+	if charges_to_add is not None:
+		# restore any previous charges
+		for atom, chargeList in preserved.items():
+			atom._charges[chargeList[0]] = chargeList[1]
+			atom.chargeSet = chargeList[0]
+	return True
+
+
+def CheckLigand(filename):
+	# OUTPUT : True if the file is a ligand PDBQT (and not a flexible residue)
+	found_ligand = False
+	try:
+		for line in open(filename, 'r'):
+			if line[0:4] == "ROOT":
+				found_ligand = True
+			if line[0:9] == "BEGIN_RES":
+				return False
+	except IOError:
+		return False
+	return found_ligand
+
+
+def CheckReceptor(filename):
+	# INFO   : check that the file is a receptor PDBQT
+	# OUTPUT : None if the file is fine, otherwise the reason
+	found_ligand = False
+	found_some_atom = False
+	for line in open(filename, 'r'):
+		if line[0:4] == "ROOT" or line[0:9] == "BEGIN_RES":
+			found_ligand = True
+		if line[0:4] == "ATOM":
+			found_some_atom = True
+	if found_ligand:
+		return "The selected PDBQT file is a ligand file..."
+	if not found_some_atom:
+		return "The file is not a valid PDBQT."
+	return None
+
+
+#########################################################################################################
+#### Receptor cache
+
+def FileHash(filename, bufsize = BUFSIZE):
+	# OUTPUT : SHA1 (hex) of the content of a file
+	import hashlib
+	sha1 = hashlib.sha1()
+	infile = open(filename, 'rb')
+	try:
+		while True:
+			block = infile.read(bufsize)
+			if not block:
+				break
+			sha1.update(block)
+	finally:
+		infile.close()
+	return sha1.hexdigest()
+
+
+def ReceptorInfo(filename):
+	# INFO   : receptor data used by the generation (no MolKit)
+	# OUTPUT : dictionary with hash, types (in order of appearance) and center
+	types = []
+	x, y, z, count = 0., 0., 0., 0
+	for line in open(filename, 'r'):
+		if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
+			atype = line.split()[-1]
+			if atype not in types:
+				types.append(atype)
+			x += float(line[30:38])
+			y += float(line[38:46])
+			z += float(line[46:54])
+			count += 1
+	count = max(1, count)
+	return { 'hash' : FileHash(filename), 'types' : types, 'center' : (x / count, y / count, z / count) }
+
+
+class ReceptorCache:
+	"""Receptor data reused by the generations (~/.raccoon/receptors).
+
+	Entries are keyed by the SHA1 of the receptor PDBQT, so a receptor is
+	recognised whatever its path. For each receptor the cache keeps its
+	ReceptorInfo(), the rigid/flexible files made by GenFlex() for each
+	residue selection and the GPF/DPF templates compiled for each set of
+	generation settings: generating again with the same receptors doesn't
+	need MolKit. Within a run the hashes are kept in memory (files with
+	unchanged size and modification time are not read again).
+	"""
+
+	def __init__(self, path = None):
+		if path is None:
+			path = os.path.join(RACCOON_DIR, "receptors")
+		self.path = path
+		self.known = {} # filename : (size, mtime, info)
+		self.hits = 0
+		self.misses = 0
+		try:
+			if not os.path.exists(path):
+				os.makedirs(path, 0755)
+		except OSError, e:
+			if DEBUG: print "ReceptorCache> disabled (%s)" % e
+			self.path = None
+
+	def stats(self):
+		return self.hits, self.misses
+
+	def info(self, filename):
+		# OUTPUT : ReceptorInfo() of the receptor
+		filename = os.path.abspath(filename)
+		stat = os.stat(filename)
+		known = self.known.get(filename)
+		if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+			return known[2]
+		info = ReceptorInfo(filename)
+		self.known[filename] = (stat.st_size, stat.st_mtime, info)
+		return info
+
+	def _entry(self, receptor, name):
+		# path of a file of the receptor entry
+		directory = os.path.join(self.path, self.info(receptor)['hash'])
+		if not os.path.exists(directory):
+			os.makedirs(directory, 0755)
+		return os.path.join(directory, name)
+
+	def _store(self, source, destination):
+		# copy a file in the cache (never leaving a partial file)
+		try:
+			shutil.copyfile(source, destination+".tmp")
+			if os.path.exists(destination):
+				os.remove(destination)
+			os.rename(destination+".tmp", destination)
+		except (IOError, OSError), e:
+			if DEBUG: print "ReceptorCache> %s not stored (%s)" % (destination, e)
+
+	def flex(self, receptor, residues):
+		# INFO   : GenFlex() with the files taken from the cache when possible
+		# OUTPUT : (rigid filename, flexres filename), next to the receptor as GenFlex()
+		import hashlib
+		name = os.path.splitext(receptor)[0]
+		outputs = (name+"_rigid.pdbqt", name+"_flex.pdbqt")
+		if self.path is None:
+			return GenFlex(receptor, residues)
+		key = hashlib.sha1(residues.replace(" ", "")).hexdigest()
+		cached = (self._entry(receptor, key+"_rigid.pdbqt"), self._entry(receptor, key+"_flex.pdbqt"))
+		if os.path.exists(cached[0]) and os.path.exists(cached[1]):
+			self.hits += 1
+			for source, destination in zip(cached, outputs):
+				if not os.path.exists(destination) or not FileHash(destination) == FileHash(source):
+					shutil.copyfile(source, destination)
+			return outputs
+		self.misses += 1
+		outputs = GenFlex(receptor, residues)
+		for source, destination in zip(outputs, cached):
+			self._store(source, destination)
+		return outputs
+
+	def _template_name(self, kind, receptor, flexres, signature):
+		import hashlib
+		key = [ kind, os.path.basename(receptor), signature ]
+		if flexres:
+			key += [ os.path.basename(flexres), FileHash(flexres) ]
+		return kind+"_"+hashlib.sha1(repr(key)).hexdigest()+".template"
+
+	def template(self, kind, receptor, flexres, signature):
+		# INFO   : GPF/DPF template compiled for the receptor (see VSGenerator)
+		# INPUT  : 'gpf' or 'dpf', receptor, flexres (or None), SettingsSignature()
+		# OUTPUT : template or None
+		import cPickle
+		if self.path is None:
+			return None
+		filename = self._entry(receptor, self._template_name(kind, receptor, flexres, signature))
+		if not os.path.exists(filename):
+			self.misses += 1
+			return None
+		try:
+			infile = open(filename, 'rb')
+			try:
+				template = cPickle.load(infile)
+			finally:
+				infile.close()
+		except Exception, e:
+			if DEBUG: print "ReceptorCache> invalid template %s (%s)" % (filename, e)
+			self.misses += 1
+			return None
+		self.hits += 1
+		return template
+
+	def store_template(self, kind, receptor, flexres, signature, template):
+		import cPickle
+		if self.path is None:
+			return
+		filename = self._entry(receptor, self._template_name(kind, receptor, flexres, signature))
+		try:
+			output = open(filename+".tmp", 'wb')
+			try:
+				cPickle.dump(template, output, 2)
+			finally:
+				output.close()
+			if os.path.exists(filename):
+				os.remove(filename)
+			os.rename(filename+".tmp", filename)
+		except (IOError, OSError, cPickle.PicklingError), e:
+			if DEBUG: print "ReceptorCache> template not stored (%s)" % e
+
+	def clear(self):
+		if self.path is not None:
+			shutil.rmtree(self.path, True)
+			os.makedirs(self.path, 0755)
+		self.known.clear()
+
+
+#########################################################################################################
+#### Map store
+
+FICLONE = 0x40049409 # Linux ioctl: share the blocks of a file (btrfs, xfs, ...)
+_LINK_METHODS = {} # (source device, destination device) : best method found
+
+def LinkOrCopy(source, destination):
+	# INFO   : put a copy of a file in destination, sharing the data when possible
+	#          (reflink, then hard link, then a real copy)
+	# OUTPUT : 'reflink', 'link' or 'copy'
+	if os.path.lexists(destination):
+		os.remove(destination)
+	devices = (os.stat(source).st_dev, os.stat(os.path.dirname(os.path.abspath(destination))).st_dev)
+	if _LINK_METHODS.has_key(devices):
+		methods = [ _LINK_METHODS[devices], 'copy' ]
+	else:
+		methods = [ 'reflink', 'link', 'copy' ]
+	for method in methods:
+		if method == 'reflink':
+			if not sys.platform.startswith('linux'):
+				continue
+			import fcntl
+			cloned = False
+			infile = open(source, 'rb')
+			try:
+				output = open(destination, 'wb')
+				try:
+					try:
+						fcntl.ioctl(output.fileno(), FICLONE, infile.fileno())
+						cloned = True
+					except (IOError, OSError):
+						pass
+				finally:
+					output.close()
+			finally:
+				infile.close()
+			if not cloned:
+				os.remove(destination)
+				continue
+		elif method == 'link':
+			if not hasattr(os, 'link'):
+				continue
+			try:
+				os.link(source, destination)
+			except OSError:
+				continue
+		else:
+			shutil.copy2(source, destination)
+		_LINK_METHODS[devices] = method
+		return method
+
+
+class TransferStats:
+	"""Files (and bytes) put in the job directories by each LinkOrCopy() method
+	(or unpacked from a .rmap container)."""
+
+	METHODS = ( 'reflink', 'link', 'copy', 'unpack' )
+
+	def __init__(self):
+		self.files = {}
+		self.bytes = {}
+		for method in self.METHODS:
+			self.files[method] = 0
+			self.bytes[method] = 0
+
+	def count(self, method, size):
+		self.files[method] += 1
+		self.bytes[method] += size
+
+	def add(self, other):
+		for method in self.METHODS:
+			self.files[method] += other.files[method]
+			self.bytes[method] += other.bytes[method]
+
+	def saved(self):
+		# bytes not written thanks to reflinks and hard links
+		return self.bytes['reflink'] + self.bytes['link']
+
+	def report(self):
+		# OUTPUT : list of lines
+		lines = []
+		for method in self.METHODS:
+			if self.files[method]:
+				lines.append("%-8s %8d files %12.1f Mb" % (method, self.files[method], self.bytes[method] / 1048576.))
+		if lines:
+			lines.append("saved versus copies : %.1f Mb" % (self.saved() / 1048576.))
+		return lines
+
+
+class MapStore:
+	"""Content-addressed store of AutoGrid maps (~/.raccoon/maps).
+
+	A map is keyed by the hash of the receptor (content and name, which
+	appears in the map header), the grid parameters of the GPF, the
+	parameter file and the map name, so identical maps are calculated once
+	across runs and projects. Maps are added and taken with LinkOrCopy().
+	"""
+
+	def __init__(self, path = None):
+		if path is None:
+			path = os.path.join(RACCOON_DIR, "maps")
+		self.path = path
+		self.hits = 0
+		self.misses = 0
+		try:
+			if not os.path.exists(path):
+				os.makedirs(path, 0755)
+		except OSError, e:
+			if DEBUG: print "MapStore> disabled (%s)" % e
+			self.path = None
+
+	def stats(self):
+		return self.hits, self.misses
+
+	def keys(self, receptor, gpf_text, parameter_file, names):
+		# INFO   : keys of the maps of a receptor
+		# INPUT  : receptor, GPF template, parameter file, map names ("A.map", "maps.fld", ...)
+		# OUTPUT : { name : key }
+		import hashlib
+		grid = [ FileHash(receptor), os.path.basename(receptor) ] + GPFParameters(gpf_text)
+		if parameter_file:
+			grid.append(FileHash(parameter_file))
+		keys = {}
+		for name in names:
+			keys[name] = hashlib.sha1(repr(grid + [ name ])).hexdigest()
+		return keys
+
+	def _file(self, key):
+		return os.path.join(self.path, key[:2], key)
+
+	def has(self, key):
+		return self.path is not None and os.path.exists(self._file(key))
+
+	def add(self, key, filename):
+		# store a map (never leaving a partial file in the store)
+		if self.path is None or self.has(key):
+			return
+		stored = self._file(key)
+		try:
+			if not os.path.exists(os.path.dirname(stored)):
+				os.makedirs(os.path.dirname(stored), 0755)
+			LinkOrCopy(filename, stored+".tmp")
+			os.rename(stored+".tmp", stored)
+		except (IOError, OSError), e:
+			if DEBUG: print "MapStore> %s not stored (%s)" % (filename, e)
+
+	def get(self, key, filename):
+		# OUTPUT : LinkOrCopy() method
+		return LinkOrCopy(self._file(key), filename)
+
+
+#########################################################################################################
+#### VS generation
+
+class RaccoonError(Exception):
+	"""Error in the VS generation; the message can be shown to the user as it is."""
+	pass
+
+
+# map sources (the values of the MapSource radio buttons)
+MAPS_IN_JOB	= 0 # AutoGrid runs in each job
+MAPS_NOW	= 1 # maps calculated now and copied/linked in each job
+MAPS_CACHED	= 2 # maps already calculated and copied/linked in each job
+
+TARGETS = {	# target OS : description used in the log
+	'lin'	: "Workstation",
+	'pbs'	: "Linux clusters",
+	'win'	: "Windows",
+	'vina'	: "AutoDock Vina" }
+
+PACKAGE_FORMATS = {	# VS package format : ( tarfile mode, extension )
+	'tar'	: ( "w", ".tar" ),
+	'bz2'	: ( "w:bz2", ".tar.bz2" ),
+	'gz'	: ( "w:gz", ".tar.gz" ),
+	'zip'	: ( None, ".zip" ) }
+
+FILTER_PRESETS = {	# filter sets : { property : (min, max) }, the max TORSDOF depends on the flex residues
+	"Default"		: { "HbD" : (0, 99), "HbA" : (0, 99), "MW" : (0, 9999), "Nat" : (0, 999) },
+	"Lipinski-like"		: { "HbD" : (0, 5), "HbA" : (0, 10), "MW" : (0, 500), "Nat" : (0, 999) },
+	"DrugLikeness"		: { "HbD" : (0, 5), "HbA" : (0, 10), "MW" : (160, 480), "Nat" : (20, 70) },
+	"DrugLikeness (frag)"	: { "HbD" : (0, 3), "HbA" : (0, 6), "MW" : (160, 250), "Nat" : (6, 45) } }
+
+AUTODOCK_MAX_TORSDOF = 32
+
+def FilterRanges(preset = "Default", max_tors = AUTODOCK_MAX_TORSDOF):
+	# OUTPUT : { property : (min, max) } for LigandFilter.select()
+	ranges = dict(FILTER_PRESETS[preset])
+	ranges["TORSDOF"] = (0, max_tors)
+	return ranges
+
+
+def VSSettings(gpf_text = "", dpf_text = "", map_source = MAPS_IN_JOB, gpf_parameter_file = "", dpf_parameter_file = "",
+		autogrid = None, map_dir = "", map_files = None, symlink = False, flexres_file = None, flex_residues = None,
+		target = "lin", scripts = "master", win_batch = False, pbs_time = "24:00:00", pbs_runs = 1,
+		package = None, vina_modes = 9, vina_exhaustiveness = 8, vina_cpu = 1, version = ""):
+	# INFO   : collect everything needed to generate the VS jobs
+	# INPUT  : gpf_text/dpf_text	: GPF and DPF templates
+	#          map_source		: MAPS_IN_JOB, MAPS_NOW or MAPS_CACHED
+	#          map_dir, map_files	: pre-calculated maps (MAPS_CACHED)
+	#          symlink		: link the cached maps instead of copying them
+	#          flexres_file		: flexible residues PDBQT, or
+	#          flex_residues	: flexible residues to be generated from each receptor ("ARG8,THR276")
+	#          target		: 'lin', 'pbs', 'win' or 'vina' (the search space of Vina
+	#				  is the grid of the GPF template, no maps nor DPF)
+	#          scripts		: 'master', 'single' or None
+	#          win_batch		: write .bat scripts instead of bash (Windows without Cygwin)
+	#          package		: None or one of PACKAGE_FORMATS
+	#          vina_*		: num_modes, exhaustiveness and cpu of the Vina config
+	# OUTPUT : settings dictionary
+	return {
+		'gpf_text'		: gpf_text,
+		'dpf_text'		: dpf_text,
+		'map_source'		: map_source,
+		'gpf_parameter_file'	: gpf_parameter_file,
+		'dpf_parameter_file'	: dpf_parameter_file,
+		'autogrid'		: autogrid,
+		'map_dir'		: map_dir,
+		'map_files'		: map_files,
+		'symlink'		: symlink,
+		'flexres_file'		: flexres_file,
+		'flex_residues'		: flex_residues,
+		'target'		: target,
+		'scripts'		: scripts,
+		'win_batch'		: win_batch,
+		'pbs_time'		: pbs_time,
+		'pbs_runs'		: pbs_runs,
+		'package'		: package,
+		'vina_modes'		: vina_modes,
+		'vina_exhaustiveness'	: vina_exhaustiveness,
+		'vina_cpu'		: vina_cpu,
+		'version'		: version }
+
+
+class StageTimer:
+	"""Wall-clock time spent in each stage of the generation.
+
+	start() closes the stage that is running (if any), so a sequence
+	of calls to start() splits the time between consecutive stages.
+	"""
+
+	def __init__(self):
+		self.stages = []
+		self.elapsed = {}
+		self.calls = {}
+		self.current = None
+		self.started = None
+
+	def start(self, stage):
+		self.stop()
+		if not self.elapsed.has_key(stage):
+			self.stages.append(stage)
+			self.elapsed[stage] = 0.
+			self.calls[stage] = 0
+		self.current = stage
+		self.started = time.time()
+
+	def stop(self):
+		if self.current is None:
+			return
+		self.elapsed[self.current] += time.time() - self.started
+		self.calls[self.current] += 1
+		self.current = None
+
+	def add(self, other):
+		# merge the timings of another StageTimer
+		for stage in other.stages:
+			if not self.elapsed.has_key(stage):
+				self.stages.append(stage)
+				self.elapsed[stage] = 0.
+				self.calls[stage] = 0
+			self.elapsed[stage] += other.elapsed[stage]
+			self.calls[stage] += other.calls[stage]
+
+	def total(self):
+		total = 0.
+		for stage in self.stages:
+			total += self.elapsed[stage]
+		return total
+
+	def report(self):
+		# OUTPUT : list of lines "stage   time   calls   time/call"
+		lines = []
+		for stage in self.stages:
+			elapsed, calls = self.elapsed[stage], self.calls[stage]
+			lines.append("%-14s %10.3f s  %8d calls  %10.3f ms/call" % (stage, elapsed, calls, 1000. * elapsed / max(calls, 1)))
+		lines.append("%-14s %10.3f s" % ("total", self.total()))
+		return lines
+
+
+def GetAtypes(filename):
+	# OUTPUT : list of the AutoDock atom types of a PDBQT (plain file or library)
+	atypes = []
+	for line in ReadLigand(filename):
+		if line[0:6] == 'HETATM' or line[0:4] == 'ATOM':
+			atom = line.split()[-1]
+			if atom not in atypes:
+				atypes.append(atom)
+	return atypes
+
+
+def TemplateKeywords(text):
+	# INFO   : parse a GPF/DPF template
+	# OUTPUT : generator of (keyword, argument) of the non-empty lines (comments removed)
+	for line in text.split('\n'):
+		if not line.strip(): # get rid of empty lines
+			continue
+		clean_line = line.split("#")[0] # get rid of comments
+		clean_line = clean_line.split(" ", 1)
+		keyword = clean_line[0]
+		try:
+			argument = clean_line[1]
+		except IndexError:
+			argument = ""
+		yield keyword, argument
+
+
+def GPFParameters(gpf_text, parameter_file = "", atom_types = None):
+	# INFO   : translate the GPF template in GridParameter4FileMaker parameters
+	# OUTPUT : list of "keyword=value"
+	#
+	# warning, this is limited to the keywords listed below
+	# but not others [ to be improved ]
+	parameters = []
+	if atom_types:
+		list_of_atom_types = []
+		for atype in atom_types:
+			if atype not in list_of_atom_types:
+				list_of_atom_types.append(atype)
+		parameters.append("ligand_types="+",".join(list_of_atom_types))
+
+	# add potential parameter file line
+	if parameter_file:
+		parameters.append("parameter_file="+parameter_file)
+
+	for keyword, argument in TemplateKeywords(gpf_text):
+		if keyword == "npts":
+			value = argument.split()
+			parameters.append(keyword+"="+value[0]+","+value[1]+","+value[2])
+		if keyword == "spacing" or keyword == "smooth":
+			parameters.append(keyword+"="+argument.replace(" ", ""))
+		if keyword == "gridcenter":
+			value = argument.split()
+			parameters.append(keyword+"="+value[0]+" "+value[1]+" "+value[2])
+		if keyword == "dielectric":
+			parameters.append(keyword+"='"+argument.replace(" ", "")+"'")
+	return parameters
+
+
+def FlexresTypes(flexres_filename, types):
+	# INFO   : add the atom types of the flexible residues to a types string
+	# OUTPUT : "A C HD ..."
+	# EXTRA  : the types are read from the PDBQT (as MolKit does), without MolKit
+	all_types = types.split()
+	for t in GetAtypes(flexres_filename):
+		if t not in all_types:
+			all_types.append(t)
+	return " ".join(all_types)
+
+
+def PrepareGPF(output_gpf_filename, receptor_filename, gpf_text, parameter_file = "", ligand_filename = None,
+		atom_types = None, flexres_filename = None, parameters = None):
+	# INFO   : generate a GPF from the template
+	# INPUT  : the maps are calculated for the types of the ligand or for atom_types
+	#          parameters (from GPFParameters()) are used instead of the template, if given
+	# OUTPUT : True
+	from AutoDockTools.GridParameters import GridParameter4FileMaker
+
+	if not parameters:
+		parameters = GPFParameters(gpf_text, parameter_file, atom_types)
+	gpfm = GridParameter4FileMaker(size_box_to_include_ligand = False, verbose = False)
+	if ligand_filename:
+		gpfm.set_ligand(ligand_filename)
+	gpfm.set_receptor(receptor_filename)
+	if flexres_filename:
+		gpfm.gpo['ligand_types']['value'] = FlexresTypes(flexres_filename, gpfm.gpo['ligand_types']['value'])
+	for p in parameters:
+		key, newvalue = p.split('=')
+		gpfm.set_grid_parameters(**{ key : newvalue })
+	gpfm.write_gpf(output_gpf_filename)
+	return True
+
+
+class ParameterTemplate:
+	"""GPF/DPF written by ADT with the ligand lines replaced by slots.
+
+	The template is compiled from the file of a reference ligand and it is
+	accepted (self.valid) only if rendering the same ligand gives back the
+	same file, so the files of the other ligands are written without MolKit.
+	The slots are the lines starting with one of the SLOTS keywords (all the
+	map lines make a single slot); render() returns None when a ligand
+	doesn't fit the template (ADT must be used then).
+	"""
+
+	SLOTS = ( "ligand_types", "map" )
+
+	def __init__(self, text, ligand_filename, values):
+		# INPUT  : reference text, its ligand and its values (ligand_types : list of types)
+		self.parts = [] # constant text or (keyword, comment column, comment)
+		self.stem = None
+		self.valid = False
+		if not values['ligand_types']:
+			return
+		constant = []
+		last = None
+		for line in text.splitlines(True):
+			words = line.split()
+			keyword = words and words[0]
+			if not keyword in self.SLOTS:
+				constant.append(line)
+				last = None
+				continue
+			if len(words) < 2:
+				return
+			if keyword == "map" and last == "map":
+				continue # one slot for all the maps
+			last = keyword
+			if keyword == "map":
+				suffix = ".%s.map" % values['ligand_types'][0]
+				if not words[1].endswith(suffix):
+					return
+				self.stem = words[1][:-len(suffix)]
+			self.compile(keyword, words, values)
+			self.parts.append("".join(constant))
+			constant = []
+			column = line.find("#")
+			if column < 0:
+				self.parts.append((keyword, None, line[len(line.rstrip()):]))
+			else:
+				self.parts.append((keyword, column, line[column:]))
+		self.parts.append("".join(constant))
+		self.parts = [ part for part in self.parts if part ]
+		self.valid = self.render(ligand_filename, values) == text
+
+	def compile(self, keyword, words, values):
+		# hook: learn the format of a slot from the reference line
+		pass
+
+	def value(self, keyword, ligand_filename, values):
+		# hook: value of a slot (None if it can't be rendered)
+		return " ".join(values[keyword])
+
+	def _line(self, keyword, value, column, comment):
+		if value is None:
+			return None
+		line = keyword+" "+value
+		if column is None:
+			return line+comment
+		if len(line) >= column:
+			return None # the layout of such a line is unknown
+		return line.ljust(column)+comment
+
+	def render(self, ligand_filename, values):
+		# INFO   : text of the file of a ligand
+		# INPUT  : ligand filename, values of the ligand
+		# OUTPUT : text, None if the template can't be used
+		if values is None:
+			return None
+		text = []
+		for part in self.parts:
+			if not isinstance(part, tuple):
+				text.append(part)
+				continue
+			keyword, column, comment = part
+			if keyword == "map":
+				for atype in values['ligand_types']:
+					text.append(self._line("map", "%s.%s.map" % (self.stem, atype), column, comment))
+			elif keyword == "ligand_types":
+				text.append(self._line(keyword, " ".join(values['ligand_types']), column, comment))
+			else:
+				text.append(self._line(keyword, self.value(keyword, ligand_filename, values), column, comment))
+		if None in text:
+			return None
+		return "".join(text)
+
+
+# order of the ligand types in the GPF written by GridParameter4FileMaker
+# (other types are in dictionary order: such ligands are left to ADT)
+GPF_TYPES_ORDER = ( "C", "A", "N", "NA", "NS", "OA", "OS", "SA", "S", "H", "HD" )
+
+def GPFValues(properties, flex_types = None):
+	# INFO   : ligand values of the GPF, from the registered properties
+	# INPUT  : properties (see LigandProperties), atom types of the flexible residues
+	# OUTPUT : dictionary used by GPFTemplate.render(), None if the types can't be ordered
+	for atype in properties["Atypes"]:
+		if atype not in GPF_TYPES_ORDER:
+			return None
+	types = [ atype for atype in GPF_TYPES_ORDER if atype in properties["Atypes"] ]
+	for atype in flex_types or []: # as FlexresTypes()
+		if atype not in types:
+			types.append(atype)
+	return { 'ligand_types' : types }
+
+
+class GPFTemplate(ParameterTemplate):
+	"""GPF written by PrepareGPF() with the ligand types and the maps replaced
+	by slots (see ParameterTemplate); the values come from GPFValues().
+	The receptor lines are constant: a template is compiled for each receptor.
+	"""
+
+
+class DockingParameter42FileMaker:
+	"""Accept a <ligand>.pdbqt and <receptor>.pdbqt and create
+	<ligand>_<receptor>42.dpf
+	"""
+
+	def __init__(self, verbose = None):
+		from AutoDockTools.DockingParameters import DockingParameters
+		self.verbose = verbose
+		self.dpo = DockingParameters()
+
+
+	def getTypes(self, molecule):
+		from AutoDockTools.atomTypeTools import AutoDock4_AtomTyper
+		if not len(molecule.allAtoms.bonds[0]):
+			molecule.buildBondsByDistance()
+		ad4_typer = AutoDock4_AtomTyper(verbose=self.verbose)
+		ad4_typer.setAutoDockElements(molecule)
+		dict = {}
+		for a in molecule.allAtoms:
+			dict[a.autodock_element] = 1
+		d_types = dict.keys()
+		d_types.sort()
+		mol_types = d_types[0]
+		for t in d_types[1:]:
+			mol_types = mol_types + " " + t
+		if self.verbose: print "end of getTypes: types=", mol_types, ' class=', mol_types.__class__
+		return mol_types
+
+
+	def set_write_all(self, value):
+		verbose = self.verbose
+		self.dpo['write_all_flag']['value'] = True
+		if verbose: print "set write_all_flag to", self.dpo['write_all_flag']['value']
+
+
+	def set_ligand(self, ligand_filename): 
+		from MolKit import Read
+		verbose = self.verbose
+		self.ligand_filename = os.path.basename(ligand_filename)
+		if verbose: print "set ligand_filename to", self.ligand_filename
+		self.dpo.set_ligand(ligand_filename)
+		#expect a filename like ind.out.pdbq: get 'ind' from it
+		self.ligand_stem = self.ligand_filename.split('.')[0]
+		if verbose: print "set ligand_stem to", self.ligand_stem
+		self.ligand = Read(ligand_filename)[0]
+		if self.ligand==None:
+			print 'ERROR reading: ', ligand_filename
+			return 
+		if verbose: print "read ", self.ligand.name
+		#set dpo:
+		#move
+		self.dpo['move']['value'] = self.ligand_filename
+		if verbose: print "set move to ", self.dpo['move']['value']
+		#ndihe
+		#assumes ligand has torTree
+		self.dpo['ndihe']['value'] = self.ligand.parser.keys.count("BRANCH")
+		#self.dpo['ndihe']['value'] = len(self.ligand.torTree.torsionMap)
+		if verbose: print "set ndihe to ", self.dpo['ndihe']['value']
+		#torsdof
+		#caution dpo['torsdof4']['value'] is a list [ndihe, 0.274]
+		try:
+			self.dpo['torsdof4']['value'][0] = self.ligand.TORSDOF
+		except:
+			print 'setting torsdof to ligand.ndihe=', self.ligand.ndihe
+			self.dpo['torsdof4']['value'][0] = self.ligand.ndihe
+		if verbose: print "set torsdof4 to ", self.dpo['torsdof4']['value']
+		#types
+		self.ligand.types = self.getTypes(self.ligand)
+		self.dpo['ligand_types']['value'] = self.ligand.types
+		if verbose: print "set types to ", self.dpo['ligand_types']['value']
+		#about
+		self.ligand.getCenter() 
+		cen = self.ligand.center
+		self.dpo['about']['value'] =  [round(cen[0],4), round(cen[1],4),\
+										round(cen[2],4)]
+		if verbose: print "set about to ", self.dpo['about']['value']
+		
+
+	def set_receptor(self, receptor_filename):
+		self.receptor_filename = os.path.basename(receptor_filename)
+		self.receptor_stem = self.receptor_filename.split('.')[0]
+		self.dpo.set_receptor(receptor_filename)
+
+
+	def set_flexres(self, flexres_filename):
+		from MolKit import Read
+		flexmol = Read(flexres_filename)[0]
+		flexres_filename = os.path.basename(flexres_filename)
+		self.dpo['flexres_flag']['value'] = True
+		self.dpo['flexres']['value'] = flexres_filename
+		#make sure each atom type in flexres molecule is in ligand_types
+		d = {}
+		current_types = self.dpo['ligand_types']['value'].split()
+		for t in current_types:
+			d[t] = 1
+		for a in flexmol.allAtoms:
+			d[a.autodock_element] = 1
+		self.dpo['ligand_types']['value'] = " ".join(d.keys())
+
+
+	def set_docking_parameters(self, **kw):
+		"""Any docking parameters should be set here
+		"""
+		# like this: 
+		# newdict = {'ga_num_evals':1750000, 'ga_pop_size':150,
+		#			'ga_run':20, 'rmstol':2.0}
+		# self.mv.dpo['<parameter>']['value'] = <new value>
+		for parm, newvalue in kw.items():
+			self.dpo[parm]['value'] = newvalue
+			if parm=='set_sw1':
+				self.dpo['set_psw1']['value'] = not newvalue
+			if parm=='set_psw1':
+				self.dpo['set_sw1']['value'] = not newvalue
+			if parm=='flexres':
+				self.set_flexres(newvalue) 
+			if parm=='write_all':
+				self.set_write_all(newvalue) 
+
+
+	def write_dpf(self, dpf_filename, parm_list = None, pop_seed = False):
+		if parm_list is None:
+			from AutoDockTools.DockingParameters import genetic_algorithm_local_search_list4_2
+			parm_list = genetic_algorithm_local_search_list4_2
+		if not dpf_filename:
+			dpf_filename = "%s%s%s%s" % \
+						   (self.ligand_stem, "_",
+							self.receptor_stem, ".dpf")
+		# now that we have a filename...
+		# set initial conformation
+		if pop_seed:
+			self.dpo['tran0']['value'] = self.dpo['about']['value']
+			self.dpo['quat0']['value'] = '1.0 0. 0. 0.'
+			dihe0 = '0. '*self.dpo['ndihe']['value']
+			dihe0.rstrip()
+			self.dpo['dihe0']['value'] = dihe0 
+		if self.verbose:
+			print "writing ", dpf_filename
+		self.dpo.write42(dpf_filename, parm_list)
+
+
+# DPF template keywords used for the docking parameters:
+#   1 : first value, 2 : first two values, '*' : the whole argument,
+#   '-' : argument without spaces, 0 : flag (no value)
+DPF_KEYWORDS = {
+	"autodock_parameter_version" : 1, "parameter_file" : '*', "outlev" : '*', "seed" : 2,
+	"tran0" : '-', "axisangle0" : 1, "dihe" : 1, "tstep" : 1, "qstep" : 1, "dstep" : 1,
+	"unbound" : 1, "rmstol" : 1, "extnrg" : 1, "e0max" : 2,
+	"ga_pop_size" : 1, "ga_num_evals" : 1, "ga_num_generations" : 1, "ga_elitism" : 1,
+	"ga_mutation_rate" : 1, "ga_crossover_rate" : 1, "ga_window_size" : 1,
+	"ga_cauchy_alpha" : 1, "ga_cauchy_beta" : 1, "set_ga" : 0,
+	"sw_max_its" : 1, "sw_max_succ" : 1, "sw_max_fail" : 1, "sw_rho" : 1, "sw_lb_rho" : 1,
+	"ls_search_freq" : 1, "set_psw1" : 0, "set_sw1" : 0, "unbound_model" : 1,
+	"ga_run" : 1, "analysis" : 0 }
+
+def DPFParameters(dpf_text):
+	# INFO   : translate the DPF template in DockingParameter42FileMaker parameters
+	# OUTPUT : list of "keyword=value"
+	parameters = []
+	for keyword, argument in TemplateKeywords(dpf_text):
+		if not DPF_KEYWORDS.has_key(keyword):
+			continue
+		kind = DPF_KEYWORDS[keyword]
+		if kind == 0:
+			value = " "
+		elif kind == '*':
+			value = argument
+		elif kind == '-':
+			value = argument.replace(" ", "")
+		else:
+			value = " ".join(argument.split()[0:kind])
+		parameters.append(keyword+"="+value)
+	return parameters
+
+
+def PrepareDPF(dpf_filename, receptor_filename, ligand_filename, dpf_text, flexres_filename = None,
+		search_algorithm = "GA", parameters = None):
+	# INFO   : generate a DPF from the template
+	# INPUT  : parameters (list of "keyword=value") are used instead of the template, if given
+	# OUTPUT : nothing
+	from AutoDockTools.DockingParameters import genetic_algorithm_local_search_list4_2, \
+			local_search_list4_2, simulated_annealing_list4_2
+
+	if search_algorithm == "GA": # GA-only supported keywords
+		parameter_list = genetic_algorithm_local_search_list4_2
+	if search_algorithm == "LS":
+		parameter_list = local_search_list4_2 # not explicitly supported
+	if search_algorithm == "SA":
+		parameter_list = simulated_annealing_list4_2 # not explicitly supported
+	parameter_list = list(parameter_list) # the ADT lists are shared: never extend them
+	pop_seed = False
+
+	if not parameters:
+		parameters = DPFParameters(dpf_text)
+
+	dm = DockingParameter42FileMaker(verbose=None)
+	dm.set_ligand(ligand_filename)
+	dm.set_receptor(receptor_filename)
+	if flexres_filename is not None:
+		dm.dpo['ligand_types']['value'] = FlexresTypes(flexres_filename, dm.dpo['ligand_types']['value'])
+		dm.dpo['flexres']['value'] = os.path.basename(flexres_filename)
+		dm.dpo['flexres_flag']['value'] = True
+	for p in parameters:
+		key, newvalue = p.split('=')
+		if newvalue[0]=='[':
+			nv = []
+			for item in newvalue[1:-1].split(','):
+				nv.append(float(item))
+			newvalue = nv
+		elif 'flag' in key:
+			if newvalue in ['1','0']:
+				newvalue = int(newvalue)
+			if newvalue =='False':
+				newvalue = False
+			if newvalue =='True':
+				newvalue = True
+		dm.set_docking_parameters(**{ key : newvalue })
+		if key not in parameter_list:
+			#special hack for output_pop_file
+			if key=='output_pop_file':
+				parameter_list.insert(parameter_list.index('set_ga'), key)
+			else:
+				parameter_list.append(key) 
+	dm.write_dpf(dpf_filename, parameter_list, pop_seed)
+
+
+def DPFValues(properties, flex_types = None):
+	# INFO   : ligand values of the DPF, from the registered properties
+	# INPUT  : properties (see LigandProperties), atom types of the flexible residues
+	# OUTPUT : dictionary used by DPFTemplate.render(); 'about' (the center)
+	#          is None until DPFTemplate reads it from the ligand file
+	types = list(properties["Atypes"])
+	types.sort()
+	for atype in flex_types or []: # as FlexresTypes()
+		if atype not in types:
+			types.append(atype)
+	return {	'ligand_types'	: types,
+			'ndihe'		: properties["NDIHE"],
+			'torsdof'	: properties["TORSDOF"] or properties["NDIHE"],
+			'about'		: None }
+
+
+class DPFTemplate(ParameterTemplate):
+	"""DPF written by PrepareDPF() with the ligand lines replaced by slots
+	(see ParameterTemplate); the values come from DPFValues().
+	"""
+
+	SLOTS = ( "ligand_types", "map", "move", "about", "ndihe", "torsdof" )
+	ABOUT_FORMATS = ( "%s", "%.4f", "%.3f", "%.2f" )
+
+	def __init__(self, text, ligand_filename, values):
+		self.reference = ligand_filename # the center of the reference ligand is read by compile()
+		ParameterTemplate.__init__(self, text, ligand_filename, values)
+
+	def center(self, ligand_filename, values):
+		# center of the ligand, read from its file the first time it's needed
+		if values['about'] is None:
+			values['about'] = [ round(x, 4) for x in LigandCenter(ReadLigand(ligand_filename)) ]
+		return values['about']
+
+	def compile(self, keyword, words, values):
+		if keyword == "about":
+			# format of the coordinates of the center
+			self.about = None
+			for format in self.ABOUT_FORMATS:
+				if [ format % x for x in self.center(self.reference, values) ] == words[1:4]:
+					self.about = format
+					break
+
+	def value(self, keyword, ligand_filename, values):
+		if keyword == "move":
+			return os.path.basename(ligand_filename)
+		if keyword == "about":
+			if self.about is None:
+				return None
+			return " ".join([ self.about % x for x in self.center(ligand_filename, values) ])
+		return str(values[keyword])
+
+
+def GenFlex(receptor_filename, residues):
+	# INFO   : split the receptor in rigid and flexible parts
+	# INPUT  : receptor PDBQT, residue names ("ARG8,THR276")
+	# OUTPUT : (rigid filename, flexres filename)
+	from MolKit import Read
+	from MolKit.protein import ResidueSet
+	from MolKit.molecule import BondSet
+	from AutoDockTools.MoleculePreparation import AD4FlexibleReceptorPreparation
+
+	name = os.path.splitext(receptor_filename)[0]
+	rigid_filename = name+"_rigid.pdbqt"
+	flexres_filename = name+"_flex.pdbqt"
+	if DEBUG: print "GenFlex> rigid = %s, flexres = %s (%s)" % (rigid_filename, flexres_filename, residues)
+
+	disallowed_pairs = ""
+	r = Read(receptor_filename)[0]
+	r.buildBondsByDistance()
+	all_res = ResidueSet()
+	for n in residues.replace(" ", "").split(','):
+		all_res += r.chains.residues.get(lambda x: x.name == n)
+	d = {}
+	for res in all_res: d[res] = 1
+	all_res = ResidueSet(d.keys())
+	all_bnds = BondSet()
+	for pair in disallowed_pairs.split(':'):
+		names = pair.split('_')
+		all_bnds += all_res.atoms.bonds[0].get(lambda x: x.atom1.name in names and x.atom2.name in names)
+	AD4FlexibleReceptorPreparation(r, residues = all_res, rigid_filename = rigid_filename,
+			flexres_filename = flexres_filename, non_rotatable_bonds = all_bnds)
+	return rigid_filename, flexres_filename
+
+
+def MapFiles(source_dir):
+	# OUTPUT : the maps calculated in source_dir (*.map and the *.maps.xyz/fld)
+	map_files = glob.glob(os.path.join(source_dir, "*.map"))
+	map_files.append(glob.glob(os.path.join(source_dir, "*.xyz"))[0])
+	map_files.append(glob.glob(os.path.join(source_dir, "*.fld"))[0])
+	return map_files
+
+
+MAP_HEADER = ( "GRID_PARAMETER_FILE", "GRID_DATA_FILE", "MACROMOLECULE", "SPACING", "NELEMENTS", "CENTER" )
+
+def MapHeader(filename):
+	# INFO   : read the header of an AutoGrid map and verify its data
+	# OUTPUT : (header dictionary, problem); problem is None if the number of
+	#          values is the number of grid points (nx+1)*(ny+1)*(nz+1)
+	# EXTRA  : the map is memory-mapped and the lines are counted by numpy
+	header = {}
+	try:
+		map_file = open(filename, 'rb')
+	except IOError, e:
+		return header, "unreadable (%s)" % e.strerror
+	try:
+		size = os.fstat(map_file.fileno()).st_size
+		if not size:
+			return header, "empty file"
+		data = mmap.mmap(map_file.fileno(), 0, access = mmap.ACCESS_READ)
+		try:
+			for keyword in MAP_HEADER:
+				words = data.readline().split()
+				if not words or not words[0] == keyword:
+					return header, "%s missing from the header" % keyword
+				header[keyword] = " ".join(words[1:])
+			body = data.tell()
+			lines = numpy.count_nonzero(numpy.frombuffer(data, numpy.uint8)[body:] == 10)
+			if not data[size-1] == "\n":
+				lines += 1
+		finally:
+			data.close()
+	finally:
+		map_file.close()
+	try:
+		points = 1
+		for n in header["NELEMENTS"].split():
+			points *= int(n) + 1
+	except ValueError:
+		return header, "invalid NELEMENTS (%s)" % header["NELEMENTS"]
+	if not lines == points:
+		return header, "%d values instead of %d" % (lines, points)
+	return header, None
+
+
+def _ThreadMap(function, items, workers):
+	# OUTPUT : [ function(item) for item in items ], computed by a pool of threads
+	#          (for functions releasing the GIL: I/O, numpy)
+	tasks, results = Queue.Queue(), [ None ] * len(items)
+	for index in range(len(items)):
+		tasks.put(index)
+	def worker():
+		while True:
+			try:
+				index = tasks.get(False)
+			except Queue.Empty:
+				return
+			results[index] = function(items[index])
+	threads = [ threading.Thread(target = worker) for i in range(max(1, min(workers, len(items)))) ]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+def CheckMaps(map_files, workers = None):
+	# INFO   : verify that the AutoGrid maps are complete and calculated on the same grid
+	# INPUT  : map files (the *.map; other files are ignored), number of threads
+	# OUTPUT : list of (map file, problem), empty if the maps are consistent
+	if workers is None:
+		workers = CPUCount()
+	map_files = [ name for name in map_files if name.endswith(".map") ]
+	return CompareMaps(map_files, _ThreadMap(MapHeader, map_files, workers))
+
+
+def CompareMaps(map_files, checked):
+	# INFO   : problems of the maps, from their MapHeader()
+	# OUTPUT : list of (map file, problem), empty if the maps are consistent
+	# EXTRA  : the reference grid is the one of most of the maps
+	problems = []
+	grids = {}
+	keywords = [ keyword for keyword in MAP_HEADER if not keyword == "GRID_DATA_FILE" ]
+	for index in range(len(map_files)):
+		header, problem = checked[index]
+		if problem:
+			problems.append((map_files[index], problem))
+		else:
+			grid = tuple([ header[keyword] for keyword in keywords ])
+			grids.setdefault(grid, []).append(index)
+	if len(grids) > 1:
+		reference = max([ (len(maps), grid) for grid, maps in grids.items() ])[1]
+		for grid, maps in grids.items():
+			if grid == reference:
+				continue
+			different = [ "%s %s (not %s)" % (keywords[i], grid[i], reference[i]) for i in range(len(grid)) if not grid[i] == reference[i] ]
+			for index in maps:
+				problems.append((map_files[index], ", ".join(different)))
+	problems.sort()
+	return problems
+
+
+class MapDirIndex:
+	"""Manifest of a directory of AutoGrid maps (the map files, their
+	size, mtime and MapHeader()), so that a directory already seen is
+	not scanned and its maps not parsed again until it changes.
+
+		index = MapDirIndex(map_dir)
+		index.files, index.types, index.problems
+
+	The manifest is saved in the directory (MANIFEST) or, when it is
+	read-only, in ~/.raccoon/mapdirs. Only the maps added or modified
+	since the last time are parsed (self.parsed).
+	"""
+
+	MANIFEST = ".raccoon_maps"
+	VERSION = "# Raccoon map manifest 1"
+
+	def __init__(self, map_dir, workers = None):
+		self.map_dir = os.path.abspath(map_dir)
+		self.files = []
+		self.types = []
+		self.problems = []
+		self.parsed = 0
+		self.entries = {} # name : (size, mtime, problem, header)
+		self.manifest = None
+		for manifest in (os.path.join(self.map_dir, self.MANIFEST), self._user_manifest()):
+			if os.path.exists(manifest):
+				self.manifest = manifest
+				break
+		mtime = self._load()
+		if not mtime == os.stat(self.map_dir).st_mtime or not self._unchanged():
+			self._scan(workers)
+			self._save()
+		self._update()
+
+	def _user_manifest(self):
+		import hashlib
+		return os.path.join(RACCOON_DIR, "mapdirs", hashlib.sha1(self.map_dir).hexdigest())
+
+	def _stat(self, name):
+		info = os.stat(os.path.join(self.map_dir, name))
+		return info.st_size, info.st_mtime
+
+	def _load(self):
+		# OUTPUT : mtime of the directory when the manifest was written (None if missing)
+		if not self.manifest:
+			return None
+		try:
+			lines = open(self.manifest).read().splitlines()
+			if not lines or not lines[0] == self.VERSION:
+				return None
+			mtime = float(lines[1])
+			for line in lines[2:]:
+				fields = line.split("\t")
+				header = {}
+				if len(fields) > 4:
+					for index in range(len(MAP_HEADER)):
+						header[MAP_HEADER[index]] = fields[4+index]
+				self.entries[fields[0]] = (int(fields[1]), float(fields[2]), fields[3] or None, header)
+			return mtime
+		except (IOError, ValueError, IndexError), e:
+			if DEBUG: print "MapDirIndex> ignoring the manifest %s (%s)" % (self.manifest, e)
+			self.entries = {}
+			return None
+
+	def _unchanged(self):
+		# no file modified in place (the directory mtime covers additions and removals)
+		try:
+			for name in self.entries:
+				if not self._stat(name) == self.entries[name][:2]:
+					return False
+		except OSError:
+			return False
+		return True
+
+	def _scan(self, workers):
+		entries = {}
+		todo = []
+		for name in os.listdir(self.map_dir):
+			if not (name.endswith(".map") or ".maps." in name) or os.path.isdir(os.path.join(self.map_dir, name)):
+				continue
+			size, mtime = self._stat(name)
+			if self.entries.has_key(name) and self.entries[name][:2] == (size, mtime):
+				entries[name] = self.entries[name]
+			elif name.endswith(".map"):
+				todo.append(name)
+				entries[name] = (size, mtime, None, {})
+			else:
+				entries[name] = (size, mtime, None, {})
+		if workers is None:
+			workers = CPUCount()
+		checked = _ThreadMap(MapHeader, [ os.path.join(self.map_dir, name) for name in todo ], workers)
+		for index in range(len(todo)):
+			header, problem = checked[index]
+			entries[todo[index]] = entries[todo[index]][:2] + (problem, header)
+		self.parsed = len(todo)
+		self.entries = entries
+
+	def _text(self):
+		lines = [ self.VERSION, repr(os.stat(self.map_dir).st_mtime) ]
+		for name in sorted(self.entries.keys()):
+			size, mtime, problem, header = self.entries[name]
+			fields = [ name, str(size), repr(mtime), problem or "" ]
+			if header:
+				fields += [ header[keyword] for keyword in MAP_HEADER ]
+			lines.append("\t".join(fields))
+		return "\n".join(lines)+"\n"
+
+	def _save(self):
+		for manifest in (os.path.join(self.map_dir, self.MANIFEST), self._user_manifest()):
+			try:
+				if not os.path.exists(os.path.dirname(manifest)):
+					os.makedirs(os.path.dirname(manifest), 0755)
+				WriteText(manifest+".tmp", self._text())
+				os.rename(manifest+".tmp", manifest)
+				if os.path.dirname(manifest) == self.map_dir:
+					# the rename changed the mtime of the directory: rewritten
+					# in place (which does not change it) with the new one
+					WriteText(manifest, self._text())
+				self.manifest = manifest
+				return
+			except (IOError, OSError), e:
+				if DEBUG: print "MapDirIndex> manifest not saved in %s (%s)" % (manifest, e)
+
+	def _update(self):
+		names = sorted(self.entries.keys())
+		self.files = [ os.path.join(self.map_dir, name) for name in names ]
+		maps = [ name for name in names if name.endswith(".map") ]
+		self.types = [ name.split(".")[-2] for name in maps if len(name.split(".")) > 2 ]
+		self.problems = CompareMaps([ os.path.join(self.map_dir, name) for name in maps ],
+				[ (self.entries[name][3], self.entries[name][2]) for name in maps ])
+
+
+RMAP_SUFFIX = ".rmap"
+RMAP_MAGIC = "RACCOON-RMAP 1\n"
+RMAP_ENCODINGS = ( "float32", "float64" ) # tried in this order, then "text"
+
+def _Align(size):
+	return (size + 7) & ~7
+
+
+def _MapValues(text):
+	# INFO   : binary form of the values of a map (one number per line)
+	# OUTPUT : (encoding, decimals, numpy array), or ("text", 0, None) if
+	#          no encoding gives back exactly the same text
+	lines = text[:64].split("\n", 1)
+	if not text or not text.endswith("\n") or not "." in lines[0]:
+		return "text", 0, None
+	decimals = len(lines[0].strip().split(".")[1])
+	try:
+		values = numpy.fromstring(text, dtype = numpy.float64, sep = "\n")
+	except ValueError:
+		return "text", 0, None
+	for encoding in RMAP_ENCODINGS:
+		array = values.astype(encoding)
+		if _MapText(array, decimals) == text:
+			return encoding, decimals, array
+	return "text", 0, None
+
+
+def _MapText(array, decimals):
+	# values of a map as AutoGrid writes them
+	return (("%%.%df\n" % decimals) * len(array)) % tuple(array.tolist())
+
+
+def PackMaps(map_files, filename, compress = False):
+	# INFO   : pack AutoGrid maps (and their fld, xyz...) in a .rmap container
+	# INPUT  : files, container filename, zlib compression of each file
+	# OUTPUT : (bytes of the files, bytes of the container)
+	# EXTRA  : the values are stored as float32 (or float64) only if they are
+	#          written back exactly as in the map, so unpacking is lossless
+	import zlib
+	index, blobs = [], []
+	offset = 0
+	original = 0
+	for map_file in map_files:
+		text = open(map_file, 'rb').read()
+		original += len(text)
+		name = os.path.basename(map_file)
+		header, encoding, decimals, count = "", "text", 0, 0
+		if name.endswith(".map"):
+			lines = text.split("\n", len(MAP_HEADER))
+			if len(lines) > len(MAP_HEADER):
+				header = "\n".join(lines[:len(MAP_HEADER)])+"\n"
+				encoding, decimals, array = _MapValues(lines[-1])
+		if encoding == "text":
+			header, blob = "", text
+		else:
+			count = len(array)
+			blob = header + "\0" * (_Align(len(header)) - len(header)) + array.tostring()
+		compression = "none"
+		if compress:
+			compression, blob = "zlib", zlib.compress(blob, 6)
+		index.append("\t".join([ name, encoding, compression, str(offset), str(len(blob)),
+				str(len(header)), str(count), str(decimals) ]))
+		blobs.append(blob + "\0" * (_Align(len(blob)) - len(blob)))
+		offset += len(blobs[-1])
+	index = "\n".join(index)+"\n"
+	start = len(RMAP_MAGIC) + len("%d\n" % len(index)) + len(index)
+	output = open(filename+".tmp", 'wb')
+	try:
+		output.write(RMAP_MAGIC + "%d\n" % len(index) + index)
+		output.write("\0" * (_Align(start) - start))
+		for blob in blobs:
+			output.write(blob)
+	finally:
+		output.close()
+	os.rename(filename+".tmp", filename)
+	return original, os.path.getsize(filename)
+
+
+class PackedMaps:
+	"""Maps of a .rmap container (see PackMaps), memory-mapped.
+
+		packed = PackedMaps(filename)
+		packed.names(), packed.header(name), packed.values(name)
+		packed.extract(name, filename)
+
+	values() of the uncompressed maps are numpy arrays on the mapped
+	file (nothing is read until they are used).
+	"""
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.file = open(filename, 'rb')
+		try:
+			if not self.file.read(len(RMAP_MAGIC)) == RMAP_MAGIC:
+				raise RaccoonError("%s is not a Raccoon map container" % filename)
+			size = int(self.file.readline())
+			index = self.file.read(size)
+			self.start = _Align(self.file.tell())
+			self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+		except (ValueError, EnvironmentError), e:
+			self.file.close()
+			raise RaccoonError("Impossible to read the map container %s (%s)" % (filename, e))
+		self.entries = {}
+		self.order = []
+		for line in index.splitlines():
+			name, encoding, compression, offset, length, header, count, decimals = line.split("\t")
+			self.entries[name] = (encoding, compression, self.start+int(offset), int(length), int(header), int(count), int(decimals))
+			self.order.append(name)
+
+	def names(self):
+		return list(self.order)
+
+	def _blob(self, name):
+		# OUTPUT : (buffer, offset, length) of the packed file in the buffer
+		#          (the decompressed file for the zlib entries)
+		import zlib
+		encoding, compression, offset, length = self.entries[name][:4]
+		if compression == "zlib":
+			blob = zlib.decompress(self.data[offset:offset+length])
+			return blob, 0, len(blob)
+		return self.data, offset, length
+
+	def header(self, name):
+		# OUTPUT : MapHeader() dictionary of a map ({} for the other files)
+		header = {}
+		length = self.entries[name][4]
+		if length:
+			blob, offset, size = self._blob(name)
+			for line in blob[offset:offset+length].splitlines():
+				words = line.split()
+				header[words[0]] = " ".join(words[1:])
+		return header
+
+	def values(self, name):
+		# OUTPUT : numpy array of the values of a map (None for the other files)
+		encoding, compression, offset, length, header, count, decimals = self.entries[name]
+		if encoding == "text":
+			return None
+		blob, offset, size = self._blob(name)
+		return numpy.frombuffer(blob, numpy.dtype(encoding), count, offset + _Align(header))
+
+	def text(self, name):
+		# OUTPUT : the file, as it was packed
+		encoding, compression, offset, length, header, count, decimals = self.entries[name]
+		blob, offset, size = self._blob(name)
+		if encoding == "text":
+			return blob[offset:offset+size]
+		return blob[offset:offset+header] + _MapText(self.values(name), decimals)
+
+	def extract(self, name, filename):
+		output = open(filename, 'wb')
+		try:
+			output.write(self.text(name))
+		finally:
+			output.close()
+
+	def problems(self):
+		# OUTPUT : CompareMaps() of the packed maps
+		maps = [ name for name in self.order if name.endswith(".map") ]
+		checked = []
+		for name in maps:
+			header, problem = self.header(name), None
+			if self.entries[name][0] == "text":
+				problem = "values not packed"
+			elif not len(header) == len(MAP_HEADER):
+				problem = "incomplete header"
+			else:
+				points = 1
+				for n in header["NELEMENTS"].split():
+					points *= int(n) + 1
+				if not points == self.entries[name][5]:
+					problem = "%d values instead of %d" % (self.entries[name][5], points)
+			checked.append((header, problem))
+		return CompareMaps([ self.filename+":"+name for name in maps ], checked)
+
+	def close(self):
+		self.data.close()
+		self.file.close()
+
+
+def UnpackMaps(filename, destination_dir, names = None):
+	# INFO   : write the maps of a .rmap container in destination_dir
+	# INPUT  : container, directory, [ names of the files (default: all) ]
+	# OUTPUT : list of the files written
+	packed = PackedMaps(filename)
+	try:
+		if names is None:
+			names = packed.names()
+		files = []
+		for name in names:
+			files.append(os.path.join(destination_dir, name))
+			packed.extract(name, files[-1])
+		return files
+	finally:
+		packed.close()
+
+
+def CopyMapDir(atomtypes_to_copy, source_dir, destination_dir, map_files = None, symlink = False, stats = None):
+	# INFO   : copy or make symbolic links of map files
+	# INPUT  : atom types, source directory (links are relative to it),
+	#          destination, [ map files (default: all the maps in source_dir) ],
+	#          TransferStats of the copies
+	# OUTPUT : True if all the maps (+e, +d and maps.*) were found
+	# EXTRA  : copies are reflinks or hard links when possible (see LinkOrCopy);
+	#          the maps in .rmap containers (map_files) are unpacked
+	if source_dir == destination_dir:
+		if DEBUG: print "CopyMapDir> skipping copy/symlink because the directories are the same"
+		return True
+	if map_files is None:
+		map_files = MapFiles(source_dir)
+	packed = {} # map (as if it was next to the container) : PackedMaps
+	containers = []
+	for container in [ map for map in map_files if map.endswith(RMAP_SUFFIX) ]:
+		maps = PackedMaps(container)
+		containers.append(maps)
+		for name in maps.names():
+			packed[os.path.join(os.path.dirname(container), name)] = maps
+	map_files = [ map for map in map_files if not map.endswith(RMAP_SUFFIX) ] + packed.keys()
+
+	counter = 0
+	atomtypes_to_copy = list(atomtypes_to_copy) + [ 'e', 'd', 'maps' ]
+	try:
+		for atype in atomtypes_to_copy:
+			for map in map_files:
+				if atype == map.split(".")[-2]:
+					try:
+						if packed.has_key(map):
+							destination = destination_dir+os.sep+os.path.basename(map)
+							packed[map].extract(os.path.basename(map), destination)
+							if stats:
+								stats.count('unpack', os.path.getsize(destination))
+						elif symlink:
+							map_filename = os.path.basename(map)
+							SRC = "../"+os.path.basename(source_dir)+os.sep+map_filename
+							os.symlink(SRC, destination_dir+os.sep+map_filename)
+						else:
+							method = LinkOrCopy(map, destination_dir+os.sep+os.path.basename(map))
+							if stats:
+								stats.count(method, os.path.getsize(map))
+						counter = counter + 1 # +1 to account for the two maps.* files
+					except:
+						raise RaccoonError("Some problem occurred when copying or linking the file %s" % map)
+	finally:
+		for maps in containers:
+			maps.close()
+	return len(atomtypes_to_copy)+1 == counter
+
+
+def AutoGridCommand(gpf, autogrid):
+	# OUTPUT : (command line, log file) of AutoGrid, to be run in the GPF directory
+	glg = gpf.rsplit('.', 1)[:-1][0]+".glg"
+	return [ autogrid, "-p", os.path.basename(gpf), "-l", os.path.basename(glg) ], glg
+
+
+def CheckAutoGridLog(glg):
+	# OUTPUT : True, RaccoonError with the AutoGrid message on failures
+	try:
+		GridLog = open(glg, 'r')
+		log = GridLog.readlines()
+		GridLog.close()
+	except IOError:
+		raise RaccoonError("Maps calculation failed: the AutoGrid log %s is missing" % glg)
+	if len(log) > 1 and "Successful Completion" in log[-2]:
+		return True
+	raise RaccoonError("Maps calculation failed with the following message:\n %s" % "".join(log[-7:]))
+
+
+def RunAutoGrid(working_dir, gpf, autogrid):
+	# INFO   : run AutoGrid in working_dir
+	# OUTPUT : True, RaccoonError with the AutoGrid message on failures
+	command, glg = AutoGridCommand(gpf, autogrid)
+	try:
+		subprocess.call(command, cwd = working_dir)
+	except OSError, e:
+		raise RaccoonError("Impossible to run AutoGrid (%s):\n%s" % (autogrid, e))
+	return CheckAutoGridLog(glg)
+
+
+def GPFValue(lines, keyword):
+	# OUTPUT : first word after keyword in the GPF lines (None if missing)
+	for line in lines:
+		words = line.split()
+		if len(words) > 1 and words[0] == keyword:
+			return words[1]
+	return None
+
+
+class AutoGridJob:
+	"""The maps of a receptor in output_dir, calculated by MapScheduler.
+
+	The maps found in the MapStore are taken from there (self.done is
+	True and AutoGrid is not needed). Otherwise runs() are either the GPF
+	of all the maps or, when split, a GPF for each atom type (only the
+	first one calculating the e/d maps too). The split runs are done in
+	subdirectories with the same file names as a single run, so that
+	merge() puts identical maps and a single fld in output_dir; clean()
+	removes the subdirectories of the runs not merged.
+	"""
+
+	def __init__(self, output_dir, receptor, atom_types, gpf_text, parameter_file = "", autogrid = None,
+			flexres_filename = None, store = None, name = None):
+		self.output_dir = output_dir
+		self.autogrid = autogrid
+		self.store = store
+		self.name = name
+		self.stem = os.path.basename(receptor).rsplit('.', 1)[:-1][0]
+		self.gpf = None
+		self.splitted = []
+		self.done = False
+		if not os.path.dirname(receptor) == output_dir:
+			try:
+				shutil.copy2(receptor, output_dir)
+			except:
+				raise RaccoonError("Impossible to copy the receptor in the target directory for caching the maps.")
+		else:
+			if DEBUG: print "AutoGridJob> skipping the receptor copy, because files are identical"
+		names = [ atype+".map" for atype in list(atom_types) + [ 'e', 'd' ] ] + [ "maps.xyz", "maps.fld" ]
+		self.keys = {}
+		if store:
+			# the fld lists all the maps: it depends on the whole set of types
+			self.keys = store.keys(receptor, gpf_text, parameter_file, names[:-1])
+			self.keys["maps.fld"] = store.keys(receptor, gpf_text, parameter_file, [ "maps.fld "+" ".join(atom_types) ]).values()[0]
+			if not [ name for name in names if not store.has(self.keys[name]) ]:
+				store.hits += 1
+				for name in names:
+					store.get(self.keys[name], self.file(name))
+				self.done = True
+				return
+			store.misses += 1
+		if not autogrid:
+			raise RaccoonError("The AutoGrid binary file is required for pre-caching maps.")
+		for name in names: # maps linked from the store must not be overwritten
+			if os.path.lexists(self.file(name)):
+				os.remove(self.file(name))
+		gpf_name = self.file("_all_maps.gpf")
+		try:
+			PrepareGPF(gpf_name, receptor, gpf_text, parameter_file, atom_types = atom_types, flexres_filename = flexres_filename)
+		except:
+			return
+		self.gpf = gpf_name
+
+	def file(self, name):
+		# file of the maps of the receptor in output_dir ("C.map", "maps.fld", ...)
+		if name.startswith("_"):
+			return self.output_dir+os.sep+self.stem+name
+		return self.output_dir+os.sep+self.stem+"."+name
+
+	def runs(self, split = False):
+		# INFO   : AutoGrid runs needed by the maps
+		# OUTPUT : list of (working directory, GPF)
+		if self.done or not self.gpf:
+			return []
+		lines = open(self.gpf).readlines()
+		types = []
+		for line in lines:
+			if line.split()[:1] == [ "ligand_types" ]:
+				types = line.split('#')[0].split()[1:]
+		if not split or len(types) < 2:
+			return [ (self.output_dir, self.gpf) ]
+		self.splitted = []
+		for index in range(len(types)):
+			path = self.output_dir+os.sep+".autogrid_%d" % index
+			MakeDir(path)
+			text = []
+			map_index = 0
+			for line in lines:
+				keyword = line.split()[:1]
+				if keyword == [ "ligand_types" ]:
+					line = line.replace(" ".join(types), types[index], 1)
+				elif keyword == [ "map" ]:
+					map_index += 1
+					if not map_index == index+1:
+						continue
+				elif keyword in ([ "elecmap" ], [ "dsolvmap" ]) and index > 0:
+					continue # optional in AutoGrid 4: done by the first run only
+				elif keyword in ([ "receptor" ], [ "parameter_file" ]):
+					# the files with relative names must be found in the subdirectory
+					name = line.split()[1]
+					if not os.path.isabs(name) and os.path.exists(self.output_dir+os.sep+name):
+						LinkOrCopy(self.output_dir+os.sep+name, path+os.sep+name)
+				text.append(line)
+			WriteText(path+os.sep+os.path.basename(self.gpf), "".join(text))
+			self.splitted.append((path, path+os.sep+os.path.basename(self.gpf)))
+		return self.splitted
+
+	def merge(self):
+		# INFO   : put the maps of the split runs in output_dir and add the maps to the store
+		if self.splitted:
+			self._merge()
+		for name in self.keys:
+			if os.path.exists(self.file(name)):
+				self.store.add(self.keys[name], self.file(name))
+		self.done = True
+
+	def _merge(self):
+		import re
+		labels, variables, log = [], [], []
+		for index in range(len(self.splitted)):
+			path, gpf = self.splitted[index]
+			lines = open(gpf).readlines()
+			fld_name = GPFValue(lines, "gridfld")
+			maps = [ GPFValue(lines, "map") ]
+			if index == 0:
+				maps += [ GPFValue(lines, "elecmap"), GPFValue(lines, "dsolvmap"), os.path.splitext(fld_name)[0]+".xyz" ]
+			for name in maps:
+				if name:
+					if os.path.exists(self.output_dir+os.sep+name):
+						os.remove(self.output_dir+os.sep+name)
+					os.rename(path+os.sep+name, self.output_dir+os.sep+name)
+			# fld: the map of the type of each run, then the e/d maps of the first one
+			fld = open(path+os.sep+fld_name).readlines()
+			current_labels = [ line for line in fld if line.startswith("label=") ]
+			current_variables = [ line for line in fld if line.startswith("variable ") ]
+			if index == 0:
+				first = fld
+				rest = current_labels[1:], current_variables[1:]
+			labels.append(current_labels[0])
+			variables.append(current_variables[0])
+			log.append(open(AutoGridCommand(gpf, self.autogrid)[1]).read())
+		labels += rest[0]
+		variables += rest[1]
+		text = []
+		for line in first:
+			if line.startswith("veclen="):
+				line = re.sub("^veclen=[0-9]+", "veclen=%d" % len(variables), line)
+			elif line.startswith("label="):
+				if line in rest[0]:
+					continue
+				line = "".join([ re.sub("variable [0-9]+", "variable %d" % (i+1), labels[i]) for i in range(len(labels)) ])
+			elif line.startswith("variable "):
+				if line in rest[1]:
+					continue
+				line = "".join([ re.sub("^variable [0-9]+", "variable %d" % (i+1), variables[i]) for i in range(len(variables)) ])
+			text.append(line)
+		WriteText(self.output_dir+os.sep+fld_name, "".join(text))
+		WriteText(AutoGridCommand(self.gpf, self.autogrid)[1], "".join(log))
+		self.clean()
+
+	def clean(self):
+		# remove the subdirectories of the split runs
+		for path, gpf in self.splitted:
+			shutil.rmtree(path, True)
+		self.splitted = []
+
+
+class MapScheduler:
+	"""Pool of AutoGrid processes calculating the maps of several receptors.
+
+		scheduler = MapScheduler(workers)
+		scheduler.add(AutoGridJob(...))
+		for runs in scheduler.run():
+			...
+
+	run() is a generator of the number of AutoGrid runs completed (None
+	while waiting, so that the interface can be updated). When there are
+	fewer receptors than workers the GPF of each receptor is split by atom
+	type. The jobs are merged as soon as all their runs are completed
+	(self.merged); stop() kills the running processes and removes the
+	split runs of the jobs not merged.
+	"""
+
+	def __init__(self, workers = 1, timeout = 0.1):
+		self.workers = max(1, workers)
+		self.timeout = timeout
+		self.jobs = []
+		self.merged = []
+		self.processes = []
+		self.stopped = False
+
+	def add(self, job):
+		if not job.done:
+			self.jobs.append(job)
+
+	def _worker(self, tasks, results):
+		while not self.stopped:
+			try:
+				job, path, gpf = tasks.get(False)
+			except Queue.Empty:
+				return
+			error = None
+			command, glg = AutoGridCommand(gpf, job.autogrid)
+			try:
+				process = subprocess.Popen(command, cwd = path)
+				self.processes.append(process)
+				process.wait()
+				self.processes.remove(process)
+				if not self.stopped:
+					CheckAutoGridLog(glg)
+			except OSError, e:
+				error = "Impossible to run AutoGrid (%s):\n%s" % (job.autogrid, e)
+			except RaccoonError, e:
+				error = str(e)
+			results.put((job, error))
+
+	def run(self):
+		tasks, results = Queue.Queue(), Queue.Queue()
+		split = len(self.jobs) < self.workers
+		pending = {}
+		for job in self.jobs:
+			runs = job.runs(split)
+			if not runs:
+				raise RaccoonError("Impossible to write the GPF of the maps in:\n%s" % job.output_dir)
+			pending[job] = len(runs)
+			for path, gpf in runs:
+				tasks.put((job, path, gpf))
+		total = tasks.qsize()
+		for i in range(min(self.workers, total)):
+			thread = threading.Thread(target = self._worker, args = (tasks, results))
+			thread.setDaemon(True)
+			thread.start()
+		for count in range(total):
+			while True:
+				try:
+					job, error = results.get(True, self.timeout)
+					break
+				except Queue.Empty:
+					yield None
+			if error:
+				self.stop()
+				raise RaccoonError(error)
+			pending[job] -= 1
+			if not pending[job]:
+				try:
+					job.merge()
+				except EnvironmentError, e:
+					self.stop()
+					raise RaccoonError("Impossible to merge the maps of the AutoGrid runs in:\n%s\n(%s)" % (job.output_dir, e))
+				self.merged.append(job)
+			yield count+1
+
+	def stop(self):
+		self.stopped = True
+		for process in self.processes[:]:
+			try:
+				process.terminate()
+			except (OSError, AttributeError): # Python < 2.6: the runs are completed
+				pass
+		for job in self.jobs:
+			job.clean()
+
+
+def CalcCacheMaps(output_dir, receptor, atom_types, gpf_text, parameter_file = "", autogrid = None, flexres_filename = None,
+		store = None, workers = 1):
+	# INFO   : calculate the maps of all the atom types in output_dir
+	# INPUT  : maps already in the MapStore are not calculated again,
+	#          with workers > 1 the atom types are calculated in parallel
+	# OUTPUT : True/False
+	job = AutoGridJob(output_dir, receptor, atom_types, gpf_text, parameter_file, autogrid, flexres_filename, store)
+	if job.done:
+		return True
+	if not job.gpf:
+		return False
+	scheduler = MapScheduler(workers)
+	scheduler.add(job)
+	for runs in scheduler.run():
+		pass
+	return True
+
+
+def MakeDir(path):
+	# create a directory (and its parents) if missing
+	if not os.path.exists(path):
+		try:
+			os.makedirs(path, 0755)
+		except OSError:
+			raise RaccoonError("Impossible to create the directory:\n%s\n GIVING UP..." % path)
+
+
+def CopyToJob(filename, dest_dir, what):
+	# copy a file in the job directory (if it's not there already)
+	if os.path.dirname(filename) == dest_dir:
+		return
+	try:
+		shutil.copy2(filename, dest_dir)
+	except (IOError, OSError):
+		raise RaccoonError("Impossible to copy the %s:\n%s\n\tto\n%s\n\nGIVING UP..." % (what, filename, dest_dir))
+
+
+JOBS_CHUNK = 50 # max number of jobs sent at once to a worker process
+
+
+def JobName(ligand_filename, receptor_stem):
+	# <ligand>_<receptor>
+	return os.path.basename(ligand_filename).rsplit('.', 1)[:-1][0]+"_"+receptor_stem
+
+
+def JobDir(ligand_filename, target):
+	# INFO   : name of the job directory <ligand>_<receptor> of a ligand
+	# INPUT  : target from VSGenerator.receptor(); its journal (the job directories
+	#          of the receptor, in ligand order) is updated
+	# OUTPUT : directory name
+	# EXTRA  : names are assigned before the jobs are generated (in any order),
+	#          so the journal doesn't depend on the generation order
+	job_dir = target['path']+os.sep+JobName(ligand_filename, target['name'])
+	count = target['homonyms'].get(job_dir, 0) + 1
+	target['homonyms'][job_dir] = count
+	if count > 1: # to manage homonimy (same ligand filename from different directories)
+		job_dir = job_dir+"_"+str(count)
+	target['journal'].append(job_dir)
+	return job_dir
+
+
+def MkJobDir(job_dir):
+	# INFO   : create a job directory
+	# OUTPUT : directory, False on errors
+	# EXTRA  : an existing directory (interrupted generation) is reused
+	try:
+		if not os.path.exists(job_dir):
+			os.makedirs(job_dir, 0755)
+		return job_dir
+	except:
+		return False
+
+
+def JobFiles(settings, target, ligand, ligand_dir):
+	# INFO   : files written by MakeJob() in a job directory
+	# OUTPUT : (ligand, gpf, dpf, script); gpf and script are None if not generated
+	ligand_file = os.path.join(ligand_dir, os.path.basename(ligand))
+	if settings['target'] == "vina":
+		script_file = None
+		if settings['scripts']:
+			script_file = ligand_dir+os.sep+VinaScriptName(settings['win_batch'])
+		return ligand_file, None, None, script_file
+	gpf_file = None
+	if settings['map_source'] == MAPS_IN_JOB:
+		gpf_file = ligand_dir+os.sep+target['name']+".gpf"
+	ligand_name = os.path.basename(ligand).rsplit('.', 1)[:-1][0]
+	dpf_file = ligand_dir+os.sep+ligand_name+"_"+target['name']+".dpf"
+	script_file = None
+	if not settings['target'] == "win" and settings['scripts']:
+		if settings['win_batch']:
+			script_file = ligand_dir+os.sep+"run.bat"
+		else:
+			script_file = ligand_dir+os.sep+"run.sh"
+	return ligand_file, gpf_file, dpf_file, script_file
+
+
+def VerifyJob(settings, target, ligand, ligand_dir):
+	# INFO   : check a job directory left by an interrupted generation
+	# OUTPUT : True if all the files written by MakeJob() are there
+	for filename in JobFiles(settings, target, ligand, ligand_dir):
+		if filename and not (os.path.isfile(filename) and os.path.getsize(filename)):
+			return False
+	return True
+
+
+PROGRESS_FILE = "raccoonVS.progress"
+
+
+def SettingsSignature(settings):
+	# INFO   : checksum of the settings that define the content of the jobs
+	#          (a generation is resumed only with the same settings)
+	import hashlib
+	items = [ (key, value) for key, value in settings.items() if not key == 'package' ]
+	items.sort()
+	return hashlib.md5(repr(items)).hexdigest()
+
+
+class ProgressJournal:
+	"""Jobs completed by a VS generation, used to resume it.
+
+	The file contains a header with the settings signature and then
+	one line per completed job ("receptor/job directory"), appended
+	as soon as the job is done. A line truncated by a crash is ignored.
+	The journal of a completed generation is removed (close()), so
+	resumed is True only if a previous generation was interrupted.
+	"""
+
+	def __init__(self, filename, signature):
+		self.filename = filename
+		self.completed = set()
+		self.resumed = os.path.exists(filename)
+		header = "# Raccoon VS progress %s" % signature
+		if not self.resumed:
+			self.file = open(filename, 'w')
+			self.file.write(header+"\n")
+			self.file.flush()
+			return
+		lines = open(filename, 'r').read().split("\n")
+		if not lines[0] == header:
+			raise RaccoonError("The directory:\n%s\ncontains a VS generated with different settings.\n\nUse an empty directory." % \
+					os.path.dirname(filename))
+		truncated = lines[-1]
+		self.completed.update(lines[1:-1])
+		self.completed.discard("")
+		self.file = open(filename, 'a')
+		if truncated:
+			self.file.write("\n")
+
+	def __contains__(self, entry):
+		return entry in self.completed
+
+	def __len__(self):
+		return len(self.completed)
+
+	def add(self, entries):
+		if not entries:
+			return
+		self.completed.update(entries)
+		self.file.write("\n".join(entries)+"\n")
+		self.file.flush()
+
+	def close(self, completed = False):
+		# completed: the generation is done, the journal is removed
+		self.file.close()
+		if completed and os.path.exists(self.filename):
+			os.remove(self.filename)
+
+
+def Executable(filename):
+	if not sys.platform == "win32":
+		os.chmod(filename, 0755)
+
+
+def MakeJobScript(ligand_dir, dpf_file, gpf_file, win_batch = False):
+	# INFO   : generate run.sh (or run.bat) in the ligand_dir
+	if win_batch:
+		script_file = ligand_dir+os.sep+"run.bat"
+		line = "REM Generated by AutoDock Raccoon"
+		if gpf_file:
+			gpf = os.path.basename(gpf_file)
+			glg = gpf[:-3]+"glg"
+			line += ("\necho Running AutoGrid...\nautogrid4.exe -p %s -l %s" % (gpf, glg) )
+		dpf = os.path.basename(dpf_file)
+		dlg = dpf[:-3]+"dlg"
+		line += ("\necho Running AutoDock...\nautodock4.exe -p %s -l %s\n" % (dpf, dlg) )
+	else:
+		script_file = ligand_dir+os.sep+"run.sh"
+		line = "#!/bin/bash\n# Generated by AutoDock Raccoon\n#\n#"
+		line += "\n# Specify here the paths for the binaries, if necessary"
+		if gpf_file:
+			line += "\n"+"# autogrid = ''"
+			line += "\n"+"# autodock = ''"
+		else:
+			line += "\n"+"# autodock = ''"
+		if gpf_file:
+			gpf = os.path.basename(gpf_file)
+			glg = gpf[:-3]+"glg"
+			line += ("\necho Running AutoGrid...\nautogrid4 -p %s -l %s" % (gpf, glg) )
+		dpf = os.path.basename(dpf_file)
+		dlg = dpf[:-3]+"dlg"
+		line += ("\necho Running AutoDock...\nautodock4 -p %s -l %s\n" % (dpf, dlg) )
+	script = open(script_file, 'w')
+	script.writelines(line)
+	script.close()
+	if not win_batch:
+		Executable(script_file)
+	return True
+
+
+def MakeMasterJobScript(path, journal, settings):
+	# INFO   : generate the script starting all the jobs of a receptor
+	#          (RunVS.sh/.bat) or the PBS submission script
+	header = """      ________________________________________________________________
+__________//___________________________/////___________________/____________
+_________/__/__________________________/____/__________________/____________
+________/____/___________/_____________/_____/_________________/____________
+________/____/__/_____/_/////___/////__/_____/__/////___/////__/___/________
+_______/______/_/_____/__/_____/_____/_/_____/_/_____/_/_____/_/_//_________
+_______////////_/_____/__/_____/_____/_/_____/_/_____/_/_______//_/_________
+_______/______/_/____//__/___/_/_____/_/____/__/_____/_/_____/_/___/________
+_______/______/__////_/___///___/////__/////____/////___/////__/____/_______
+      ________________________________________________________________
+                                 ______ 
+                                /      \\ 
+                               /        \\ 
+                              /          \\   Raccoon
+                              \\    /\\    /    Virtual 
+                               \\  /  \\  /      Screening 
+                                \\/ /\\ \\/        Generation      
+                                 /\\  \\ 
+                               /\\  \\__\\    version %s
+                              /  \\__\\ 
+                             /____\\ """ % settings['version']
+
+	if settings['target'] in ("lin", "vina"):
+		if settings['win_batch']:
+			line = "@echo off\nREM Generated by AutoDock Raccoon\necho.\n"
+			command = "call run.bat"
+			master_script_name = path+os.sep+"RunVS.bat"
+			spacer = ""
+			Q = ""
+		else:
+			line = "### Generated by AutoDock Raccoon\n"
+			command = "./run.sh"
+			master_script_name = path+os.sep+"RunVS.sh"
+			Q = "'"
+			spacer = "  "
+
+		for i in header.split("\n"): # acrobatic moves for making a unified generator...
+			line += "echo %s%s%s%s\n" % (Q, spacer, i, Q)
+
+		if settings['win_batch']:
+			line += "echo.\necho                  == Press ENTER to start the calculation ==\n"
+			line += "pause > NUL\n"
+		else:
+			line += "\necho -e \"\\n                 == Press ENTER to start the calculation ==\"\n"
+			line += "read X\n"
+
+		for DIR in journal:
+			dir = os.path.basename(DIR)
+			line += ("echo %sDocking %s%s\n"% (Q, dir, Q)  )
+			line += ("cd %s\n%s\ncd ..\n\n" % (dir, command))
+
+		line += "echo %sCalculation completed.%s\n" % (Q,Q)
+		if settings['win_batch']:
+			line += "pause > NUL\n"
+		else:
+			line += "read X\n"
+
+		try:
+			master_script = open(master_script_name, 'w')
+			master_script.writelines(line)
+			master_script.close()
+		except IOError:
+			raise RaccoonError("An error occurred when trying to generate the jobs list file.")
+		if not settings['win_batch']:
+			Executable(master_script_name)
+		return True
+
+	if settings['target'] == "pbs":
+		# create the list of job dirs in which to go
+		# for submitting the calculation
+		try:
+			file = open(path+os.sep+'jobs_list', 'w')
+			for DIR in journal:
+				print >> file, os.path.basename(DIR)+"\n" 
+			file.close()
+		except IOError:
+			raise RaccoonError("An error occurred when trying to generate the jobs list file.")
+		return CreateSmuggler(path, settings)
+
+
+def CreateSmuggler(path, settings):
+	# INFO   : generate the PBS submission script vs_submit.sh
+	filename = "vs_submit.sh"
+	end = settings['pbs_runs']
+	run_autogrid = settings['map_source'] == MAPS_IN_JOB
+	line = "#!/bin/bash\n"
+	line += "#\n# Generated with Raccoon | AutoDockVS\n#\n\n"
+
+	line += "#### PBS jobs parameters\n"
+	line += "CPUT=\"%s\"\n" % settings['pbs_time']
+	line += "WALLT=\"%s\"\n" % settings['pbs_time']
+	line += "#\n# There should be no reason\n"
+	line += "# for changing the following values\n"
+	line += "NODES=1\n"
+	line += "PPN=1\n"
+	line += "MEM=512mb\n\n\n"
+
+	line += "### CUSTOM VARIABLES\n"
+	line += "#\n"
+	line += "# use the following line to set special options (e.g. specific queues)\n"
+	line += "#OPT=\"-q MyPriorQueue\"\n"
+	line += "OPT=\"\"\n\n\n"
+
+	line += "# Paths for executables on the cluster \n"
+	line += "# Modify them to specify custom executables to be used\n"
+	line += "QSUB=\"qsub\"\n"
+	line += "AUTODOCK=\"autodock4\"\n\n"
+	# Set Autogrid if necessary"
+	if run_autogrid:
+		line += "AUTOGRID=\"autogrid4\"\n\n"
+
+	line += "# Special path to move into before running\n"
+	line += "# the screening. This is very system-specific,\n"
+	line += "# so unless you're know what are you doing,\n"
+	line += "# leave it as it is\n"
+	line += "WORKING_PATH=`pwd`\n\n"
+
+	line += "\n\n##################################################################################################\n"
+	line += "##################################################################################################\n"
+	line += "####### There should be no need to modify anything below this line ###############################\n"
+	line += "##################################################################################################\n"
+	line += "##################################################################################################\n\n\n"
+	line += "#\n#\n\n"
+
+	line += "type $AUTODOCK &> /dev/null || {\n"
+	line += "        echo -e \"\\nError: the file [$AUTODOCK] doesn't exist or is not executable\\n\";\n"
+	line += "        echo -e \"Try to specify the full path to the executable of the AutoDock binary in the script\";\n"
+	line += "        echo -e \"( i.e. AUTODOCK=/usr/bin/autodock4 )\\n\\n\";\n"
+	line += "        echo -e \" [ virtuals screening submission aborted]\\n\"\n"
+	line += "        exit 1; }\n\n"
+	line += ""
+
+	if run_autogrid:
+		line += "type $AUTOGRID &> /dev/null || {\n"
+		line += "        echo -e \"\\nError: the file [$AUTOGRID] doesn't exist or is not executable\\n\";\n"
+		line += "        echo -e \"Try to specify the full path to the executable of the AutoGrid binary in the script\";\n"
+		line += "        echo -e \"( i.e. AUTOGRID=/usr/bin/autogrid4 )\\n\\n\";\n"
+		line += "        echo -e \" [ virtuals screening submission aborted]\\n\"\n"
+		line += "        exit 1; }\n\n"
+
+	line += "type $QSUB &> /dev/null || {\n"
+	line += "        echo -e \"\\nError: the file [$QSUB] doesn't exist or is not executable\\n\";\n"
+	line += "        echo -e \"Try to specify the full path to the executable of the Qsub command binary in the script\";\n"
+	line += "        echo -e \"( i.e. QSUB=/usr/bin/qsub )\\n\\n\";\n"
+	line += "        echo -e \" [ virtuals screening submission aborted]\\n\"\n"
+	line += "        exit 1; }\n\n"
+
+	line += "echo Starting submission...\n"
+	line += "for NAME in `cat jobs_list`\n"
+	line += "    do\n"
+	line += "        cd $NAME\n"
+	# Set the extra loop for multiple DLG per ligand
+	# and specify the name convention: ligand_protein.#.job
+	if end > 1:
+		line += "        for i in `seq 1 %s`\n" % str(end)
+		line += "            do\n"
+		job_name = "$NAME.$i.job"
+		tab = "    "
+	else:
+		tab = ""
+		job_name = "$NAME.job"
+
+	line += "%s        echo \"#!/bin/bash\" > %s\n" % (tab, job_name)
+	line += "%s        echo \"cd $WORKING_PATH/$NAME\" >> %s \n" % (tab, job_name)
+	if run_autogrid:
+		line += "%s        echo \"$AUTOGRID -p *.gpf -l grid_out.glg\" >> %s\n" % (tab, job_name)
+	if end > 1:
+		line += "%s        echo \"$AUTODOCK -p $NAME.dpf -l $NAME.$i.dlg\" >> %s\n" % (tab, job_name)
+	else:
+		line += "%s        echo \"$AUTODOCK -p $NAME.dpf -l $NAME.dlg\" >> %s\n" % (tab, job_name)
+
+	line += "%s        chmod +x %s\n" % (tab, job_name)
+	line += "%s        echo -n \"Submitting $NAME : \"\n" % tab
+	line += "%s        $QSUB $OPT -l cput=$CPUT -l nodes=1:ppn=1 -l walltime=$WALLT -l mem=$MEM %s\n" % (tab, job_name) # remove the echo for making it active
+	if end > 1:
+		line += "        done\n"	
+	line += "        cd ..\n"
+	line += "done\n"
+	try:
+		output = open(path+os.sep+filename, 'w')
+		output.writelines(line)
+		output.close()
+	except IOError:
+		raise RaccoonError("An error occurred when trying to generate the %s file." % filename)
+	Executable(path+os.sep+filename)
+	return True
+
+
+VINA_CONFIG = "conf.txt" # Vina config of a receptor, in the receptor directory
+VINA_MAX_VOLUME = 27000. # A^3, larger search spaces need a higher exhaustiveness
+VINA_DEFAULT_SPACING = 0.375 # AutoGrid default
+
+
+def VinaBox(gpf_text):
+	# INFO   : Vina search space of the grid defined in the GPF template
+	# OUTPUT : ((center x, y, z), (size x, y, z)) in Angstrom
+	# EXTRA  : the size is npts * spacing (the extent of the AutoGrid grid)
+	values = {}
+	for keyword, argument in TemplateKeywords(gpf_text):
+		values[keyword] = argument.split()
+	if values.get('gridcenter', [""])[0] == "auto":
+		raise RaccoonError("The grid center of the GPF is 'auto': Vina needs the coordinates of the center of the search space.")
+	try:
+		npts = [ int(value) for value in values['npts'][:3] ]
+		spacing = float(values.get('spacing', [ VINA_DEFAULT_SPACING ])[0])
+		center = tuple([ float(value) for value in values['gridcenter'][:3] ])
+	except (KeyError, ValueError):
+		raise RaccoonError("The GPF must define npts, spacing and gridcenter to set the Vina search space.")
+	if not len(npts) == 3 or not len(center) == 3:
+		raise RaccoonError("The GPF must define npts, spacing and gridcenter to set the Vina search space.")
+	size = tuple([ points * spacing for points in npts ])
+	if min(size) <= 0:
+		raise RaccoonError("The Vina search space must have a positive size (npts %s, spacing %s)." % \
+				(" ".join(values['npts'][:3]), spacing))
+	return center, size
+
+
+def CheckVina(settings, box, receptor):
+	# INFO   : check the Vina settings and the search space of a receptor
+	# INPUT  : VSSettings(), VinaBox(), receptor filename
+	# OUTPUT : list of warnings (RaccoonError if Vina can't run)
+	for key, name in ( ('vina_modes', "num_modes"), ('vina_exhaustiveness', "exhaustiveness"), ('vina_cpu', "cpu") ):
+		if settings[key] < 1:
+			raise RaccoonError("The Vina %s must be at least 1 (%s)." % (name, settings[key]))
+	center, size = box
+	warnings = []
+	volume = size[0] * size[1] * size[2]
+	if volume > VINA_MAX_VOLUME:
+		warnings.append("the search space is %.0f A^3 (more than %.0f A^3): increase the exhaustiveness" % (volume, VINA_MAX_VOLUME))
+	lines = [ line for line in open(receptor, 'r') if line[0:6] == 'HETATM' or line[0:4] == 'ATOM' ]
+	if lines:
+		coords = AtomCoords(lines)
+		low = numpy.array(center) - numpy.array(size) / 2
+		inside = numpy.logical_and(coords >= low, coords <= low + numpy.array(size)).all(axis = 1).sum()
+		if not inside:
+			warnings.append("no atoms of %s are in the search space" % os.path.basename(receptor))
+	return warnings
+
+
+def VinaConfig(settings, box, receptor, flexres = None):
+	# INFO   : text of the Vina config of a receptor
+	# INPUT  : receptor and flexres file names as seen from the directory where Vina runs
+	center, size = box
+	lines = [ "receptor = %s" % receptor ]
+	if flexres:
+		lines.append("flex = %s" % flexres)
+	lines.append("")
+	for axis in range(3):
+		lines.append("center_%s = %.3f" % ("xyz"[axis], center[axis]))
+	lines.append("")
+	for axis in range(3):
+		lines.append("size_%s = %.3f" % ("xyz"[axis], size[axis]))
+	lines.append("")
+	lines.append("num_modes = %d" % settings['vina_modes'])
+	lines.append("exhaustiveness = %d" % settings['vina_exhaustiveness'])
+	lines.append("cpu = %d" % settings['vina_cpu'])
+	return "\n".join(lines)+"\n"
+
+
+def VinaScriptName(win_batch = False):
+	if win_batch:
+		return "run.bat"
+	return "run.sh"
+
+
+def MakeVinaJobScript(ligand_dir, ligand_file, win_batch = False):
+	# INFO   : generate run.sh (or run.bat) in the ligand_dir; Vina runs in the
+	#          receptor directory (VINA_CONFIG) and writes out.pdbqt and log.txt here
+	job = os.path.basename(ligand_dir)
+	ligand = os.path.basename(ligand_file)
+	if win_batch:
+		line = "REM Generated by AutoDock Raccoon"
+		line += "\ncd .."
+		line += "\necho Running Vina..."
+		line += "\nvina.exe --config %s --ligand %s\\%s --out %s\\out.pdbqt --log %s\\log.txt" % (VINA_CONFIG, job, ligand, job, job)
+		line += "\ncd %s\n" % job
+	else:
+		line = "#!/bin/bash\n# Generated by AutoDock Raccoon\n#\n#"
+		line += "\n# Specify here the path for the binary, if necessary"
+		line += "\nVINA=${VINA:-vina}"
+		line += "\ncd \"$(dirname \"$0\")/..\""
+		line += "\necho Running Vina..."
+		line += "\n$VINA --config %s --ligand %s/%s --out %s/out.pdbqt --log %s/log.txt\n" % (VINA_CONFIG, job, ligand, job, job)
+	script_file = ligand_dir+os.sep+VinaScriptName(win_batch)
+	script = open(script_file, 'w')
+	script.writelines(line)
+	script.close()
+	if not win_batch:
+		Executable(script_file)
+	return True
+
+
+class _ShardWriter:
+	"""Thread writing one file of a VS package (see PackageBuilder):
+	the files put() are added in the order they arrive."""
+
+	def __init__(self, filename, mode):
+		self.filename = filename
+		self.mode = mode # tarfile mode, None for zip
+		self.queue = Queue.Queue()
+		self.entries = {} # arcname : (size, mtime)
+		self.error = None
+		self.thread = threading.Thread(target = self._run)
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def put(self, path, arcname, stat):
+		self.entries[arcname] = stat
+		self.queue.put((path, arcname))
+
+	def close(self):
+		# OUTPUT : filename (RaccoonError if the writing failed)
+		self.queue.put(None)
+		self.thread.join()
+		if self.error:
+			raise RaccoonError("Unable to write the VS package %s (%s)" % (self.filename, self.error))
+		os.rename(self.filename+".tmp", self.filename)
+		return self.filename
+
+	def abort(self):
+		self.queue.put(None)
+		self.thread.join()
+		if os.path.exists(self.filename+".tmp"):
+			os.remove(self.filename+".tmp")
+
+	def _run(self):
+		import tarfile, zipfile
+		archive = None
+		try:
+			closing = False
+			try:
+				if self.mode:
+					archive = tarfile.open(self.filename+".tmp", self.mode)
+				else:
+					archive = zipfile.ZipFile(self.filename+".tmp", 'w', zipfile.ZIP_DEFLATED, True)
+				while True:
+					item = self.queue.get()
+					if item is None:
+						closing = True
+						break
+					path, arcname = item
+					if self.mode:
+						archive.add(path, arcname, False) # links are kept (and hard links found)
+					elif os.path.islink(path):
+						info = zipfile.ZipInfo(arcname)
+						info.create_system = 3 # unix
+						info.external_attr = 0120777 << 16 # symbolic link
+						archive.writestr(info, os.readlink(path))
+					elif not os.path.isdir(path):
+						archive.write(path, arcname)
+			finally:
+				if archive:
+					archive.close()
+		except Exception, e:
+			self.error = e
+			while not closing and self.queue.get() is not None: # the files put later are ignored
+				pass
+
+
+class PackageBuilder:
+	"""VS package, written while the jobs are generated.
+
+		builder = PackageBuilder(source_dir, filename, format, shards)
+		builder.add(job_dir)	# (optional) as soon as a job is completed
+		files = builder.finish()
+
+	The package is split in 'shards' archives (the job directories are
+	assigned by their name), each one written and compressed by its own
+	thread. Symbolic links (and, in tar files, hard links) are packed as
+	links, so the maps linked in the jobs are stored once. A manifest of
+	the packed files is saved with the package: building it again only
+	rewrites the shards with new or modified files.
+	"""
+
+	def __init__(self, source_dir, filename, format, shards = 1, message = None):
+		self.mode, ext = PACKAGE_FORMATS[format]
+		self.source_dir = os.path.abspath(source_dir)
+		self.prefix = os.path.basename(self.source_dir)
+		self.name = os.path.basename(filename)
+		self.message = message or (lambda text: None)
+		self.shards = max(1, shards)
+		if self.shards == 1:
+			self.files = [ filename+ext ]
+		else:
+			self.files = [ "%s.%dof%d%s" % (filename, i+1, self.shards, ext) for i in range(self.shards) ]
+		self.manifest = filename+".manifest"
+		self.previous = self._load() # previous package: [ { arcname : (size, mtime) } for each shard ]
+		self.writers = [ None ] * self.shards
+		self.rewritten = 0
+
+	def _load(self):
+		for filename in self.files:
+			if not os.path.exists(filename):
+				return None
+		try:
+			lines = open(self.manifest).read().splitlines()
+		except IOError:
+			return None
+		if not lines or not lines[0] == "# Raccoon VS package %d %s" % (self.shards, self.mode):
+			return None
+		previous = [ {} for i in range(self.shards) ]
+		try:
+			for line in lines[1:]:
+				shard, size, mtime, arcname = line.split("\t", 3)
+				previous[int(shard)][arcname] = (int(size), float(mtime))
+		except ValueError:
+			return None
+		return previous
+
+	def _save(self, shards):
+		lines = [ "# Raccoon VS package %d %s" % (self.shards, self.mode) ]
+		for index in range(self.shards):
+			for arcname in sorted(shards[index].keys()):
+				size, mtime = shards[index][arcname]
+				lines.append("%d\t%d\t%r\t%s" % (index, size, mtime, arcname))
+		WriteText(self.manifest, "\n".join(lines)+"\n")
+
+	def _shard(self, arcname):
+		# job directories (prefix/receptor/job) are never split between shards
+		import zlib
+		return (zlib.crc32("/".join(arcname.split("/")[:3])) & 0xffffffff) % self.shards
+
+	def _packed(self, path):
+		# the package files in the VS directory are not packed
+		return os.path.dirname(path) == self.source_dir and os.path.basename(path).startswith(self.name)
+
+	def _walk(self, path):
+		# OUTPUT : { arcname : (path, (size, mtime)) } of the files and directories in path
+		entries = {}
+		def stat(path):
+			# (the mtime of the directories changes with the package files)
+			info = os.lstat(path)
+			if os.path.isdir(path) and not os.path.islink(path):
+				return 0, 0.
+			return info.st_size, info.st_mtime
+		arcname = lambda path: self.prefix+path[len(self.source_dir):].replace(os.sep, "/")
+		entries[arcname(path)] = (path, stat(path))
+		for root, dirs, files in os.walk(path):
+			for name in dirs + files:
+				item = os.path.join(root, name)
+				if not self._packed(item):
+					entries[arcname(item)] = (item, stat(item))
+		return entries
+
+	def _writer(self, index):
+		if self.writers[index] is None:
+			self.writers[index] = _ShardWriter(self.files[index], self.mode)
+		return self.writers[index]
+
+	def add(self, path):
+		# INFO   : stream a completed directory (or file) of the VS in the package
+		# EXTRA  : ignored when the package is updated (see finish())
+		if self.previous:
+			return
+		entries = self._walk(os.path.abspath(path))
+		for arcname in sorted(entries.keys()): # directories before their files
+			path, stat = entries[arcname]
+			self._writer(self._shard(arcname)).put(path, arcname, stat)
+
+	def finish(self):
+		# INFO   : pack the files not streamed yet and close the package
+		# OUTPUT : list of the package files
+		self.message('Writing the VS package...(this could take a while)')
+		entries = self._walk(self.source_dir)
+		shards = [ {} for i in range(self.shards) ]
+		for arcname in entries:
+			shards[self._shard(arcname)][arcname] = entries[arcname][1]
+		try:
+			for index in range(self.shards):
+				writer = self.writers[index]
+				if writer is None and self.previous and self.previous[index] == shards[index]:
+					continue # unchanged
+				streamed = writer and writer.entries or {}
+				for arcname in streamed:
+					if not shards[index].get(arcname) == streamed[arcname]:
+						# modified (or deleted) after being streamed
+						writer.abort()
+						writer = self.writers[index] = None
+						break
+				writer = self._writer(index)
+				for arcname in sorted(shards[index].keys()):
+					if not writer.entries.has_key(arcname):
+						writer.put(entries[arcname][0], arcname, shards[index][arcname])
+				self.rewritten += 1
+			for index in range(self.shards):
+				if self.writers[index]:
+					self.writers[index].close()
+					self.writers[index] = None
+		except:
+			for writer in self.writers:
+				if writer:
+					writer.abort()
+			self.writers = [ None ] * self.shards
+			raise
+		self._save(shards)
+		return self.files
+
+	def abort(self):
+		# INFO   : stop writing the package (the files are not completed)
+		for index in range(self.shards):
+			if self.writers[index]:
+				self.writers[index].abort()
+				self.writers[index] = None
+
+
+def MakePackage(source_dir, filename, format, message = None, shards = 1):
+	# INFO   : pack the VS directory in a tar or zip file (see PackageBuilder)
+	# INPUT  : format : one of PACKAGE_FORMATS; message : progress callback;
+	#          number of package files (compressed in parallel)
+	# OUTPUT : list of the package files (the extension is added)
+	return PackageBuilder(source_dir, filename, format, shards, message).finish()
+
+
+def VSLogHeader(settings, info):
+	# INFO   : header of the Raccoon log
+	# INPUT  : info : dictionary with date, outdir, os, machine, filters ({ property : (min, max) }),
+	#          reject (non-AD atom types), receptors (list), single (single receptor mode), ligands
+	# OUTPUT : text
+	# EXTRA  : LoadLog() reads the filters from fixed lines and the
+	#          other settings from the tagged lines (TARGET>, GPF>, ...)
+	filters = info['filters']
+	receptors = info['receptors']
+	ligands = info['ligands']
+	header = """
+ 	      ________________________________________________________________
+	
+	__________//___________________________/////___________________/____________
+	_________/__/__________________________/____/__________________/____________
+	________/____/___________/_____________/_____/_________________/____________
+	________/____/__/_____/_/////___/////__/_____/__/////___/////__/___/________
+	_______/______/_/_____/__/_____/_____/_/_____/_/_____/_/_____/_/_//_________
+	_______////////_/_____/__/_____/_____/_/_____/_/_____/_/_______//_/_________
+	_______/______/_/____//__/___/_/_____/_/____/__/_____/_/_____/_/___/________
+	_______/______/__////_/___///___/////__/////____/////___/////__/____/_______
+	
+	      ________________________________________________________________
+	                                 ______ 
+	                                /      \\ 
+	                               /        \\ 
+	                              /          \\   Raccoon
+	                              \\    /\\    /    Virtual 
+	                               \\  /  \\  /      Screening 
+	                                \\/ /\\ \\/        Generation      
+	                                 /\\  \\ 
+	                               /\\  \\__\\    version %s
+	                              /  \\__\\ 
+	                             /____\\
+		
+		
+                  date :\t%s
+      output directory :\t%s
+    total docking jobs :\t%s
+      operative system :\t%s [ %s ]
+   generating jobs for :\t%s
+
+
+      ===================================== Ligand filters =========================================
+	
+                       Filtering criteria
+                       ------------------
+                                   MIN      MAX
+                    Hb donors :   %4s  -  %4s
+                 Hb acceptors :   %4s  -  %4s
+             Molecular weight :   %4s  -  %4s
+        Total number of atoms :   %4s  -  %4s
+              Rotatable bonds :   %4s  -  %4s
+		Reject non-AD atypes  :   %s
+	
+	
+		Ligands accepted for the virtual-screening: %s
+
+
+""" % ( settings['version'], info['date'], info['outdir'], str(len(ligands) * len(receptors)),
+		info['os'], info['machine'], TARGETS[settings['target']],
+		str(filters["HbD"][0]), str(filters["HbD"][1]), str(filters["HbA"][0]), str(filters["HbA"][1]),
+		str(filters["MW"][0]), str(filters["MW"][1]), str(filters["Nat"][0]), str(filters["Nat"][1]),
+		str(filters["TORSDOF"][0]), str(filters["TORSDOF"][1]), str(info['reject']), str(len(ligands)))
+
+	# receptor
+	if info['single']:
+		receptor_log = "\n      ============================= Single target receptor ==========================================\n"
+		receptor_log = receptor_log+"\n   Target structure:\nTARGET>\t"+ receptors[0]
+	else:
+		receptor_log = "\n      =========================== Multiple target receptors =========================================\n"
+		receptor_log = receptor_log+"\n   Total target structures :" + str(len(receptors))+"\n"
+		# append the list of receptor structures
+		for rec in receptors:
+			receptor_log = receptor_log+"\nTARGET>\t"+rec
+	header = header + receptor_log
+
+	# flexible residues
+	if settings['flexres_file'] or settings['flex_residues']:
+		flex_log = "\n\n      ------------------------------- Flexible residues -----------------------------------\n\n"
+		if settings['flexres_file']:
+			flex_log = flex_log + "FLEX> Flexible residues from the file :\t"+settings['flexres_file']
+		else:
+			flex_log = flex_log + "FLEX> Flexible residues generated from the selection : "+ settings['flex_residues']
+		header = header + flex_log + "\n"
+
+	# Maps
+	maps_log = "\n\n      ===================================== Maps ====================================================\n"
+	if settings['target'] == "vina":
+		maps_log = maps_log + "\n   Grid mode : Vina search space from the grid (size = npts * spacing).\n"
+		maps_log = maps_log + "   Grid param file template :\n\n"
+		for line in settings['gpf_text'].split('\n'):
+			if line.strip():
+				maps_log = maps_log+"\nGPF>\t"+line
+		docking_log = "\n\n     ==================================  Docking parameters ========================================\n"
+		docking_log = docking_log+"\n   Docking mode : >AutoDock Vina< with a config file (%s) in each receptor directory.\n" % VINA_CONFIG
+		docking_log = docking_log+"   Vina config :\n\n"
+		for line in VinaConfig(settings, VinaBox(settings['gpf_text']), "<receptor>").split('\n')[1:]:
+			if line.strip():
+				docking_log = docking_log+"\nVINA>\t"+line
+		header = header + maps_log + docking_log
+	else:
+		if settings['symlink']:
+			cache_policy = " >linked< "
+		else:
+			cache_policy = " >copied< "
+		if settings['map_source'] <= MAPS_NOW:
+			if settings['map_source'] == MAPS_IN_JOB:
+				maps_log = maps_log + "\n   Grid mode : calculated in each job.\n"
+				maps_log = maps_log + "   Grid param file template :\n\n"
+			if settings['map_source'] == MAPS_NOW:
+				maps_log = maps_log + "\n   Grid mode : calculated now and"+cache_policy+"in each ligand job directory.\n"
+				maps_log = maps_log + "   Grid param file template :\n\n"
+				maps_log = maps_log+("\t [ AutoGrid binary file used : |%s| ]" % settings['autogrid'])
+			# add the gpf lines to the log
+			for line in settings['gpf_text'].split('\n'):
+				if line.strip(): # get rid of empty lines
+					maps_log = maps_log+"\nGPF>\t"+line
+			if settings['gpf_parameter_file']:
+				maps_log = maps_log+(" [ the parameter file |%s| has been copied ]\n\n" % settings['gpf_parameter_file'])
+		if settings['map_source'] == MAPS_CACHED:
+			maps_log = maps_log + "\n   Grid mode : use pre-calculated"+cache_policy+"in each ligand job directory.\n"
+			maps_log = maps_log + "   Grid cache dir : "+settings['map_dir']
+		header = header + maps_log
+
+		docking_log = "\n\n     ==================================  Docking parameters ========================================\n"
+		docking_log = docking_log+"\n   Docking mode : docking parameters will be >generated from template< for each ligand.\n"
+		docking_log = docking_log+"   Docking param file template :\n\n"
+		for line in settings['dpf_text'].split('\n'):
+			if line.strip(): # get rid of empty lines
+				docking_log = docking_log+"\nDPF>\t"+line
+		if settings['dpf_parameter_file']:
+			docking_log = docking_log+("\n\n[ the parameter file %s has been copied ]" % settings['dpf_parameter_file'])
+		header = header + docking_log
+
+	ligands_log = "\n\n     ======================================  Ligands list ============================================\n\n"
+	for ligand in ligands:
+		ligands_log += "\nLIGAND> "+ligand
+	return header + ligands_log
+
+
+def WriteText(filename, text):
+	output = open(filename, 'w')
+	try:
+		output.write(text)
+	finally:
+		output.close()
+
+
+def MakeJob(settings, target, ligand, ligand_dir, timer, values = None, links = None):
+	# INFO   : generate the job directory of a ligand
+	# INPUT  : settings from VSSettings(), target from VSGenerator.receptor(),
+	#          job directory from JobDir(), StageTimer,
+	#          { 'gpf' : GPFValues(), 'dpf' : DPFValues() } of the ligand
+	# OUTPUT : job directory
+	# EXTRA  : GPF and DPF are rendered from target['gpf'] and target['dpf']
+	#          (GPFTemplate, DPFTemplate) when possible, otherwise with ADT;
+	#          a Vina job has only the ligand (and its script)
+	s = settings
+	if not values:
+		values = {}
+	ligand_file, gpf_file, dpf_file, script_file = JobFiles(settings, target, ligand, ligand_dir)
+	timer.start("directories")
+	if not MkJobDir(ligand_dir):
+		raise RaccoonError("Impossible to create the directory:\n%s\n GIVING UP..." % ligand_dir)
+
+	# copy the ligand in place (ligands from a library are written here)
+	timer.start("copy")
+	try:
+		ligand_file = MaterializeLigand(ligand, ligand_dir)
+	except (IOError, OSError):
+		raise RaccoonError("Impossible to copy the ligand:\n%s\n\tto\n%s\n\nGIVING UP..." % (ligand, ligand_dir))
+	if s['target'] == "vina": # receptor and config are in the receptor directory
+		if script_file:
+			timer.start("scripts")
+			MakeVinaJobScript(ligand_dir, ligand_file, s['win_batch'])
+		timer.stop()
+		return ligand_dir
+	if target['flexres']:
+		CopyToJob(target['flexres'], ligand_dir, "flex res file")
+
+	# maps management
+	if s['map_source'] == MAPS_IN_JOB:
+		# a. generate GPF
+		timer.start("gpf")
+		text = None
+		if target['gpf']:
+			text = target['gpf'].render(ligand_file, values.get('gpf'))
+		try:
+			if text:
+				WriteText(gpf_file, text)
+			else:
+				timer.start("gpf (MolKit)")
+				PrepareGPF(gpf_file, target['receptor'], s['gpf_text'], s['gpf_parameter_file'],
+						ligand_filename = ligand_file, flexres_filename = target['flexres'],
+						parameters = target['gpf_parameters'])
+		except:
+			raise RaccoonError("Impossible to create the gpf file:\n%s\n GIVING UP..." % gpf_file)
+		if not os.path.exists(gpf_file):
+			raise RaccoonError("Impossible to create the gpf file:\n%s\n GIVING UP..." % gpf_file)
+		timer.start("copy")
+		if s['gpf_parameter_file']:
+			CopyToJob(s['gpf_parameter_file'], ligand_dir, "parameter file required by the GPF")
+		CopyToJob(target['receptor'], ligand_dir, "receptor")
+	else:
+		# b. use cached maps (including the flex res atoms)
+		timer.start("maps")
+		if values.get('dpf'):
+			current_atom_types = list(values['dpf']['ligand_types']) # flex res included
+		else:
+			current_atom_types = GetAtypes(ligand_file)
+			for atom in target['flex_types']:
+				if atom not in current_atom_types: current_atom_types.append(atom)
+		CopyMapDir(current_atom_types, target['maps'], ligand_dir, symlink = s['symlink'], stats = links)
+
+	# Prepare the DPF
+	timer.start("dpf")
+	text = None
+	if target['dpf']:
+		text = target['dpf'].render(ligand_file, values.get('dpf'))
+	try:
+		if text:
+			WriteText(dpf_file, text)
+		else:
+			timer.start("dpf (MolKit)")
+			PrepareDPF(dpf_file, target['receptor'], ligand_file, s['dpf_text'], target['flexres'])
+	except:
+		raise RaccoonError("Impossible to create the DPF file:\n%s\n GIVING UP..." % dpf_file)
+	if not os.path.exists(dpf_file):
+		raise RaccoonError("Impossible to create the DPF file:\n%s\n GIVING UP..." % dpf_file)
+	timer.start("copy")
+	if s['dpf_parameter_file']:
+		CopyToJob(s['dpf_parameter_file'], ligand_dir, "parameter file required by the DPF")
+
+	if script_file:
+		timer.start("scripts")
+		MakeJobScript(ligand_dir, dpf_file, gpf_file, s['win_batch'])
+	timer.stop()
+	return ligand_dir
+
+
+def _JobChunk(job):
+	# worker side of VSGenerator.jobs() (must be a module-level function
+	# to be pickled): the errors are sent back to the main process
+	settings, target, jobs = job
+	timer = StageTimer()
+	links = TransferStats()
+	done = []
+	try:
+		for ligand, ligand_dir, values in jobs:
+			MakeJob(settings, target, ligand, ligand_dir, timer, values, links)
+			done.append(ligand_dir)
+	except RaccoonError, e:
+		timer.stop()
+		return done, timer, links, str(e)
+	except Exception, e:
+		timer.stop()
+		return done, timer, links, "Error while generating the job of the ligand:\n%s\n\n%s" % (ligand, e)
+	return done, timer, links, None
+
+
+class VSGenerator:
+	"""Generate the docking jobs of a virtual screening, one receptor at a time.
+
+		vs = VSGenerator(settings, atom_types)
+		for runs in vs.maps(receptors, path):
+			...
+		for receptor in receptors:
+			target = vs.receptor(receptor, path)
+			for done in vs.jobs(target, ligands):
+				...
+			vs.close(target)
+		vs.package(path)
+
+	The jobs of a receptor are split in chunks generated by a pool of
+	worker processes (job() generates a single job in this process).
+	The completed jobs are recorded in a ProgressJournal in the VS
+	directory: generating again in the same directory (with the same
+	settings) resumes an interrupted generation (the jobs and receptors
+	whose files were deleted meanwhile are generated again).
+	The maps calculated now (maps(), optional) are done by a MapScheduler
+	for all the receptors at once, and taken from (and added to) a MapStore;
+	the maps put in the job directories are counted in self.links.
+	The completed jobs are streamed in the VS package (PackageBuilder).
+	With the 'vina' target there are no maps nor DPF: receptor() writes
+	the Vina config of the receptor (the search space is the grid of the
+	GPF template) and the jobs contain the ligands; the problems found
+	in the search spaces are collected in self.warnings.
+	Errors are raised as RaccoonError; the time spent in each stage
+	is collected in self.timer.
+	"""
+
+	def __init__(self, settings, atom_types, message = None, workers = 1, timeout = 0.1, table = None,
+			receptors = None, store = None):
+		# atom_types : atom types of the accepted ligands
+		# message    : callback for the progress messages
+		# workers    : number of worker processes for the jobs
+		# table      : LigandTable of the ligands (the DPF are written from the
+		#              registered properties, without MolKit)
+		# receptors  : ReceptorCache (default: the one in ~/.raccoon)
+		# store      : MapStore (default: the one in ~/.raccoon)
+		if receptors is None:
+			receptors = ReceptorCache()
+		if store is None:
+			store = MapStore()
+		self.settings = settings
+		self.table = table
+		self.receptors = receptors
+		self.store = store
+		self.links = TransferStats()
+		self.signature = SettingsSignature(settings)
+		self.gpf_parameters = GPFParameters(settings['gpf_text'], settings['gpf_parameter_file']) # parsed once
+		self.atom_types = list(atom_types)
+		self.message = message
+		self.workers = max(1, workers)
+		self.timeout = timeout
+		self.timer = StageTimer()
+		self.done = 0
+		self.skipped = 0 # jobs found completed (resumed generation)
+		self.pool = None
+		self.scheduler = None
+		self.builder = None # PackageBuilder of the VS package
+		self.targets = {} # (receptor, path) : (target, atom types) prepared by maps()
+		self.progress = None
+		self.box = None # Vina search space
+		self.warnings = []
+		if settings['target'] == "vina":
+			self.box = VinaBox(settings['gpf_text'])
+
+	def notify(self, text):
+		if self.message:
+			self.message(text)
+
+	def receptor(self, receptor, path):
+		# INFO   : create the receptor directory, the flexible residues and the cached maps
+		# OUTPUT : target dictionary for job() and close()
+		s = self.settings
+		if self.targets.has_key((receptor, path)): # see maps()
+			target, atom_types = self.targets.pop((receptor, path))
+		else:
+			target, atom_types = self._target(receptor, path)
+		self.timer.start("receptor")
+		if self.completed(target):
+			self.timer.stop()
+			return target
+		if s['target'] == "vina":
+			self.vina(target)
+		elif s['map_source'] == MAPS_NOW: # populate the dir with AutoGrid
+			self.notify("[ Running AutoGrid on %s... ]" % target['name'])
+			self.timer.start("autogrid")
+			if not CalcCacheMaps(target['maps'], target['receptor'], atom_types, s['gpf_text'],
+					s['gpf_parameter_file'], s['autogrid'], target['flexres'], self.store, self.workers):
+				raise RaccoonError("Impossible to calculate the cached maps here:\n%s\n GIVING UP..." % target['maps'])
+		elif s['map_source'] == MAPS_CACHED: # populate the dir by copying the files from the cache
+			self.notify("[ Copying cached maps for %s... ]" % target['name'])
+			self.timer.start("maps")
+			# no matter if maps will be eventually copied or linked, now it must be a copy
+			if not CopyMapDir(atom_types, None, target['maps'], s['map_files'], stats = self.links):
+				raise RaccoonError("Impossible to copy the maps in the VS job master directory \n%s\n GIVING UP..." % target['maps'])
+		self.progress.add([ self.entry(target) ])
+		self.timer.stop()
+		return target
+
+	def vina(self, target):
+		# INFO   : copy the receptor (and the flexible residues) in the receptor
+		#          directory and write its Vina config
+		s = self.settings
+		self.timer.start("vina")
+		for warning in CheckVina(s, self.box, target['receptor']):
+			self.notify("[ WARNING: %s ]" % warning)
+			self.warnings.append("%s : %s" % (target['name'], warning))
+		CopyToJob(target['receptor'], target['path'], "receptor")
+		flexres = None
+		if target['flexres']:
+			CopyToJob(target['flexres'], target['path'], "flex res file")
+			flexres = os.path.basename(target['flexres'])
+		try:
+			WriteText(target['path']+os.sep+VINA_CONFIG, VinaConfig(s, self.box, os.path.basename(target['receptor']), flexres))
+		except IOError:
+			raise RaccoonError("Impossible to write the Vina config in:\n%s\n GIVING UP..." % target['path'])
+
+	def _target(self, receptor, path):
+		# INFO   : create the receptor directory and the flexible residues
+		# OUTPUT : target dictionary, atom types of the maps
+		s = self.settings
+		rec_name = os.path.basename(receptor).rsplit('.', 1)[:-1][0]
+		target = {	'name'		: rec_name,
+				'path'		: path+os.sep+rec_name,
+				'receptor'	: receptor,
+				'flexres'	: None,
+				'flex_types'	: [],
+				'maps'		: None,
+				'gpf'		: None,
+				'dpf'		: None,
+				'gpf_parameters': self.gpf_parameters,
+				'info'		: None,
+				'journal'	: [],
+				'homonyms'	: {} }
+		if s['target'] == "vina":
+			target['gpf'], target['dpf'] = False, False # only the ligands in the jobs
+		elif not s['map_source'] == MAPS_IN_JOB:
+			target['gpf'] = False # no GPF in the jobs
+		self.timer.start("receptor")
+		MakeDir(target['path'])
+		if not self.progress:
+			self.progress = ProgressJournal(path+os.sep+PROGRESS_FILE, self.signature)
+		if s['package'] and not self.builder:
+			self.builder = PackageBuilder(path, path+os.sep+"VSpack_"+os.path.basename(path), s['package'],
+					self.workers, self.message)
+		atom_types = list(self.atom_types)
+
+		## 1. define or generate flexible residue files
+		if s['flexres_file']:
+			target['flexres'] = s['flexres_file']
+		elif s['flex_residues']:
+			self.notify("[ Generating flex residues for %s... ]" % rec_name)
+			self.timer.start("flexres")
+			target['receptor'], target['flexres'] = self.receptors.flex(receptor, s['flex_residues'])
+		if target['flexres']:
+			target['flex_types'] = GetAtypes(target['flexres'])
+			for atom in target['flex_types']:
+				if atom not in atom_types: atom_types.append(atom)
+		target['info'] = self.receptors.info(target['receptor'])
+		for kind in ('gpf', 'dpf'):
+			if target[kind] is None:
+				target[kind] = self.receptors.template(kind, target['receptor'], target['flexres'], self.signature)
+
+		## 2. directory of the maps calculated or copied now
+		if s['map_source'] >= MAPS_NOW and not s['target'] == "vina":
+			target['maps'] = target['path']+os.sep+"maps"
+			MakeDir(target['maps'])
+		self.timer.stop()
+		return target, atom_types
+
+	def maps(self, receptors, path):
+		# INFO   : calculate the maps of all the receptors at once (MAPS_NOW),
+		#          with a MapScheduler of self.workers AutoGrid processes
+		# OUTPUT : generator of the number of AutoGrid runs completed (None while waiting)
+		# EXTRA  : receptor() finds the maps done
+		s = self.settings
+		if not s['map_source'] == MAPS_NOW or s['target'] == "vina":
+			return
+		self.scheduler = MapScheduler(self.workers, self.timeout)
+		for receptor in receptors:
+			target, atom_types = self._target(receptor, path)
+			self.targets[(receptor, path)] = target, atom_types
+			if self.completed(target):
+				continue
+			self.scheduler.add(AutoGridJob(target['maps'], target['receptor'], atom_types, s['gpf_text'],
+					s['gpf_parameter_file'], s['autogrid'], target['flexres'], self.store, self.entry(target)))
+		self.notify("[ Running AutoGrid on %d receptors... ]" % len(self.scheduler.jobs))
+		self.timer.start("autogrid")
+		try:
+			for runs in self.scheduler.run():
+				self._merged()
+				yield runs
+		finally:
+			self._merged()
+			self._terminate()
+			self.timer.stop()
+
+	def _merged(self):
+		# record the receptors whose maps are done in the journal
+		if self.scheduler and self.progress:
+			self.progress.add([ job.name for job in self.scheduler.merged ])
+			self.scheduler.merged = []
+
+	def entry(self, target, ligand_dir = ""):
+		# progress journal entry of a receptor (ligand_dir = "") or a job
+		return target['name']+"/"+os.path.basename(ligand_dir)
+
+	def completed(self, target):
+		# the receptor directory is in the journal and its maps (or the Vina
+		# config) are still there
+		if not self.entry(target) in self.progress:
+			return False
+		if self.settings['target'] == "vina":
+			return os.path.isfile(target['path']+os.sep+VINA_CONFIG)
+		if target['maps']:
+			return len(os.listdir(target['maps'])) > 0
+		return True
+
+	def pending(self, target, jobs):
+		# INFO   : drop the jobs already generated
+		# INPUT  : list of (ligand, job directory)
+		# OUTPUT : list of the jobs to be generated
+		# EXTRA  : only when resuming an interrupted generation; the jobs in the
+		#          journal are skipped if their directory is still there, the
+		#          ones not in the journal (the generation stopped while writing
+		#          them) if VerifyJob() finds all the files
+		if not self.progress.resumed:
+			return jobs
+		self.timer.start("resume")
+		existing = set(os.listdir(target['path']))
+		todo, verified = [], []
+		for ligand, ligand_dir in jobs:
+			if os.path.basename(ligand_dir) in existing:
+				if self.entry(target, ligand_dir) in self.progress:
+					continue
+				if VerifyJob(self.settings, target, ligand, ligand_dir):
+					verified.append(self.entry(target, ligand_dir))
+					continue
+			todo.append((ligand, ligand_dir))
+		self.progress.add(verified)
+		self.skipped += len(jobs) - len(todo)
+		self.done += len(jobs) - len(todo)
+		self.timer.stop()
+		return todo
+
+	def values(self, target, ligand):
+		# GPF and DPF values of a registered ligand (None if unknown)
+		if self.table is None or not self.table.has_key(ligand) or target['dpf'] is False:
+			return None
+		properties = self.table[ligand]
+		values = { 'dpf' : DPFValues(properties, target['flex_types']) }
+		if target['gpf'] is not False:
+			values['gpf'] = GPFValues(properties, target['flex_types'])
+		return values
+
+	def compile(self, target, kind, template_class, filename, ligand_file, values):
+		# compile the template of the target from a file written by ADT
+		if target[kind] is not None or not values or not values.get(kind):
+			return
+		self.timer.start(kind+" (template)")
+		template = template_class(open(filename, 'r').read(), ligand_file, values[kind])
+		target[kind] = template.valid and template # False: don't try again
+		if template.valid:
+			self.receptors.store_template(kind, target['receptor'], target['flexres'], self.signature, template)
+		elif DEBUG: print "VSGenerator> %s template not usable for %s" % (kind, target['name'])
+		self.timer.stop()
+
+	def make(self, target, ligand, ligand_dir, values):
+		# INFO   : generate a job in this process
+		# EXTRA  : the GPF/DPF templates of the target are compiled from the
+		#          first files written by ADT
+		MakeJob(self.settings, target, ligand, ligand_dir, self.timer, values, self.links)
+		ligand_file, gpf_file, dpf_file, script_file = JobFiles(self.settings, target, ligand, ligand_dir)
+		self.compile(target, 'gpf', GPFTemplate, gpf_file, ligand_file, values)
+		self.compile(target, 'dpf', DPFTemplate, dpf_file, ligand_file, values)
+		self.progress.add([ self.entry(target, ligand_dir) ])
+		self.done += 1
+		self.pack([ ligand_dir ])
+
+	def job(self, target, ligand):
+		# INFO   : generate the job directory of a ligand
+		# OUTPUT : job directory
+		ligand_dir = JobDir(ligand, target)
+		self.make(target, ligand, ligand_dir, self.values(target, ligand))
+		return ligand_dir
+
+	def jobs(self, target, ligands):
+		# INFO   : generate the jobs of all the ligands for a target
+		# OUTPUT : generator of the number of jobs done so far (all the targets);
+		#          with the worker processes None is returned every 'timeout'
+		#          seconds while waiting, so the caller can keep the interface alive
+		#          (and stop() the generation)
+		# EXTRA  : the job directories are named here, the jobs already generated
+		#          are skipped, then the ligands are split in chunks that are
+		#          generated by the worker processes
+		jobs = self.pending(target, [ (ligand, JobDir(ligand, target)) for ligand in ligands ])
+		jobs = [ (ligand, ligand_dir, self.values(target, ligand)) for ligand, ligand_dir in jobs ]
+		if jobs and None in (target['gpf'], target['dpf']):
+			# the first job compiles the GPF/DPF templates used by the workers
+			self.make(target, *jobs[0])
+			jobs = jobs[1:]
+		if not jobs:
+			yield self.done
+			return
+		size = max(1, min(JOBS_CHUNK, len(jobs) / (self.workers * 4)))
+		job_target = {}
+		for key in ('name', 'path', 'receptor', 'flexres', 'flex_types', 'maps', 'gpf', 'dpf', 'gpf_parameters'):
+			job_target[key] = target[key] # the journal is not needed by the workers
+		tasks = [ (self.settings, job_target, jobs[i:i+size]) for i in range(0, len(jobs), size) ]
+		self.pool = NewPool(min(self.workers, len(tasks)))
+		if not self.pool:
+			for ligand, ligand_dir, values in jobs:
+				self.make(target, ligand, ligand_dir, values)
+				yield self.done
+			return
+		try:
+			results = self.pool.imap_unordered(_JobChunk, tasks)
+			for count in range(len(tasks)):
+				while True:
+					try:
+						done, timer, links, error = results.next(self.timeout)
+						break
+					except multiprocessing.TimeoutError:
+						yield None
+				self.progress.add([ self.entry(target, ligand_dir) for ligand_dir in done ])
+				self.done += len(done)
+				self.timer.add(timer)
+				self.links.add(links)
+				if error:
+					raise RaccoonError(error)
+				self.pack(done)
+				yield self.done
+			self.pool.close()
+		finally:
+			self._terminate()
+
+	def pack(self, job_dirs):
+		# stream the completed jobs in the VS package (if any)
+		if self.builder:
+			self.timer.start("package")
+			for job_dir in job_dirs:
+				self.builder.add(job_dir)
+			self.timer.stop()
+
+	def stop(self):
+		# stop the worker processes (if any) and the package; the progress
+		# journal is closed and kept, to resume the generation
+		self._merged()
+		self._terminate()
+		if self.builder:
+			self.builder.abort()
+			self.builder = None
+		if self.progress:
+			self.progress.close()
+			self.progress = None
+
+	def _terminate(self):
+		if self.pool:
+			self.pool.terminate()
+			self.pool = None
+		if self.scheduler:
+			self.scheduler.stop()
+			self.scheduler = None
+
+	def close(self, target):
+		# INFO   : write the master script of the receptor
+		if self.settings['scripts'] == "master" and not self.settings['target'] == "win":
+			self.timer.start("scripts")
+			MakeMasterJobScript(target['path'], target['journal'], self.settings)
+			self.timer.stop()
+
+	def finish(self):
+		# remove the progress journal (the generation is completed)
+		if self.progress:
+			self.progress.close(completed = True)
+			self.progress = None
+
+	def package(self, path):
+		# INFO   : complete the VS package (the files not streamed yet are added)
+		# OUTPUT : list of the package files (None if disabled)
+		if not self.settings['package']:
+			return None
+		self.timer.start("package")
+		try:
+			if not self.builder:
+				self.builder = PackageBuilder(path, path+os.sep+"VSpack_"+os.path.basename(path), self.settings['package'],
+						self.workers, self.message)
+			files = self.builder.finish()
+			self.builder = None
+			return files
+		finally:
+			self.timer.stop()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Raccoon maps
+#
+# Pack the AutoGrid maps of a directory in a binary .rmap container
+# (float32 values, optionally compressed) and unpack them back to the
+# original text files. A container can be used as the map_dir of the
+# cached maps in raccoon_batch.py: the maps are unpacked in the VS.
+#
+#   usage: python raccoon_maps.py pack map_dir [ maps.rmap ] [ -z ]
+#          python raccoon_maps.py unpack maps.rmap [ directory ]
+#          python raccoon_maps.py info maps.rmap
+#
+# v.1.0.0  Stefano Forli
+#
+# Copyright 2009, Molecular Graphics Lab
+# 	The Scripps Research Institute
+#
+#################################################################
+#
+#     This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+#################################################################
+
+import os
+import sys
+
+from raccoon_engine import RaccoonError, MapDirIndex, PackMaps, PackedMaps, UnpackMaps, RMAP_SUFFIX
+
+USAGE = """usage: python %s pack map_dir [ maps.rmap ] [ -z ]
+       python %s unpack maps.rmap [ directory ]
+       python %s info maps.rmap"""
+
+
+def Pack(map_dir, filename = None, compress = False):
+	index = MapDirIndex(map_dir)
+	if not index.files:
+		raise RaccoonError("No maps found in %s" % map_dir)
+	for map_file, problem in index.problems:
+		print "WARNING: %s : %s" % (os.path.basename(map_file), problem)
+	if filename is None:
+		filename = os.path.abspath(map_dir).rstrip(os.sep)+RMAP_SUFFIX
+	original, packed = PackMaps(index.files, filename, compress)
+	print "%d files packed in %s: %.1f Mb -> %.1f Mb (%.1fx)" % (len(index.files), filename,
+			original / 1048576., packed / 1048576., float(original) / max(packed, 1))
+
+
+def Unpack(filename, directory = None):
+	if directory is None:
+		directory = filename[:-len(RMAP_SUFFIX)]
+	if not os.path.exists(directory):
+		os.makedirs(directory, 0755)
+	files = UnpackMaps(filename, directory)
+	print "%d files unpacked in %s" % (len(files), directory)
+
+
+def Info(filename):
+	packed = PackedMaps(filename)
+	try:
+		for name in packed.names():
+			encoding, compression, offset, length = packed.entries[name][:4]
+			print "%-30s %-8s %-5s %12d bytes" % (name, encoding, compression, length)
+		for map_file, problem in packed.problems():
+			print "WARNING: %s : %s" % (map_file, problem)
+	finally:
+		packed.close()
+
+
+if __name__ == "__main__":
+	args = [ arg for arg in sys.argv[1:] if not arg == "-z" ]
+	commands = { "pack" : (Pack, 2, 3), "unpack" : (Unpack, 2, 3), "info" : (Info, 2, 2) }
+	if not args or not commands.has_key(args[0]) or not commands[args[0]][1] <= len(args) <= commands[args[0]][2]:
+		print USAGE % ((os.path.basename(sys.argv[0]),) * 3)
+		sys.exit(1)
+	function = commands[args[0]][0]
+	try:
+		if function == Pack:
+			Pack(compress = "-z" in sys.argv, *args[1:])
+		else:
+			function(*args[1:])
+	except (RaccoonError, IOError, OSError), e:
+		print "ERROR: %s" % e
+		sys.exit(1)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+#
+# Vina results
+#
+# Collect the results of a screening in a single ranked table:
+#
+#   - Vina       : <ligand>/log.txt (or <ligand>/out.pdbqt), affinity
+#                  and rmsd l.b./u.b. of each mode
+#   - AutoDock   : *.dlg, lowest and mean energy of each cluster
+#
+#   usage: python vina_results.py [ options ] [ directories ]
+#
+#   options:
+#     --output name   prefix of the tables                    [ results ]
+#     --top    N      best N poses extracted in <name>_top/    [ 0 ]
+#     --workers N     parsing processes                       [ all the cores ]
+#
+# The tables are written as:
+#
+#   <name>.csv      ligands sorted by their best energy, one line per mode
+#   <name>.cols/    the same table by columns (numpy .npy files, to be
+#                   read with numpy.load(..., mmap_mode = 'r')); ligand.npy
+#                   is the rank of the ligand, its name is the line
+#                   order.npy[rank] of names.txt (offsets in names.npy)
+#
+# The files are parsed in batches and the columns written to disk
+# as they come, so any number of results can be collected.
+#
+# v.1.0.0  Stefano Forli
+#
+# Copyright 2009, Molecular Graphics Lab
+# 	The Scripps Research Institute
+#
+#################################################################
+#
+#     This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+#################################################################
+
+import os
+import sys
+import time
+import shutil
+from optparse import OptionParser
+
+import numpy
+
+from vina_screen import OUT_FILE, LOG_FILE
+
+try:
+	import multiprocessing
+except ImportError:
+	# Python < 2.6: the files are parsed in the main process
+	multiprocessing = None
+
+BATCH = 20000 # result files parsed at a time
+
+# columns of the table: (name, numpy type); the ligand of each row is
+# the 'ligand' index in the names
+COLUMNS = (	( "ligand",	"int32" ),
+		( "mode",	"int16" ),	# Vina mode, AutoDock cluster rank
+		( "energy",	"float32" ),	# affinity, lowest energy of the cluster
+		( "rmsd_lb",	"float32" ),	# Vina only
+		( "rmsd_ub",	"float32" ),	# Vina only
+		( "mean_energy","float32" ),	# AutoDock only
+		( "cluster_size","int32" ),	# AutoDock only
+		)
+NAN = float('nan')
+
+
+def ResultFiles(paths):
+	# INFO   : find the result files (generator: nothing is kept in memory)
+	# OUTPUT : (ligand name, program, file)
+	for path in paths:
+		if os.path.isfile(path):
+			name, ext = os.path.splitext(os.path.basename(path))
+			if ext == ".dlg":
+				yield name, "autodock", path
+			else:
+				yield os.path.basename(os.path.dirname(os.path.abspath(path))), "vina", path
+			continue
+		for root, dirs, files in os.walk(path):
+			dirs.sort()
+			files.sort()
+			if LOG_FILE in files:
+				yield os.path.basename(root), "vina", os.path.join(root, LOG_FILE)
+			elif OUT_FILE in files:
+				yield os.path.basename(root), "vina", os.path.join(root, OUT_FILE)
+			for name in files:
+				if name.endswith(".dlg"):
+					yield name[:-4], "autodock", os.path.join(root, name)
+
+
+def ParseVina(filename):
+	# INFO   : modes of a Vina log or output PDBQT
+	# OUTPUT : list of (mode, energy, rmsd lb, rmsd ub, mean energy, cluster size)
+	modes = []
+	infile = open(filename, 'r')
+	try:
+		if filename.endswith(".pdbqt"):
+			for line in infile:
+				if line.startswith("REMARK VINA RESULT:"):
+					energy, lb, ub = line.split()[3:6]
+					modes.append((len(modes)+1, float(energy), float(lb), float(ub), NAN, 0))
+			return modes
+		table = False
+		for line in infile:
+			if line.startswith("-----+"):
+				table = True
+				continue
+			if table:
+				words = line.split()
+				if not len(words) == 4 or not words[0].isdigit():
+					break
+				modes.append((int(words[0]), float(words[1]), float(words[2]), float(words[3]), NAN, 0))
+	finally:
+		infile.close()
+	return modes
+
+
+def ParseDlg(filename):
+	# INFO   : clusters of an AutoDock DLG (clustering histogram)
+	# OUTPUT : list of (rank, lowest energy, rmsd lb, rmsd ub, mean energy, cluster size)
+	clusters = []
+	infile = open(filename, 'r')
+	try:
+		histogram = False
+		for line in infile:
+			if "CLUSTERING HISTOGRAM" in line:
+				histogram = True
+				continue
+			if histogram:
+				words = line.split("|")
+				if len(words) < 5:
+					continue
+				if not words[0].strip().isdigit():
+					if clusters: # end of the table
+						break
+					continue
+				clusters.append((int(words[0]), float(words[1]), NAN, NAN, float(words[3]), int(words[4])))
+	finally:
+		infile.close()
+	return clusters
+
+
+def ParseResult(result):
+	# worker side (module-level to be pickled)
+	# OUTPUT : (name, program, file, modes, error)
+	name, program, filename = result
+	try:
+		if program == "vina":
+			return name, program, filename, ParseVina(filename), None
+		return name, program, filename, ParseDlg(filename), None
+	except (IOError, ValueError, IndexError), e:
+		return name, program, filename, [], str(e)
+
+
+def Batches(iterable, size):
+	batch = []
+	for item in iterable:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+class ResultTable:
+	"""Columns of the results, written to disk (<name>.cols/) as the
+	files are parsed; rank() sorts the ligands by their best energy."""
+
+	def __init__(self, name):
+		self.path = name+".cols"
+		if os.path.exists(self.path):
+			shutil.rmtree(self.path)
+		os.makedirs(self.path)
+		self.columns = {}
+		for column, dtype in COLUMNS:
+			self.columns[column] = open(os.path.join(self.path, column+".raw"), 'wb')
+		self.names = open(os.path.join(self.path, "names.txt"), 'wb')
+		self.files = open(os.path.join(self.path, "files.txt"), 'wb')
+		self.ligands = 0
+		self.rows = 0
+		self.failed = []
+
+	def add(self, results):
+		# INFO   : append the results of a batch of files
+		rows = []
+		for name, program, filename, modes, error in results:
+			if error or not modes:
+				self.failed.append((filename, error or "no results"))
+				continue
+			self.names.write(name.replace("\n", " ")+"\n")
+			self.files.write(filename+"\n")
+			for mode in modes:
+				rows.append((self.ligands,) + mode)
+			self.ligands += 1
+		if not rows:
+			return
+		rows = numpy.array(rows, dtype = numpy.float64)
+		for index in range(len(COLUMNS)):
+			column, dtype = COLUMNS[index]
+			rows[:,index].astype(dtype).tofile(self.columns[column])
+		self.rows += len(rows)
+
+	def rank(self):
+		# INFO   : write the columns sorted by the best energy of each ligand
+		#          (then the modes in their order) as <column>.npy
+		for output in self.columns.values() + [ self.names, self.files ]:
+			output.close()
+		def column(name):
+			if not self.rows: # empty files can not be mapped
+				return numpy.zeros(0, dict(COLUMNS)[name])
+			return numpy.memmap(os.path.join(self.path, name+".raw"), dtype = dict(COLUMNS)[name], mode = 'r',
+				shape = (self.rows,))
+		ligand = column("ligand")
+		# first row and number of rows of each ligand (the rows of a ligand are consecutive)
+		first = numpy.searchsorted(ligand, numpy.arange(self.ligands))
+		count = numpy.diff(numpy.append(first, self.rows))
+		best = numpy.minimum.reduceat(column("energy"), first) if self.rows else numpy.zeros(0)
+		order = numpy.argsort(best, kind = 'mergesort')
+		# rows of the ligands in the new order
+		starts = numpy.repeat(first[order], count[order])
+		steps = numpy.arange(self.rows) - numpy.repeat(numpy.cumsum(count[order]) - count[order], count[order])
+		rows = starts + steps
+		for name, dtype in COLUMNS:
+			data = column(name)
+			if name == "ligand":
+				# ligand = rank of the ligand (0 is the best one)
+				rank = numpy.empty(self.ligands, dtype = dtype)
+				rank[order] = numpy.arange(self.ligands, dtype = dtype)
+				numpy.save(os.path.join(self.path, name+".npy"), rank[data[rows]])
+			else:
+				numpy.save(os.path.join(self.path, name+".npy"), numpy.asarray(data[rows]))
+			del data
+			os.remove(os.path.join(self.path, name+".raw"))
+		numpy.save(os.path.join(self.path, "order.npy"), order.astype("int32"))
+		self._index("names")
+		self._index("files")
+		return order
+
+	def _index(self, name):
+		# offsets of the lines of names.txt/files.txt (names.npy, files.npy)
+		data = numpy.memmap(os.path.join(self.path, name+".txt"), dtype = numpy.uint8, mode = 'r') \
+			if os.path.getsize(os.path.join(self.path, name+".txt")) else numpy.zeros(0, numpy.uint8)
+		ends = numpy.nonzero(data == 10)[0] + 1
+		numpy.save(os.path.join(self.path, name+".npy"), numpy.append(0, ends).astype("int64"))
+
+
+class Lines:
+	"""Random access to the lines of names.txt/files.txt of a table."""
+
+	def __init__(self, path, name):
+		self.offsets = numpy.load(os.path.join(path, name+".npy"))
+		self.file = open(os.path.join(path, name+".txt"), 'rb')
+
+	def __getitem__(self, index):
+		self.file.seek(self.offsets[index])
+		return self.file.read(self.offsets[index+1] - self.offsets[index] - 1)
+
+	def close(self):
+		self.file.close()
+
+
+def WriteCsv(path, filename):
+	# INFO   : the ranked table as CSV (one line per mode), written by blocks
+	columns = dict([ (name, numpy.load(os.path.join(path, name+".npy"), mmap_mode = 'r')) for name, dtype in COLUMNS ])
+	order = numpy.load(os.path.join(path, "order.npy"), mmap_mode = 'r')
+	names = Lines(path, "names")
+	output = open(filename, 'w')
+	try:
+		output.write("rank,ligand,mode,energy,rmsd_lb,rmsd_ub,mean_energy,cluster_size\n")
+		for start in range(0, len(columns["ligand"]), BATCH):
+			block = dict([ (name, columns[name][start:start+BATCH].tolist()) for name in columns ])
+			lines = []
+			for i in range(len(block["ligand"])):
+				rank = block["ligand"][i]
+				values = [ "%.3f" % block[name][i] for name in ("energy", "rmsd_lb", "rmsd_ub", "mean_energy") ]
+				values = [ value.replace("nan", "") for value in values ]
+				lines.append("%d,%s,%d,%s,%d\n" % (rank+1, names[order[rank]], block["mode"][i], ",".join(values),
+						block["cluster_size"][i]))
+			output.write("".join(lines))
+	finally:
+		output.close()
+		names.close()
+
+
+def ExtractTop(path, top, directory):
+	# INFO   : copy the best pose of the first 'top' ligands in directory
+	#          (Vina: the first model of out.pdbqt; AutoDock: the DLG)
+	# OUTPUT : number of files written
+	order = numpy.load(os.path.join(path, "order.npy"), mmap_mode = 'r')
+	names, files = Lines(path, "names"), Lines(path, "files")
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	written = 0
+	try:
+		for rank in range(min(top, len(order))):
+			name, filename = names[order[rank]], files[order[rank]]
+			prefix = os.path.join(directory, "%d_%s" % (rank+1, name))
+			if filename.endswith(".dlg"):
+				shutil.copy(filename, prefix+".dlg")
+				written += 1
+				continue
+			pdbqt = os.path.join(os.path.dirname(filename), OUT_FILE)
+			if not os.path.exists(pdbqt):
+				continue
+			pose = []
+			for line in open(pdbqt, 'r'):
+				pose.append(line)
+				if line.startswith("ENDMDL"):
+					break
+			output = open(prefix+".pdbqt", 'w')
+			output.writelines(pose)
+			output.close()
+			written += 1
+	finally:
+		names.close()
+		files.close()
+	return written
+
+
+def Collect(paths, name, workers = None, top = 0, message = None):
+	# INFO   : parse all the results and write the ranked tables
+	# OUTPUT : ResultTable
+	if not message:
+		message = lambda text: None
+	if workers is None:
+		workers = multiprocessing and multiprocessing.cpu_count() or 1
+	table = ResultTable(name)
+	pool = None
+	if multiprocessing and workers > 1:
+		pool = multiprocessing.Pool(workers)
+	try:
+		start = time.time()
+		for batch in Batches(ResultFiles(paths), BATCH):
+			if pool:
+				results = pool.map(ParseResult, batch, max(1, len(batch) / (workers * 4)))
+			else:
+				results = map(ParseResult, batch)
+			table.add(results)
+			message("%d ligands, %d poses (%.0f files/s)" % (table.ligands, table.rows,
+					(table.ligands + len(table.failed)) / max(time.time() - start, 1e-9)))
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+	table.rank()
+	WriteCsv(table.path, name+".csv")
+	if top:
+		message("%d best poses extracted in %s" % (ExtractTop(table.path, top, name+"_top"), name+"_top"))
+	return table
+
+
+def Message(text):
+	print text
+	sys.stdout.flush()
+
+
+if __name__ == "__main__":
+	parser = OptionParser(usage = "usage: python %prog [ options ] [ directories ]")
+	parser.add_option("--output", default = "results", help = "prefix of the tables [ results ]")
+	parser.add_option("--top", type = "int", default = 0, help = "best N poses extracted in <output>_top/")
+	parser.add_option("--workers", type = "int", default = None, help = "parsing processes [ all the cores ]")
+	options, paths = parser.parse_args()
+	try:
+		table = Collect(paths or [ "." ], options.output, options.workers, options.top, Message)
+	except (IOError, OSError), e:
+		print "ERROR: %s" % e
+		sys.exit(1)
+	for filename, error in table.failed[:20]:
+		print "WARNING: %s : %s" % (filename, error)
+	if len(table.failed) > 20:
+		print "WARNING: ...and %d more files without results" % (len(table.failed) - 20)
+	print "%d ligands ranked in %s.csv (%s.cols)" % (table.ligands, options.output, options.output)
@@ -0,0 +1,648 @@
+#!/usr/bin/env python
+#
+# Vina screen
+#
+# Dock a set of ligands with AutoDock Vina, running several Vina
+# processes at once (jobs x cpu should be the number of cores).
+# The results are written as by vina_screen_local.sh:
+#
+#     <ligand>/out.pdbqt
+#     <ligand>/log.txt
+#
+#   usage: python vina_screen.py [ options ] [ ligands and directories ]
+#
+#   options:
+#     --config conf.txt   Vina config file (receptor, box, ...)   [ conf.txt ]
+#     --vina   vina       Vina executable                         [ vina in the PATH ]
+#     --jobs   N          Vina processes at the same time         [ cores / cpu ]
+#     --cpu    M          --cpu of each Vina process              [ 1 ]
+#     --timeout S         seconds before a docking is stopped     [ none ]
+#     --retries R         dockings run again after a failure      [ 1 ]
+#     --batch  B          ligands docked by each Vina process     [ 1 ]
+#     --funnel F          two stages: re-dock the best fraction F [ none ]
+#     --fast   E          exhaustiveness of the first stage       [ 1 ]
+#     --rank   R          score, efficiency (score / heavy atoms) [ score ]
+#     --log    file       Raccoon log where the funnel is recorded
+#     --output dir        directory of the results                [ . ]
+#     --force             dock again the ligands already docked
+#
+# The ligands are the PDBQT files given (all the *.pdbqt in the
+# directories, default the current one), except the receptor and the
+# flexible residues of the config. The ligands already docked are
+# skipped, so an interrupted screening can be run again.
+#
+# With --batch the receptor is read (and its grids calculated) once for
+# B ligands, using the batch mode of Vina (--batch, Vina 1.2 or later;
+# older versions dock one ligand per process). Vina writes a single log
+# for the batch: the log.txt of each ligand has only the table of the
+# modes (read from out.pdbqt). The ligands of a batch that failed are
+# docked again one by one.
+#
+# With --funnel all the ligands are docked at a low exhaustiveness
+# (<output>/stage1), then the best fraction F of them is docked again
+# with the exhaustiveness of the config (<output>/stage2, default 8).
+# The thresholds and the statistics of the stages are printed and
+# recorded as FUNNEL> lines in the Raccoon log given with --log.
+#
+# v.1.0.0  Stefano Forli
+#
+# Copyright 2009, Molecular Graphics Lab
+# 	The Scripps Research Institute
+#
+#################################################################
+#
+#     This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+#################################################################
+
+import os
+import sys
+import glob
+import math
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import Queue
+from optparse import OptionParser
+
+OUT_FILE = "out.pdbqt"
+LOG_FILE = "log.txt"
+LOG_DONE = "Writing output ... done." # last line of a completed Vina log
+BATCH_SUFFIX = "_out.pdbqt" # output of each ligand in the --dir of a Vina batch
+VINA_EXHAUSTIVENESS = 8 # Vina default
+FUNNEL_RANKS = ( "score", "efficiency" )
+PROGRESS_EVERY = 5. # seconds between progress lines
+
+
+def CPUCount():
+	# number of available cores (at least 1)
+	try:
+		import multiprocessing
+		return multiprocessing.cpu_count()
+	except (ImportError, NotImplementedError):
+		return 1
+
+
+def Which(program):
+	# full path of an executable (given with its path or in the PATH), None if missing
+	if os.path.dirname(program):
+		paths = [ "" ]
+	else:
+		paths = os.environ.get("PATH", "").split(os.pathsep)
+	for path in paths:
+		for exe_file in (os.path.join(path, program), os.path.join(path, program+".exe")):
+			if os.path.isfile(exe_file) and os.access(exe_file, os.X_OK):
+				return exe_file
+	return None
+
+
+def ReadConfig(filename):
+	# INFO   : read a Vina config file
+	# OUTPUT : dictionary { option : value } (the options without a value are skipped)
+	config = {}
+	infile = open(filename, 'r')
+	try:
+		for line in infile:
+			line = line.split('#')[0]
+			if not '=' in line:
+				continue
+			option, value = [ word.strip() for word in line.split('=', 1) ]
+			if option and value:
+				config[option] = value
+	finally:
+		infile.close()
+	return config
+
+
+def FindLigands(paths, exclude = ()):
+	# INFO   : PDBQT ligands in the files, patterns and directories
+	# INPUT  : paths, files to skip (receptor, flexible residues)
+	# OUTPUT : sorted list of files
+	exclude = [ os.path.abspath(name) for name in exclude ]
+	ligands = []
+	for path in paths:
+		if os.path.isdir(path):
+			files = glob.glob(os.path.join(path, "*.pdbqt"))
+		else:
+			files = glob.glob(path) or [ path ]
+		for name in files:
+			if not os.path.abspath(name) in exclude and not name in ligands:
+				ligands.append(name)
+	ligands.sort()
+	return ligands
+
+
+def LigandName(ligand):
+	return os.path.basename(ligand).rsplit('.', 1)[0]
+
+
+def Docked(result_dir):
+	# True if the docking in result_dir was completed
+	try:
+		log = open(os.path.join(result_dir, LOG_FILE)).read()
+	except IOError:
+		return False
+	return LOG_DONE in log and os.path.exists(os.path.join(result_dir, OUT_FILE))
+
+
+def VinaBatch(vina):
+	# True if Vina docks several ligands in a process (--batch, Vina >= 1.2)
+	try:
+		process = subprocess.Popen([ vina, "--help" ], stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+		return "--batch" in process.communicate()[0]
+	except OSError:
+		return False
+
+
+def WriteLog(result_dir):
+	# INFO   : log.txt of a ligand docked in a batch, with the table
+	#          of the modes of out.pdbqt (as written by Vina)
+	lines = [ "Docked in a batch: the Vina log is not available for each ligand.\n\n",
+		"mode |   affinity | dist from best mode\n",
+		"     | (kcal/mol) | rmsd l.b.| rmsd u.b.\n",
+		"-----+------------+----------+----------\n" ]
+	mode = 0
+	for line in open(os.path.join(result_dir, OUT_FILE), 'r'):
+		if line.startswith("REMARK VINA RESULT:"):
+			mode += 1
+			energy, lb, ub = [ float(value) for value in line.split()[3:6] ]
+			lines.append("%4d %12.1f %10.3f %10.3f\n" % (mode, energy, lb, ub))
+	lines.append(LOG_DONE+"\n")
+	log = open(os.path.join(result_dir, LOG_FILE), 'w')
+	log.writelines(lines)
+	log.close()
+
+
+class VinaRunner:
+	"""Run Vina on the ligands with 'jobs' processes of 'cpu' threads.
+
+		runner = VinaRunner(vina, config, output_dir, jobs, cpu)
+		for ligand, status, attempts, message in runner.run(ligands):
+			...
+		runner.report()
+
+	The status is 'docked', 'failed' or 'timeout' (None is returned every
+	'progress' seconds while waiting); failed dockings are run again up
+	to 'retries' times, the ones stopped after 'timeout' seconds are not.
+	Each process docks up to 'batch' ligands when Vina supports it
+	(self.batch is 1 otherwise). The Vina 'options' (a list) override the
+	config; Vina runs in 'cwd' (default the current directory).
+	"""
+
+	def __init__(self, vina, config, output_dir = ".", jobs = None, cpu = 1, timeout = None, retries = 1,
+			progress = PROGRESS_EVERY, batch = 1, options = (), cwd = None):
+		self.vina = vina
+		self.config = config
+		self.options = list(options)
+		self.cwd = cwd
+		self.output_dir = output_dir
+		self.cpu = max(1, cpu)
+		if not jobs:
+			jobs = max(1, CPUCount() / self.cpu)
+		self.jobs = jobs
+		self.timeout = timeout
+		self.retries = retries
+		self.progress = progress
+		self.batch = max(1, batch)
+		if self.batch > 1 and not VinaBatch(vina):
+			self.batch = 1
+		self.processes = []
+		self.stopped = False
+		self.count = { 'docked' : 0, 'failed' : 0, 'timeout' : 0 }
+		self.start = None
+		self.elapsed = 0.
+		self.cpu_time = 0.
+
+	def command(self, ligand, result_dir):
+		return [ self.vina, "--config", self.config, "--ligand", ligand, "--cpu", str(self.cpu),
+			"--out", os.path.join(result_dir, OUT_FILE), "--log", os.path.join(result_dir, LOG_FILE) ] + self.options
+
+	def dock(self, ligand):
+		# INFO   : dock a ligand (in a worker thread)
+		# OUTPUT : (status, attempts, message)
+		result_dir = os.path.join(self.output_dir, LigandName(ligand))
+		if not os.path.exists(result_dir):
+			os.makedirs(result_dir)
+		attempts = 0
+		message = "stopped"
+		while attempts <= self.retries and not self.stopped:
+			attempts += 1
+			for name in (OUT_FILE, LOG_FILE): # no partial results
+				if os.path.exists(os.path.join(result_dir, name)):
+					os.remove(os.path.join(result_dir, name))
+			output = tempfile.TemporaryFile()
+			try:
+				try:
+					process = subprocess.Popen(self.command(ligand, result_dir), stdout = output, stderr = subprocess.STDOUT,
+							cwd = self.cwd)
+				except OSError, e:
+					return 'failed', attempts, "impossible to run %s (%s)" % (self.vina, e)
+				self.processes.append(process)
+				start = time.time()
+				while process.poll() is None:
+					if self.timeout and time.time() - start > self.timeout:
+						Kill(process)
+						process.wait()
+						self.processes.remove(process)
+						return 'timeout', attempts, "stopped after %d s" % self.timeout
+					time.sleep(0.1)
+				self.processes.remove(process)
+				if process.returncode == 0 and Docked(result_dir):
+					return 'docked', attempts, ""
+				output.seek(0)
+				message = "exit code %d: %s" % (process.returncode, " ".join(output.read().split()[-20:]))
+			finally:
+				output.close()
+		return 'failed', attempts, message
+
+	def dock_batch(self, ligands):
+		# INFO   : dock several ligands with a Vina process (in a worker thread)
+		# OUTPUT : list of the ligands docked
+		# EXTRA  : the batch is stopped after 'timeout' seconds per ligand;
+		#          the output being written then is discarded
+		batch_dir = tempfile.mkdtemp(prefix = ".batch_", dir = self.output_dir)
+		output = tempfile.TemporaryFile()
+		try:
+			command = [ self.vina, "--config", self.config, "--cpu", str(self.cpu), "--dir", batch_dir ] + self.options
+			try:
+				process = subprocess.Popen(command + [ "--batch" ] + ligands, stdout = output, stderr = subprocess.STDOUT,
+						cwd = self.cwd)
+			except OSError:
+				return []
+			self.processes.append(process)
+			start = time.time()
+			killed = False
+			while process.poll() is None:
+				if self.stopped or (self.timeout and time.time() - start > self.timeout * len(ligands)):
+					Kill(process)
+					process.wait()
+					killed = True
+				time.sleep(0.1)
+			self.processes.remove(process)
+			outputs = [ (ligand, os.path.join(batch_dir, LigandName(ligand)+BATCH_SUFFIX)) for ligand in ligands ]
+			outputs = [ (os.path.getmtime(pdbqt), ligand, pdbqt) for ligand, pdbqt in outputs if os.path.exists(pdbqt) ]
+			outputs.sort()
+			if killed:
+				outputs = outputs[:-1]
+			docked = []
+			for mtime, ligand, pdbqt in outputs:
+				result_dir = os.path.join(self.output_dir, LigandName(ligand))
+				if not os.path.exists(result_dir):
+					os.makedirs(result_dir)
+				shutil.move(pdbqt, os.path.join(result_dir, OUT_FILE))
+				WriteLog(result_dir)
+				docked.append(ligand)
+			return docked
+		finally:
+			output.close()
+			shutil.rmtree(batch_dir, True)
+
+	def _worker(self, tasks, results):
+		while not self.stopped:
+			try:
+				ligands = tasks.get(False)
+			except Queue.Empty:
+				return
+			try:
+				if len(ligands) > 1:
+					try:
+						docked = self.dock_batch(ligands)
+					except Exception: # docked one by one below
+						docked = []
+					for ligand in docked:
+						ligands.remove(ligand)
+						results.put((ligand, 'docked', 1, ""))
+				while ligands:
+					status, attempts, message = self.dock(ligands[0])
+					results.put((ligands.pop(0), status, attempts, message))
+			except Exception, e:
+				for ligand in ligands:
+					results.put((ligand, 'failed', 1, str(e)))
+
+	def run(self, ligands):
+		# OUTPUT : generator of (ligand, status, attempts, message) (see above)
+		if not os.path.exists(self.output_dir):
+			os.makedirs(self.output_dir)
+		tasks, results = Queue.Queue(), Queue.Queue()
+		for i in range(0, len(ligands), self.batch):
+			tasks.put(list(ligands[i:i+self.batch]))
+		self.start = time.time()
+		cpu_start = ChildrenTime()
+		threads = [ threading.Thread(target = self._worker, args = (tasks, results)) for i in range(min(self.jobs, tasks.qsize())) ]
+		for thread in threads:
+			thread.setDaemon(True)
+			thread.start()
+		try:
+			for count in range(len(ligands)):
+				while True:
+					try:
+						result = results.get(True, self.progress)
+						break
+					except Queue.Empty:
+						yield None
+				self.count[result[1]] += 1
+				yield result
+		finally:
+			self.stop()
+			self.elapsed = time.time() - self.start
+			self.cpu_time = ChildrenTime() - cpu_start
+
+	def stop(self):
+		self.stopped = True
+		for process in self.processes[:]:
+			Kill(process)
+
+	def report(self):
+		# OUTPUT : list of lines (ligands/hour and core utilization)
+		done = self.count['docked']
+		elapsed = self.elapsed or (time.time() - self.start)
+		lines = [ "%d docked, %d failed, %d timeout in %.1f s (%d jobs x %d cpu, batches of %d)" % (done, self.count['failed'],
+				self.count['timeout'], elapsed, self.jobs, self.cpu, self.batch) ]
+		lines.append("%.1f ligands/hour" % (done * 3600. / max(elapsed, 1e-9)))
+		if self.cpu_time:
+			lines.append("core utilization: %.0f%% of %d cores" % (100. * self.cpu_time / max(elapsed * CPUCount(), 1e-9), CPUCount()))
+		return lines
+
+
+def BestScore(result_dir):
+	# affinity of the first mode of out.pdbqt (None if not docked)
+	try:
+		for line in open(os.path.join(result_dir, OUT_FILE), 'r'):
+			if line.startswith("REMARK VINA RESULT:"):
+				return float(line.split()[3])
+	except (IOError, ValueError, IndexError):
+		pass
+	return None
+
+
+def HeavyAtoms(ligand):
+	# heavy atoms of a PDBQT ligand (all but the HD, as Nat in Raccoon)
+	count = 0
+	for line in open(ligand, 'r'):
+		if (line[0:6] == 'HETATM' or line[0:4] == 'ATOM') and not line.split()[-1] == "HD":
+			count += 1
+	return count
+
+
+class VinaFunnel:
+	"""Two-stage screening: all the ligands are docked with a low
+	exhaustiveness ('fast', in output_dir/stage1), then the best 'fraction'
+	of them is docked again with a high one ('slow', in output_dir/stage2).
+
+		funnel = VinaFunnel(vina, config, output_dir, fraction = 0.1)
+		for stage, result in funnel.run(ligands):
+			...
+		funnel.report()
+
+	The ligands are ranked by the best affinity ('score') or by the
+	affinity per heavy atom ('efficiency', from heavy_atoms = { ligand :
+	Nat } or read from the PDBQT). The ligands already docked in a stage
+	are not docked again (unless 'force'). The other keyword arguments
+	are passed to the VinaRunner of each stage.
+	"""
+
+	def __init__(self, vina, config, output_dir = ".", fraction = 0.1, fast = 1, slow = VINA_EXHAUSTIVENESS, rank = "score",
+			heavy_atoms = None, force = False, **runner_options):
+		if not 0 < fraction <= 1:
+			raise ValueError("the funnel fraction must be in (0, 1] (%s)" % fraction)
+		if not rank in FUNNEL_RANKS:
+			raise ValueError("unknown rank: %s (available: %s)" % (rank, ", ".join(FUNNEL_RANKS)))
+		self.vina = vina
+		self.config = config
+		self.output_dir = output_dir
+		self.fraction = fraction
+		self.fast = fast
+		self.slow = slow
+		self.rank = rank
+		self.heavy_atoms = heavy_atoms or {}
+		self.force = force
+		self.runner_options = runner_options
+		self.runners = {} # stage : VinaRunner (None if nothing to dock)
+		self.ligands = {} # stage : ligands
+		self.skipped = {} # stage : ligands already docked
+		self.scores = {} # stage : { ligand : best affinity }
+		self.threshold = None # rank value of the last ligand selected
+		self.selected = []
+
+	def key(self, ligand, score):
+		# value used to rank the ligands (lower is better)
+		if self.rank == "efficiency":
+			if not self.heavy_atoms.has_key(ligand):
+				self.heavy_atoms[ligand] = HeavyAtoms(ligand)
+			return score / max(1, self.heavy_atoms[ligand])
+		return score
+
+	def stage(self, name, exhaustiveness, ligands):
+		# OUTPUT : generator of the VinaRunner results of a stage
+		output_dir = os.path.join(self.output_dir, name)
+		if not os.path.exists(output_dir):
+			os.makedirs(output_dir)
+		todo = ligands
+		if not self.force:
+			todo = [ ligand for ligand in ligands if not Docked(os.path.join(output_dir, LigandName(ligand))) ]
+		self.ligands[name] = ligands
+		self.skipped[name] = len(ligands) - len(todo)
+		self.runners[name] = None
+		if todo:
+			self.runners[name] = VinaRunner(self.vina, self.config, output_dir,
+					options = [ "--exhaustiveness", str(exhaustiveness) ], **self.runner_options)
+			for result in self.runners[name].run(todo):
+				yield result
+		self.scores[name] = {}
+		for ligand in ligands:
+			score = BestScore(os.path.join(output_dir, LigandName(ligand)))
+			if score is not None:
+				self.scores[name][ligand] = score
+
+	def run(self, ligands):
+		# OUTPUT : generator of (stage, result) (see VinaRunner.run())
+		for result in self.stage("stage1", self.fast, ligands):
+			yield "stage1", result
+		ranked = [ (self.key(ligand, score), ligand) for ligand, score in self.scores["stage1"].items() ]
+		ranked.sort()
+		count = int(math.ceil(self.fraction * len(ranked)))
+		self.selected = [ ligand for key, ligand in ranked[:count] ]
+		if self.selected:
+			self.threshold = ranked[count-1][0]
+		for result in self.stage("stage2", self.slow, self.selected):
+			yield "stage2", result
+
+	def stop(self):
+		for runner in self.runners.values():
+			if runner:
+				runner.stop()
+
+	def report(self):
+		# OUTPUT : list of lines (thresholds and statistics of the stages)
+		unit = { "score" : "kcal/mol", "efficiency" : "kcal/mol/heavy atom" }[self.rank]
+		lines = [ "rank by %s, best %.1f%% re-docked: %d of %d ligands docked in stage 1" % (self.rank, self.fraction * 100,
+				len(self.selected), len(self.scores.get("stage1", {}))) ]
+		if self.threshold is not None:
+			lines.append("threshold : %.3f %s" % (self.threshold, unit))
+		for name, exhaustiveness in ( ("stage1", self.fast), ("stage2", self.slow) ):
+			if not self.ligands.has_key(name):
+				continue
+			line = "%s : exhaustiveness %d, %d ligands (%d already docked)" % (name, exhaustiveness,
+					len(self.ligands[name]), self.skipped[name])
+			runner = self.runners[name]
+			if runner:
+				count = runner.count
+				line += ", %d docked, %d failed, %d timeout in %.1f s (%.1f ligands/hour)" % (count['docked'],
+						count['failed'], count['timeout'], runner.elapsed, count['docked'] * 3600. / max(runner.elapsed, 1e-9))
+			lines.append(line)
+		if self.scores.has_key("stage2"):
+			changes = [ score - self.scores["stage1"][ligand] for ligand, score in self.scores["stage2"].items() ]
+			if changes:
+				lines.append("stage2 : best affinity improved for %d of %d ligands (mean change %+.2f kcal/mol)" % \
+						(len([ change for change in changes if change < 0 ]), len(changes), sum(changes) / len(changes)))
+			runner = self.runners["stage2"]
+			if runner and runner.count['docked'] and self.runners["stage1"]:
+				# time of the whole screen at the high exhaustiveness
+				single = runner.elapsed / runner.count['docked'] * len(self.ligands["stage1"])
+				spent = self.runners["stage1"].elapsed + runner.elapsed
+				lines.append("time : %.1f s, %.1f s estimated for a single stage at exhaustiveness %d (%.1fx)" % (spent,
+						single, self.slow, single / max(spent, 1e-9)))
+		return lines
+
+
+def AppendLog(filename, lines, tag):
+	# INFO   : add tagged lines to a Raccoon log (before its final [DONE])
+	infile = open(filename, 'r')
+	text = infile.read().rstrip()
+	infile.close()
+	done = ""
+	if text.endswith("[DONE]"):
+		text, done = text[:-len("[DONE]")].rstrip(), "\n\n\n[DONE]"
+	output = open(filename, 'w')
+	output.write(text+"\n\n"+"\n".join([ tag+"\t"+line for line in lines ])+done+"\n")
+	output.close()
+
+
+def Kill(process):
+	# stop a Vina process (there is nothing to save)
+	try:
+		process.kill()
+	except (OSError, AttributeError): # Python < 2.6
+		if hasattr(os, 'kill'):
+			import signal
+			try:
+				os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+			except OSError:
+				pass
+
+
+def ChildrenTime():
+	# CPU time of the terminated child processes (0 where not available)
+	times = os.times()
+	return times[2] + times[3]
+
+
+def Screen(options, paths):
+	# OUTPUT : number of ligands not docked
+	if not os.path.exists(options.config):
+		raise IOError("the Vina config file %s is missing" % options.config)
+	config = ReadConfig(options.config)
+	if not config.has_key('receptor'):
+		raise IOError("the receptor is not defined in %s" % options.config)
+	vina = Which(options.vina)
+	if not vina:
+		raise IOError("Vina executable not found: %s (use --vina or $VINA)" % options.vina)
+	# Vina reads the receptor files of the config from the current directory
+	exclude = [ config[key] for key in ('receptor', 'flex') if config.has_key(key) ]
+	ligands = FindLigands(paths or [ "." ], exclude)
+	if options.funnel:
+		return Funnel(options, vina, config, ligands)
+	todo = ligands
+	if not options.force:
+		todo = [ ligand for ligand in ligands if not Docked(os.path.join(options.output, LigandName(ligand))) ]
+	print "%d ligands (%d already docked)" % (len(ligands), len(ligands) - len(todo))
+	if not todo:
+		return 0
+	runner = VinaRunner(vina, options.config, options.output, options.jobs, options.cpu, options.timeout, options.retries,
+			batch = options.batch)
+	if options.batch > runner.batch:
+		print "WARNING: %s has no batch mode (Vina 1.2 or later): one ligand per process" % vina
+	last = time.time()
+	for result in runner.run(todo):
+		if result:
+			ligand, status, attempts, message = result
+			if status == 'docked':
+				print "Processing ligand %s ... done" % LigandName(ligand)
+			else:
+				print "Processing ligand %s ... %s after %d attempts (%s)" % (LigandName(ligand), status, attempts, message)
+		if time.time() - last > PROGRESS_EVERY:
+			last = time.time()
+			done = sum(runner.count.values())
+			print "[ %d | %d ] %.1f ligands/hour" % (done, len(todo), runner.count['docked'] * 3600. / (last - runner.start))
+	for line in runner.report():
+		print line
+	return runner.count['failed'] + runner.count['timeout']
+
+
+def Funnel(options, vina, config, ligands):
+	# OUTPUT : number of ligands not docked (both stages)
+	slow = int(config.get('exhaustiveness', VINA_EXHAUSTIVENESS))
+	funnel = VinaFunnel(vina, options.config, options.output, options.funnel, options.fast, slow, options.rank,
+			force = options.force, jobs = options.jobs, cpu = options.cpu, timeout = options.timeout,
+			retries = options.retries, batch = options.batch)
+	print "%d ligands, stage 1 at exhaustiveness %d, best %.1f%% at %d" % (len(ligands), options.fast, options.funnel * 100, slow)
+	failed = 0
+	try:
+		for stage, result in funnel.run(ligands):
+			if not result:
+				continue
+			ligand, status, attempts, message = result
+			if status == 'docked':
+				print "[ %s ] Processing ligand %s ... done" % (stage, LigandName(ligand))
+			else:
+				failed += 1
+				print "[ %s ] Processing ligand %s ... %s after %d attempts (%s)" % (stage, LigandName(ligand), status,
+						attempts, message)
+	finally:
+		funnel.stop()
+	for line in funnel.report():
+		print line
+	if options.log:
+		AppendLog(options.log, funnel.report(), "FUNNEL>")
+	return failed
+
+
+if __name__ == "__main__":
+	parser = OptionParser(usage = "usage: python %prog [ options ] [ ligands and directories ]")
+	parser.add_option("--config", default = "conf.txt", help = "Vina config file [ conf.txt ]")
+	parser.add_option("--vina", default = "vina", help = "Vina executable [ vina in the PATH ]")
+	parser.add_option("--jobs", type = "int", default = None, help = "Vina processes at the same time [ cores / cpu ]")
+	parser.add_option("--cpu", type = "int", default = 1, help = "--cpu of each Vina process [ 1 ]")
+	parser.add_option("--timeout", type = "float", default = None, help = "seconds before a docking is stopped")
+	parser.add_option("--retries", type = "int", default = 1, help = "dockings run again after a failure [ 1 ]")
+	parser.add_option("--batch", type = "int", default = 1, help = "ligands docked by each Vina process [ 1 ]")
+	parser.add_option("--funnel", type = "float", default = None, help = "two stages: re-dock the best fraction F")
+	parser.add_option("--fast", type = "int", default = 1, help = "exhaustiveness of the first stage [ 1 ]")
+	parser.add_option("--rank", default = "score", choices = FUNNEL_RANKS, help = "score, efficiency (score / heavy atoms) [ score ]")
+	parser.add_option("--log", default = None, help = "Raccoon log where the funnel is recorded")
+	parser.add_option("--output", default = ".", help = "directory of the results [ . ]")
+	parser.add_option("--force", action = "store_true", default = False, help = "dock again the ligands already docked")
+	options, paths = parser.parse_args()
+	try:
+		failed = Screen(options, paths)
+	except (IOError, OSError, ValueError), e:
+		print "ERROR: %s" % e
+		sys.exit(1)
+	except KeyboardInterrupt:
+		print "\nInterrupted: run again to dock the remaining ligands."
+		sys.exit(1)
+	if failed:
+		sys.exit(2)
@@ -1,8 +1,15 @@
 #! /bin/bash
+#
+# Dock all the *.pdbqt ligands in the current directory with the
+# settings in conf.txt (results in <ligand>/out.pdbqt and <ligand>/log.txt).
+# The dockings run in parallel on all the cores: see vina_screen.py
+# for the options (--jobs, --cpu, --timeout, --retries...).
+#
+#   usage: vina_screen_local.sh [ vina_screen.py options ]
+#
+# VINA is the Vina executable (default: vina in the PATH), e.g. with Cygwin
+#   VINA=C:/cygwin64/home/vina/vina vina_screen_local.sh
 
-for f in ZINC *.pdbqt; do
-    b=`basename $f .pdbqt`
-    echo Processing ligand $b
-    mkdir -p $b
-    C:/cygwin64/home/vina/vina --config conf.txt --ligand $f --out ${b}/out.pdbqt --log ${b}/log.txt
-done
\ No newline at end of file
+VINA=${VINA:-vina}
+
+exec python "$(dirname "$0")/vina_screen.py" --config conf.txt --vina "$VINA" "$@"